@@ -1,10 +1,14 @@
-import csv
 import logging
 import ntpath
 import os.path
 
 from .exceptions import AddError
-from .helpers import get_tracked_sheets, set_logging, validate_axle_project
+from .helpers import (
+    get_tracked_sheets,
+    set_logging,
+    update_tracked_sheets,
+    validate_axle_project,
+)
 
 
 def add(path, title=None, freeze_row=0, freeze_column=0, verbose=False):
@@ -13,13 +17,14 @@ def add(path, title=None, freeze_row=0, freeze_column=0, verbose=False):
     set_logging(verbose)
     axle_dir = validate_axle_project()
     sheets = get_tracked_sheets(axle_dir)
+    add_sheets(sheets, path, title=title, freeze_row=freeze_row, freeze_column=freeze_column)
+    update_tracked_sheets(axle_dir, [dict(details, Title=t) for t, details in sheets.items()])
 
-    if not title:
-        # Create the sheet title from file basename
-        title = ntpath.basename(path).split(".")[0]
-    if title in sheets:
-        raise AddError(f"'{title}' sheet already exists in this project")
 
+def add_sheets(sheets, path, title=None, freeze_row=0, freeze_column=0, path_to_title=None):
+    """Add a table, or the tables in a directory, to a dict of sheet title -> details. If
+    path_to_title (a dict of the paths of the sheets -> sheet title) is provided, it is updated
+    instead of being built from the sheets. Return the titles of the new sheets."""
     # Check if provided path is a directory
     new_paths = []
     if os.path.isdir(path):
@@ -31,39 +36,39 @@ def add(path, title=None, freeze_row=0, freeze_column=0, verbose=False):
     else:
         if not path.endswith(".tsv") and not path.endswith(".csv"):
             raise AddError(f"File '{path}' must be a TSV or CSV table")
+        if not title:
+            # Create the sheet title from file basename
+            title = ntpath.basename(path).split(".")[0]
+        if title in sheets:
+            raise AddError(f"'{title}' sheet already exists in this project")
         new_paths.append(path)
 
     if not new_paths:
         raise AddError(f"No TSV or CSV tables exist in directory '{path}'")
 
-    paths = {x["Path"]: t for t, x in sheets.items()}
-    with open(f"{axle_dir}/sheet.tsv", "a") as f:
-        writer = csv.DictWriter(
-            f,
-            delimiter="\t",
-            lineterminator="\n",
-            fieldnames=["Title", "Path", "Frozen Rows", "Frozen Columns"],
-        )
-        for p in new_paths:
-            if p in paths:
-                other_title = paths[path]
-                raise AddError(f"Local table {path} already exists as '{other_title}'")
+    if path_to_title is None:
+        path_to_title = {x["Path"]: t for t, x in sheets.items()}
+    # Check all tables before any are added
+    added = {}
+    for p in new_paths:
+        if p in path_to_title:
+            other_title = path_to_title[p]
+            raise AddError(f"Local table {p} already exists as '{other_title}'")
 
-            if not title:
-                cur_title = os.path.splitext(os.path.basename(p))[0]
-                if cur_title in paths.keys():
-                    raise AddError("Local table '{cur_title}' already exists")
-            else:
-                cur_title = title
+        if not title:
+            cur_title = os.path.splitext(os.path.basename(p))[0]
+            if cur_title in sheets or cur_title in added:
+                raise AddError(f"'{cur_title}' sheet already exists in this project")
+        else:
+            cur_title = title
+        added[cur_title] = p
 
-            # Finally, add this TSV to sheet.tsv
-            writer.writerow(
-                {
-                    "Title": cur_title,
-                    "Path": p,
-                    "Frozen Rows": freeze_row,
-                    "Frozen Columns": freeze_column,
-                }
-            )
-
-            logging.info(f"{cur_title} successfully added to project")
+    for cur_title, p in added.items():
+        sheets[cur_title] = {
+            "Path": p,
+            "Frozen Rows": freeze_row,
+            "Frozen Columns": freeze_column,
+        }
+        path_to_title[p] = cur_title
+        logging.info(f"{cur_title} successfully added to project")
+    return list(added.keys())
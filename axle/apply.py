@@ -1,180 +1,375 @@
 import csv
+import io
 import logging
 import os
+import re
+import tempfile
+import xml.etree.ElementTree as ET
+import zipfile
 
+from openpyxl import Workbook
 from .exceptions import ApplyError
 from .helpers import (
+    a1_range_to_rowcols,
+    a1_to_rowcol,
+    col_to_a1,
+    get_compression,
+    get_config,
+    get_entries_hash,
+    get_file_state,
+    get_format_dict,
+    get_format_hash,
+    get_manifest,
+    get_shard_locations,
+    get_shard_titles,
     get_tracked_sheets,
     get_sheet_formats,
     get_sheet_notes,
     set_logging,
     update_formats,
+    update_manifest,
     update_notes,
     validate_axle_project,
 )
+from .profile import count, span
+from .push import apply_format_id
+from .xlsx import patch_sheets, read_package
 
 MESSAGE_HEADERS = ["table", "cell", "level", "rule id", "rule", "message", "suggestion"]
 
+# Message level -> format ID (see DEFAULT_FORMATS in init.py), in order of precedence
+LEVEL_FORMATS = {"error": 1, "warn": 2, "info": 3}
 
-def apply(paths, verbose=False):
+# Notes that were added by apply start with the message level
+APPLIED_NOTE = re.compile(r"^(ERROR|WARN|INFO)(:|\n|$)")
+
+
+def apply(paths, write_xlsx=False, verbose=False):
+    """Apply one or more message tables to the sheets as formats and notes. Each table is read one
+    row at a time. If write_xlsx, the changed cells are also updated in the spreadsheet. Return a
+    dict of sheet title -> level -> number of messages applied."""
     set_logging(verbose)
     axle_dir = validate_axle_project()
 
     # TODO: support data validation tables
-    message_tables = []
-    for p in paths:
-        if p.endswith("csv"):
-            sep = ","
-        else:
-            sep = "\t"
-        with open(p, "r") as f:
-            # Get headers and rows
-            reader = csv.DictReader(f, delimiter=sep)
-            headers = [x.lower() for x in reader.fieldnames]
-            rows = []
-            for r in reader:
-                rows.append({k.lower(): v for k, v in r.items()})
-
-            for h in headers:
-                if h.lower() not in MESSAGE_HEADERS:
-                    raise ApplyError(f"The headers in table {p} are not valid for apply")
-            message_tables.append(rows)
-
-    apply_messages(axle_dir, message_tables)
-
-
-def apply_messages(axle_dir, message_tables):
-    """Apply one or more message tables (from dict reader) to the sheets as formats and notes."""
-    tracked_sheets = get_tracked_sheets(axle_dir)
-    sheet_to_formats = get_sheet_formats(axle_dir)
-
-    # Remove any formats that are "applied" (format ID 0, 1, or 2)
-    sheet_to_manual_formats = {}
-    for sheet_title, cell_to_formats in sheet_to_formats.items():
-        manual_formats = {}
-        for cell, fmt in cell_to_formats.items():
-            if int(fmt) > 2:
-                manual_formats[cell] = fmt
-            sheet_to_manual_formats[sheet_title] = manual_formats
-    sheet_to_formats = sheet_to_manual_formats
+    return apply_messages(axle_dir, [iter_messages(p) for p in paths], write_xlsx=write_xlsx)
+
+
+def iter_messages(path):
+    """Yield each row of a message table as a dict with lowercase headers."""
+    if path.endswith("csv"):
+        sep = ","
+    else:
+        sep = "\t"
+    with open(path, "r") as f:
+        reader = csv.reader(f, delimiter=sep)
+        headers = [x.lower() for x in next(reader, [])]
+        for h in headers:
+            if h not in MESSAGE_HEADERS:
+                raise ApplyError(f"The headers in table {path} are not valid for apply")
+        for row in reader:
+            yield dict(zip(headers, row))
+
+
+def apply_messages(axle_dir, message_tables, write_xlsx=False):
+    """Apply one or more message tables (iterables of rows as dicts) to the sheets as formats and
+    notes. Rows are processed one at a time and are not kept, and repeated messages for the same
+    table, cell, and level are skipped. The format of a cell is set by its most severe message
+    (error > warn > info), and the note of a cell is the first message for it. If write_xlsx, the
+    changed cells are also updated in the spreadsheet. Return a dict of sheet title -> level ->
+    number of messages applied."""
+    with span("read state"):
+        tracked_sheets = get_tracked_sheets(axle_dir)
+        sheet_to_formats = get_sheet_formats(axle_dir)
+        sheet_to_notes = get_sheet_notes(axle_dir)
+    if write_xlsx:
+        # Keep the current formats & notes to find the cells that change
+        old_formats = {k: dict(v) for k, v in sheet_to_formats.items()}
+        old_notes = {k: dict(v) for k, v in sheet_to_notes.items()}
+
+    counts = apply_to_sheets(tracked_sheets, sheet_to_formats, sheet_to_notes, message_tables)
+    with span("write state"):
+        # Update formats & notes TSVs
+        update_notes(axle_dir, sheet_to_notes)
+        update_formats(axle_dir, sheet_to_formats)
+    if write_xlsx:
+        with span("patch xlsx"):
+            patch_spreadsheet(axle_dir, old_formats, sheet_to_formats, old_notes, sheet_to_notes)
+    return counts
+
+
+def apply_to_sheets(tracked_sheets, sheet_to_formats, sheet_to_notes, message_tables):
+    """Apply one or more message tables to dicts of sheet title -> cell -> format ID and sheet
+    title -> cell -> note, replacing the formats and notes from earlier messages (see
+    apply_messages). Return a dict of sheet title -> level -> number of messages applied."""
+    # Remove any formats that are "applied" (format ID 1, 2, or 3)
+    for cell_to_formats in sheet_to_formats.values():
+        for cell in [c for c, fmt in cell_to_formats.items() if int(fmt) <= 3]:
+            del cell_to_formats[cell]
 
     # Remove any notes that are "applied" (starts with ERROR, WARN, or INFO)
-    sheet_to_notes = get_sheet_notes(axle_dir)
-    sheet_to_manual_notes = {}
-    for sheet_title, cell_to_notes in sheet_to_notes.items():
-        manual_notes = {}
-        for cell, note in cell_to_notes.items():
-            if (
-                not note.startswith("ERROR: ")
-                and not note.startswith("WARN: ")
-                and not note.startswith("INFO: ")
-            ):
-                manual_notes[cell] = note
-        sheet_to_manual_notes[sheet_title] = manual_notes
-    sheet_to_notes = sheet_to_manual_notes
-
-    # Read the message table to get the formats & notes to add
-    for message_table in message_tables:
-        for row in message_table:
-            # Check for cell location - skip if none
-            cell = row.get("cell")
-            if not cell or cell.strip() == "":
-                continue
-            cell = cell.upper()
-
-            table = os.path.splitext(os.path.basename(row["table"]))[0]
-            if table not in tracked_sheets:
-                logging.warning(f"'{table}' is not a tracked sheet")
-                continue
-
-            if table in sheet_to_formats:
-                cell_to_formats = sheet_to_formats[table]
-            else:
-                cell_to_formats = {}
-
-            if table in sheet_to_notes:
-                cell_to_notes = sheet_to_notes[table]
-            else:
-                cell_to_notes = {}
-
-            # Check for current applied formats and/or notes
-            current_fmt = -1
-            current_note_author = None
-            current_note_text = None
-            if cell in cell_to_formats and int(cell_to_formats[cell]) <= 3:
-                current_fmt = cell_to_formats[cell]
-            if cell in cell_to_notes:
-                current_note_text = cell_to_notes[cell].get("text")
-                current_note_author = cell_to_notes[cell].get("author")
-                if (
-                    not current_note_text.startswith("ERROR")
-                    and not current_note_text.startswith("WARN")
-                    and not current_note_text.startswith("INFO")
+    for cell_to_notes in sheet_to_notes.values():
+        for cell in [c for c, n in cell_to_notes.items() if APPLIED_NOTE.match(n["text"] or "")]:
+            del cell_to_notes[cell]
+
+    # Sheet title -> cell -> levels of messages applied to the cell
+    sheet_to_levels = {}
+    # Sheet title -> level -> number of messages applied
+    counts = {}
+    repeated = 0
+    untracked = set()
+    with span("read messages"):
+        for message_table in message_tables:
+            for row in message_table:
+                # Check for cell location - skip if none
+                cell = row.get("cell")
+                if not cell or cell.strip() == "":
+                    continue
+                cell = cell.upper()
+
+                table = os.path.splitext(os.path.basename(row.get("table") or ""))[0]
+                if table not in tracked_sheets:
+                    if table not in untracked:
+                        logging.warning(f"'{table}' is not a tracked sheet")
+                        untracked.add(table)
+                    continue
+
+                level = (row.get("level") or "error").lower().strip()
+                if level == "warning":
+                    level = "warn"
+
+                # Skip repeated messages
+                cell_to_levels = sheet_to_levels.setdefault(table, {})
+                levels = cell_to_levels.get(cell, ())
+                if level in levels:
+                    repeated += 1
+                    continue
+                cell_to_levels[cell] = levels + (level,)
+                level_counts = counts.setdefault(table, {})
+                level_counts[level] = level_counts.get(level, 0) + 1
+
+                # Set formatting based on level of issue, unless the cell already has a message
+                # with a higher level
+                cell_to_formats = sheet_to_formats.setdefault(table, {})
+                fmt_id = LEVEL_FORMATS.get(level)
+                current_fmt = cell_to_formats.get(cell)
+                if fmt_id and (
+                    current_fmt is None or int(current_fmt) > 3 or fmt_id <= int(current_fmt)
                 ):
-                    # Not an applied note
-                    current_note_text = None
-                    current_note_author = None
-
-            # Set formatting based on level of issue
-            if "level" in row:
-                level = row["level"].lower().strip()
-            else:
-                level = "error"
-            if level == "error":
-                cell_to_formats[cell] = 1
-            elif level == "warn" or level == "warning":
-                level = "warn"
-                if current_fmt != 1:
-                    cell_to_formats[cell] = 2
-            elif level == "info":
-                if current_fmt != 1 and current_fmt != 2:
-                    cell_to_formats[cell] = 3
-
-            message = None
-            if "message" in row:
-                message = row["message"]
-                if message == "":
-                    message = None
-
-            suggest = None
-            if "suggestion" in row:
-                suggest = row["suggestion"]
-                if suggest == "":
-                    suggest = None
-
-            rule_id = None
-            if "rule id" in row:
-                rule_id = row["rule id"]
-
-            # Add the note
-            rule_name = None
-            if "rule" in row:
-                rule_name = row["rule"]
-                logging.info(f'Adding "{rule_name}" to {cell} as a(n) {level}')
-            else:
-                logging.info(f"Adding message to {cell} as a(n) {level}")
-
-            # Format the note
-            if rule_name:
-                note = f"{level.upper()}: {rule_name}"
-            else:
-                note = level.upper()
-            if message:
-                note += f"\n{message}"
-            if suggest:
-                note += f'\nSuggested Fix: "{suggest}"'
-            if rule_id:
-                note += f"\nFor more details, see {rule_id}"
-
-            # Add to dict
-            if current_note_text:
-                cell_to_notes[cell] = {"text": current_note_text, "author": current_note_author}
-            else:
-                cell_to_notes[cell] = {"text": note, "author": ""}
-
-            sheet_to_formats[table] = cell_to_formats
-            sheet_to_notes[table] = cell_to_notes
-
-    # Update formats & notes TSVs
-    update_notes(axle_dir, sheet_to_notes)
-    update_formats(axle_dir, sheet_to_formats)
+                    cell_to_formats[cell] = fmt_id
+
+                # Add the note, unless the cell already has a message
+                cell_to_notes = sheet_to_notes.setdefault(table, {})
+                current_note = cell_to_notes.get(cell)
+                if current_note and APPLIED_NOTE.match(current_note["text"] or ""):
+                    continue
+                cell_to_notes[cell] = {"text": get_note(level, row), "author": ""}
+
+    for table, level_counts in counts.items():
+        summary = ", ".join(f"{n} {level}" for level, n in level_counts.items())
+        logging.info(f"Applied to '{table}': {summary}")
+    if repeated:
+        logging.info(f"Skipped {repeated} repeated message(s)")
+    count("messages", sum(sum(c.values()) for c in counts.values()))
+    count("repeated messages", repeated)
+    return counts
+
+
+def get_applied_cells(cell_to_format):
+    """Return a set of (row, column) for the cells with applied formats (format ID 1, 2, or 3)."""
+    cells = set()
+    for label, fmt_id in cell_to_format.items():
+        if int(fmt_id) > 3:
+            continue
+        rowcols = a1_range_to_rowcols(label)
+        if not rowcols:
+            continue
+        first_row, first_col, last_row, last_col = rowcols
+        for row in range(first_row, last_row + 1):
+            for col in range(first_col, last_col + 1):
+                cells.add((row, col))
+    return cells
+
+
+def get_cell_formats(cell_to_format, cells):
+    """Return a dict of (row, column) -> format ID (or None) for the given cells from a dict of cell
+    or range of cells -> format ID. Where entries overlap, the later entry is used, as in push."""
+    row_to_cols = {}
+    for row, col in cells:
+        row_to_cols.setdefault(row, []).append(col)
+    cell_formats = dict.fromkeys(cells)
+    for label, fmt_id in cell_to_format.items():
+        rowcols = a1_range_to_rowcols(label)
+        if not rowcols:
+            continue
+        first_row, first_col, last_row, last_col = rowcols
+        if first_row == last_row and first_col == last_col:
+            if (first_row, first_col) in cell_formats:
+                cell_formats[(first_row, first_col)] = fmt_id
+            continue
+        if last_row - first_row < len(row_to_cols):
+            rows = [r for r in range(first_row, last_row + 1) if r in row_to_cols]
+        else:
+            rows = [r for r in row_to_cols if first_row <= r <= last_row]
+        for row in rows:
+            for col in row_to_cols[row]:
+                if first_col <= col <= last_col:
+                    cell_formats[(row, col)] = fmt_id
+    return cell_formats
+
+
+def get_format_styles(fmt_ids, id_to_format):
+    """Return the stylesheet of a workbook with one cell for each format, and a dict of format ID
+    -> the index of its cell style in that stylesheet."""
+    wb = Workbook()
+    sheet = wb.active
+    style_cache = {}
+    fmt_styles = {}
+    for row, fmt_id in enumerate(sorted(fmt_ids), start=1):
+        cell = sheet.cell(row=row, column=1)
+        apply_format_id(cell, fmt_id, id_to_format, style_cache)
+        fmt_styles[fmt_id] = cell.style_id
+    buffer = io.BytesIO()
+    wb.save(buffer)
+    with zipfile.ZipFile(buffer) as zf:
+        return ET.fromstring(zf.read("xl/styles.xml")), fmt_styles
+
+
+def get_shard_patches(shard_titles, shard_rows, cell_styles, notes):
+    """Return a dict of sheet title -> (cell styles, notes) for the sheets that a table was pushed
+    to (see get_shard_titles), from the cell styles and notes to patch in the table. The cells of
+    the header are patched in every shard."""
+    shards = len(shard_titles)
+    if shards == 1:
+        return {shard_titles[0]: (cell_styles, notes)}
+    shard_styles = [{} for _ in shard_titles]
+    for (row, col), style in cell_styles.items():
+        for shard, shard_row in get_shard_locations(row, shard_rows, shards):
+            shard_styles[shard - 1][(shard_row, col)] = style
+    shard_notes = [None] * shards
+    if notes is not None:
+        shard_notes = [{} for _ in shard_titles]
+        for cell, note in notes.items():
+            row, col = a1_to_rowcol(cell)
+            for shard, shard_row in get_shard_locations(row, shard_rows, shards):
+                shard_notes[shard - 1][col_to_a1(col) + str(shard_row)] = note
+    return {
+        title: (shard_styles[i], shard_notes[i])
+        for i, title in enumerate(shard_titles)
+        if shard_styles[i] or shard_notes[i] is not None
+    }
+
+
+def patch_spreadsheet(axle_dir, old_formats, new_formats, old_notes, new_notes):
+    """Update the styles and notes of the cells changed by apply in the spreadsheet, without
+    rebuilding any sheets. Sheets without applied formats or notes (before or after) are not
+    changed. If the spreadsheet and a sheet's formats have not changed since the last push, only
+    the cells whose format changed are patched, and the manifest is updated so that the next push
+    does not rebuild the sheet. Otherwise, all cells with applied formats are patched. Hyperlinks
+    are not changed."""
+    config = get_config(axle_dir)
+    spreadsheet_path = config["Spreadsheet Path"]
+    compression = get_compression(config)
+    if not os.path.exists(spreadsheet_path):
+        raise ApplyError(f"Unable to write to {spreadsheet_path} (run `axle push` first)")
+    id_to_format = get_format_dict(axle_dir)
+    manifest = get_manifest(axle_dir)
+    previous = manifest.get("Spreadsheet")
+    pushed = {}
+    if previous and get_file_state(spreadsheet_path, previous) == previous:
+        pushed = {x["Title"]: x for x in manifest.get("Sheets", [])}
+    with zipfile.ZipFile(spreadsheet_path) as zf:
+        xlsx_titles = read_package(zf)["sheets"].keys()
+
+    sheet_patches = {}
+    # Sheet title -> new format & note hashes, for the sheets that match the last push
+    sheet_hashes = {}
+    fmt_ids = set()
+    sheet_titles = new_formats.keys() | old_formats.keys() | new_notes.keys() | old_notes.keys()
+    for sheet_title in sheet_titles:
+        old_cell_formats = old_formats.get(sheet_title, {})
+        new_cell_formats = new_formats.get(sheet_title, {})
+        old_cell_notes = old_notes.get(sheet_title, {})
+        new_cell_notes = new_notes.get(sheet_title, {})
+        cells = get_applied_cells(old_cell_formats) | get_applied_cells(new_cell_formats)
+        noted = any(
+            APPLIED_NOTE.match(n["text"] or "")
+            for n in list(old_cell_notes.values()) + list(new_cell_notes.values())
+        )
+        if not cells and not noted:
+            continue
+        # Tables split into shards are patched in the sheet of each shard, as of the last push
+        state = pushed.get(sheet_title, {})
+        shard_titles = get_shard_titles(sheet_title, state.get("Shards"))
+        if not all(title in xlsx_titles for title in shard_titles):
+            logging.warning(f"'{sheet_title}' is not in {spreadsheet_path} (run `axle push`)")
+            continue
+
+        formats_pushed = state.get("Format Hash") == get_format_hash(old_cell_formats, id_to_format)
+        notes_pushed = state.get("Note Hash") == get_entries_hash(old_cell_notes)
+        old_cell_to_format = get_cell_formats(old_cell_formats, cells)
+        cell_styles = {
+            rowcol: fmt_id
+            for rowcol, fmt_id in get_cell_formats(new_cell_formats, cells).items()
+            if not formats_pushed or fmt_id != old_cell_to_format[rowcol]
+        }
+        notes = None
+        if not notes_pushed or new_cell_notes != old_cell_notes:
+            notes = new_cell_notes
+        if formats_pushed and notes_pushed:
+            sheet_hashes[sheet_title] = (
+                get_format_hash(new_cell_formats, id_to_format),
+                get_entries_hash(new_cell_notes),
+            )
+        if cell_styles or notes is not None:
+            sheet_patches.update(
+                get_shard_patches(shard_titles, state.get("Shard Rows"), cell_styles, notes)
+            )
+            fmt_ids.update(fmt_id for fmt_id in cell_styles.values() if fmt_id is not None)
+
+    if not sheet_patches:
+        logging.info(f"{spreadsheet_path} is already up to date")
+        return
+
+    styles_root, fmt_styles = get_format_styles(fmt_ids, id_to_format)
+    for cell_styles, _ in sheet_patches.values():
+        count("styled cells", len(cell_styles))
+        for rowcol, fmt_id in cell_styles.items():
+            if fmt_id is not None:
+                cell_styles[rowcol] = fmt_styles[fmt_id]
+    count("distinct formats", len(fmt_ids))
+    # Write to a temporary directory next to the spreadsheet so it can be replaced in one step
+    spreadsheet_dir = os.path.dirname(os.path.abspath(spreadsheet_path))
+    with tempfile.TemporaryDirectory(dir=spreadsheet_dir) as tmp:
+        out_path = os.path.join(tmp, "out.xlsx")
+        with span("save zip"):
+            patch_sheets(out_path, spreadsheet_path, styles_root, sheet_patches, compression)
+            os.replace(out_path, spreadsheet_path)
+    logging.info(f"updated {len(sheet_patches)} sheet(s) in {spreadsheet_path}")
+
+    # Record the patched sheets as pushed, if the spreadsheet was up to date before
+    if pushed:
+        for sheet_title, (format_hash, note_hash) in sheet_hashes.items():
+            pushed[sheet_title]["Format Hash"] = format_hash
+            pushed[sheet_title]["Note Hash"] = note_hash
+        manifest["Spreadsheet"] = get_file_state(spreadsheet_path)
+        update_manifest(axle_dir, manifest)
+
+
+def get_note(level, row):
+    """Return the text of a note for a message."""
+    rule_name = row.get("rule")
+    if rule_name:
+        note = f"{level.upper()}: {rule_name}"
+    else:
+        note = level.upper()
+    message = row.get("message")
+    if message:
+        note += f"\n{message}"
+    suggest = row.get("suggestion")
+    if suggest:
+        note += f'\nSuggested Fix: "{suggest}"'
+    rule_id = row.get("rule id")
+    if rule_id:
+        note += f"\nFor more details, see {rule_id}"
+    return note
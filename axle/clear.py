@@ -1,33 +1,97 @@
 import logging
 
+from . import database
 from .exceptions import ClearError
-from .helpers import get_tracked_sheets, get_sheet_notes, get_sheet_formats, set_logging, update_notes, update_formats, validate_axle_project
+from .helpers import (
+    a1_range_to_rowcols,
+    a1_to_rowcol,
+    col_to_a1,
+    get_state_db,
+    get_tracked_sheets,
+    get_sheet_notes,
+    get_sheet_formats,
+    rowcols_to_a1_range,
+    set_logging,
+    subtract_range,
+    update_notes,
+    update_formats,
+    validate_axle_project,
+)
+from .profile import span
 
 
-def clear_formats(axle_dir, sheet_title):
-    """Remove all formats from a sheet."""
-    sheet_formats = get_sheet_formats(axle_dir)
-    if sheet_title in sheet_formats:
+def clear_area_formats(axle_dir, sheet_titles, area):
+    """Remove the formats in an area from sheets in the state database, reading and deleting only
+    the formats that overlap the area. Ranges that are partly in the area are split, and the parts
+    take the place of the range, so all the formats of those sheets are read and replaced."""
+    sheet_formats = get_sheet_formats(axle_dir, sheet_titles=sheet_titles, area=area)
+    removed = {}
+    split = []
+    for st, cell_to_format in sheet_formats.items():
+        if any(subtract_range(a1_range_to_rowcols(cell), area) for cell in cell_to_format):
+            split.append(st)
+            continue
+        logging.info(f"removing formats in {get_area_label(area)} from '{st}'")
+        removed[st] = [(cell,) + a1_range_to_rowcols(cell) for cell in cell_to_format]
+    database.remove_formats(get_state_db(axle_dir), removed)
+    if split:
+        sheet_formats = get_sheet_formats(axle_dir, sheet_titles=split)
+        for st in split:
+            sheet_formats[st] = clear_formats(st, sheet_formats[st], area=area)
+        update_formats(axle_dir, sheet_formats, sheet_titles=split)
+
+
+def clear_area_notes(axle_dir, sheet_titles, area):
+    """Remove the notes in an area from sheets in the state database, reading and deleting only
+    those notes."""
+    sheet_notes = get_sheet_notes(axle_dir, sheet_titles=sheet_titles, area=area)
+    removed = {}
+    for st, cell_to_note in sheet_notes.items():
+        logging.info(f"removing notes in {get_area_label(area)} from '{st}'")
+        removed[st] = [(cell,) + a1_to_rowcol(cell) for cell in cell_to_note]
+    database.remove_notes(get_state_db(axle_dir), removed)
+
+
+def clear_formats(sheet_title, cell_to_format, area=None):
+    """Remove the formats from a sheet that are in an area (or all formats, if there is no area).
+    Ranges of formats that are partly in the area are split. Return the remaining formats."""
+    if not cell_to_format:
+        return {}
+    if not area:
         logging.info(f"removing all formats from '{sheet_title}'")
-        del sheet_formats[sheet_title]
-    update_formats(axle_dir, sheet_formats)
+        return {}
+    logging.info(f"removing formats in {get_area_label(area)} from '{sheet_title}'")
+    remaining = {}
+    for cell, fmt in cell_to_format.items():
+        rowcols = a1_range_to_rowcols(cell)
+        if not rowcols:
+            remaining[cell] = fmt
+            continue
+        for part in subtract_range(rowcols, area):
+            remaining[rowcols_to_a1_range(*part)] = fmt
+    return remaining
 
 
-def clear_notes(axle_dir, sheet_title):
-    """Remove all notes from a sheet."""
-    sheet_notes = get_sheet_notes(axle_dir)
-    if sheet_title in sheet_notes:
+def clear_notes(sheet_title, cell_to_note, area=None):
+    """Remove the notes from a sheet that are in an area (or all notes, if there is no area).
+    Return the remaining notes."""
+    if not cell_to_note:
+        return {}
+    if not area:
         logging.info(f"removing all notes from '{sheet_title}'")
-        del sheet_notes[sheet_title]
-    update_notes(axle_dir, sheet_notes)
-
+        return {}
+    logging.info(f"removing notes in {get_area_label(area)} from '{sheet_title}'")
+    remaining = {}
+    for cell, note in cell_to_note.items():
+        rowcol = a1_to_rowcol(cell)
+        if not rowcol or subtract_range(rowcol + rowcol, area):
+            remaining[cell] = note
+    return remaining
 
-def clear(keyword, on_sheets=None, verbose=False):
-    """Remove formats and/or notes from one or more sheets."""
-    set_logging(verbose)
-    axle_dir = validate_axle_project()
 
-    tracked_sheets = get_tracked_sheets(axle_dir)
+def get_clear_sheets(keyword, tracked_sheets, on_sheets=None):
+    """Check the keyword and sheet titles to clear and return the titles of the sheets to clear
+    (all tracked sheets, if on_sheets is not provided)."""
     if not on_sheets:
         # If no sheet was supplied, clear from all
         on_sheets = list(tracked_sheets.keys())
@@ -41,17 +105,95 @@ def clear(keyword, on_sheets=None, verbose=False):
         raise ClearError(
             f"The following sheet(s) are not part of this project: " + ", ".join(untracked)
         )
+    if keyword not in ["formats", "notes", "all"]:
+        raise ClearError("Unknown keyword: " + keyword)
+    return on_sheets
+
+
+def get_area(cell_range=None, rows=None, columns=None):
+    """Return the area to clear as (first row, first column, last row, last column), where a side
+    is None if the area is not bounded on that side, or None to clear whole sheets. The area is in
+    the range of cells (e.g., A1:D500), the rows (e.g., 2:500), and the columns (e.g., A:D)."""
+    if not cell_range and not rows and not columns:
+        return None
+    bounds = []
+    if cell_range:
+        rowcols = a1_range_to_rowcols(cell_range.upper())
+        if not rowcols:
+            raise ClearError(f"Invalid range: {cell_range}")
+        bounds.append(rowcols)
+    if rows:
+        first_row, _, last_row = rows.partition(":")
+        if not first_row.isdigit() or not (last_row or first_row).isdigit():
+            raise ClearError(f"Invalid rows: {rows}")
+        first_row = int(first_row)
+        last_row = int(last_row or first_row)
+        if first_row < 1 or last_row < 1:
+            raise ClearError(f"Invalid rows: {rows}")
+        bounds.append((min(first_row, last_row), None, max(first_row, last_row), None))
+    if columns:
+        first_col, _, last_col = columns.upper().partition(":")
+        first_col = a1_to_rowcol(first_col + "1")
+        last_col = a1_to_rowcol((last_col or columns.upper()) + "1")
+        if not first_col or not last_col or not columns.replace(":", "").isalpha():
+            raise ClearError(f"Invalid columns: {columns}")
+        first_col = first_col[1]
+        last_col = last_col[1]
+        bounds.append((None, min(first_col, last_col), None, max(first_col, last_col)))
+
+    # Only the cells in all of the given ranges, rows, and columns are cleared
+    area = [None, None, None, None]
+    for b in bounds:
+        for i in [0, 1]:
+            if b[i] is not None:
+                area[i] = b[i] if area[i] is None else max(area[i], b[i])
+        for i in [2, 3]:
+            if b[i] is not None:
+                area[i] = b[i] if area[i] is None else min(area[i], b[i])
+    return tuple(area)
+
+
+def get_area_label(area):
+    """Return a label for an area, e.g., A1:D500, 2:500, or A:D."""
+    if None not in area:
+        return rowcols_to_a1_range(*area)
+    first_row, first_col, last_row, last_col = area
+    first = (col_to_a1(first_col) if first_col else "") + (str(first_row) if first_row else "")
+    last = (col_to_a1(last_col) if last_col else "") + (str(last_row) if last_row else "")
+    return f"{first or 'start'}:{last or 'end'}"
+
+
+def clear(keyword, on_sheets=None, cell_range=None, rows=None, columns=None, verbose=False):
+    """Remove formats and/or notes from one or more sheets. The cells to clear can be limited to a
+    range of cells (e.g., A1:D500), rows (e.g., 2:500), and/or columns (e.g., A:D) - if more than
+    one is given, only the cells in all of them are cleared. The formats and notes are read and
+    written once for all sheets. If the project state is stored in a database and there is an area,
+    only the formats and notes in the area are read and deleted."""
+    set_logging(verbose)
+    axle_dir = validate_axle_project()
+
+    on_sheets = get_clear_sheets(keyword, get_tracked_sheets(axle_dir), on_sheets=on_sheets)
+    area = get_area(cell_range=cell_range, rows=rows, columns=columns)
+    db = get_state_db(axle_dir)
+    # format.tsv and note.tsv store all sheets, so they are read and replaced in full
+    sheet_titles = on_sheets if db else None
 
     # TODO: clear data validation once we've added support for it
-    if keyword == "formats":
-        for st in on_sheets:
-            clear_formats(axle_dir, st)
-    elif keyword == "notes":
-        for st in on_sheets:
-            clear_notes(axle_dir, st)
-    elif keyword == "all":
-        for st in on_sheets:
-            clear_formats(axle_dir, st)
-            clear_notes(axle_dir, st)
-    else:
-        raise ClearError("Unknown keyword: " + keyword)
+    if keyword in ["formats", "all"]:
+        with span("clear formats"):
+            if area and db:
+                clear_area_formats(axle_dir, on_sheets, area)
+            else:
+                sheet_formats = get_sheet_formats(axle_dir, sheet_titles=sheet_titles)
+                for st in on_sheets:
+                    sheet_formats[st] = clear_formats(st, sheet_formats.get(st), area=area)
+                update_formats(axle_dir, sheet_formats, sheet_titles=sheet_titles)
+    if keyword in ["notes", "all"]:
+        with span("clear notes"):
+            if area and db:
+                clear_area_notes(axle_dir, on_sheets, area)
+            else:
+                sheet_notes = get_sheet_notes(axle_dir, sheet_titles=sheet_titles)
+                for st in on_sheets:
+                    sheet_notes[st] = clear_notes(st, sheet_notes.get(st), area=area)
+                update_notes(axle_dir, sheet_notes, sheet_titles=sheet_titles)
@@ -3,26 +3,33 @@ import os
 import sys
 
 from argparse import ArgumentParser
-from .add import add
-from .apply import apply
-from .clear import clear
 from .exceptions import AxleError
-from .fetch import fetch
-from .helpers import get_version
-from .init import init
-from .merge import merge
-from .push import push
-from .rm import rm
+from .helpers import (
+    COMPRESSION_LEVELS,
+    ENGINES,
+    get_changed_sheets,
+    get_version,
+    validate_axle_project,
+)
+from .profile import start_profile, write_profile
+from .state import BACKENDS
+
+# Each command is imported when it is run, so that commands that do not read or write the
+# spreadsheet do not need to import openpyxl
 
 add_msg = "Add a table (TSV or CSV) to the project"
 apply_msg = "Apply a table to the spreadsheet"
 clear_msg = "Clear formatting and/or notes from one or more sheets"
+diff_msg = "Show the cells of a table that differ from the spreadsheet"
 fetch_msg = "Update cached copies of tables with sheets from spreadsheet"
 init_msg = "Init a new AXLE project"
 merge_msg = "Update tracked tables with cached copies of sheets"
 pull_msg = "Update tracked tables with sheets from spreadsheet"
 push_msg = "Update spreadsheet with tracked table contents"
 rm_msg = "Remove a table from the project"
+state_msg = "Change how the project state is stored (TSV files or SQLite)"
+status_msg = "Show what has changed since the last push"
+watch_msg = "Sync the tables and the spreadsheet whenever they change"
 
 
 def usage():
@@ -31,6 +38,7 @@ commands:
   add      {add_msg}
   apply    {apply_msg}
   clear    {clear_msg}
+  diff     {diff_msg}
   fetch    {fetch_msg}
   help     Print this message
   init     {init_msg}
@@ -38,13 +46,19 @@ commands:
   pull     {pull_msg}
   push     {push_msg}
   rm       {rm_msg}
-  version  Print the AXLE version"""
+  state    {state_msg}
+  status   {status_msg}
+  version  Print the AXLE version
+  watch    {watch_msg}"""
 
 
 def main():
     parser = ArgumentParser(usage=usage())
     global_parser = ArgumentParser(add_help=False)
     global_parser.add_argument("-v", "--verbose", help="Print logging", action="store_true")
+    global_parser.add_argument(
+        "--profile", help="Write a JSON trace of the phases of the command to this path"
+    )
     subparsers = parser.add_subparsers(dest="cmd")
 
     sp = subparsers.add_parser("help", parents=[global_parser])
@@ -67,11 +81,19 @@ def main():
 
     # ------------------------------- apply -------------------------------
     sp = subparsers.add_parser(
-        "apply", parents=[global_parser], description=apply_msg, usage="axle apply [PATH ...]",
+        "apply",
+        parents=[global_parser],
+        description=apply_msg,
+        usage="axle apply [PATH ...] [--write-xlsx]",
     )
     sp.add_argument(
         "paths", nargs="*", default=None, help="Path(s) to table(s) to apply",
     )
+    sp.add_argument(
+        "--write-xlsx",
+        help="Update the changed cells in the spreadsheet without rebuilding its sheets",
+        action="store_true",
+    )
     sp.set_defaults(func=run_apply)
 
     # ------------------------------- clear -------------------------------
@@ -79,17 +101,40 @@ def main():
         "clear",
         parents=[global_parser],
         description=clear_msg,
-        usage="axle clear KEYWORD [-t SHEET ...]",
+        usage="axle clear KEYWORD [-t SHEET ... --range RANGE --rows ROWS --columns COLUMNS]",
     )
     sp.set_defaults(func=run_clear)
     sp.add_argument(
         "keyword", help="Specify what to clear from the sheet(s): format, notes, all"
     )
     sp.add_argument("-t", "--title", help="Title of sheet to clear from", action="append")
+    sp.add_argument("--range", dest="cell_range", help="Only clear a range of cells, e.g., A1:D500")
+    sp.add_argument("--rows", help="Only clear rows, e.g., 2:500")
+    sp.add_argument("--columns", help="Only clear columns, e.g., A:D")
+
+    # ------------------------------- diff -------------------------------
+    sp = subparsers.add_parser(
+        "diff", parents=[global_parser], description=diff_msg, usage="axle diff SHEET",
+    )
+    sp.add_argument("title", help="Title of the sheet to diff")
+    sp.set_defaults(func=run_diff)
 
     # ------------------------------- fetch -------------------------------
     sp = subparsers.add_parser(
-        "fetch", parents=[global_parser], description=pull_msg, usage="axle fetch"
+        "fetch", parents=[global_parser], description=pull_msg, usage="axle fetch [-s -e ENGINE]"
+    )
+    sp.add_argument(
+        "-s",
+        "--streaming",
+        help="Read the spreadsheet one row at a time without loading it into memory",
+        action="store_true",
+    )
+    sp.add_argument(
+        "-e",
+        "--engine",
+        help="Engine used to read the spreadsheet ('fast' parses the worksheets directly)",
+        choices=ENGINES,
+        default="openpyxl",
     )
     sp.set_defaults(func=run_fetch)
 
@@ -98,7 +143,10 @@ def main():
         "init",
         parents=[global_parser],
         description=init_msg,
-        usage="axle init TITLE [-p PATH -d DIRECTORY -f FILE_FORMAT]",
+        usage=(
+            "axle init TITLE [-p PATH -d DIRECTORY -f FILE_FORMAT --state BACKEND "
+            "--compression LEVEL]"
+        ),
     )
     sp.add_argument("title", help="Title of the project")
     sp.add_argument("-p", "--path", help="Optional path for XLSX file")
@@ -106,23 +154,81 @@ def main():
     sp.add_argument(
         "-f", "--file-format", default="tsv", help="Default format for new tables (TSV or CSV)"
     )
+    sp.add_argument(
+        "--state", default="tsv", choices=BACKENDS, help="How to store the project state"
+    )
+    sp.add_argument(
+        "--compression",
+        default="default",
+        choices=COMPRESSION_LEVELS,
+        help="How much to compress the spreadsheet when it is written",
+    )
     sp.set_defaults(func=run_init)
 
     # ------------------------------- merge -------------------------------
     sp = subparsers.add_parser(
-        "merge", parents=[global_parser], description=pull_msg, usage="axle merge"
+        "merge", parents=[global_parser], description=pull_msg, usage="axle merge [-3 -k KEY]"
     )
+    add_merge_arguments(sp)
     sp.set_defaults(func=run_merge)
 
     # ------------------------------- pull -------------------------------
     sp = subparsers.add_parser(
-        "pull", parents=[global_parser], description=pull_msg, usage="axle pull"
+        "pull",
+        parents=[global_parser],
+        description=pull_msg,
+        usage="axle pull [-s -e ENGINE -3 -k KEY]",
+    )
+    add_merge_arguments(sp)
+    sp.add_argument(
+        "-s",
+        "--streaming",
+        help="Read the spreadsheet one row at a time without loading it into memory",
+        action="store_true",
+    )
+    sp.add_argument(
+        "-e",
+        "--engine",
+        help="Engine used to read the spreadsheet ('fast' parses the worksheets directly)",
+        choices=ENGINES,
+        default="openpyxl",
     )
     sp.set_defaults(func=run_pull)
 
     # ------------------------------- push -------------------------------
     sp = subparsers.add_parser(
-        "push", parents=[global_parser], description=push_msg, usage="axle push"
+        "push",
+        parents=[global_parser],
+        description=push_msg,
+        usage="axle push [-s --full -j JOBS --compression LEVEL --typed --shard-rows ROWS]",
+    )
+    sp.add_argument(
+        "-s",
+        "--streaming",
+        help="Write rows straight to the spreadsheet without holding tables in memory",
+        action="store_true",
+    )
+    sp.add_argument(
+        "--full", help="Rebuild every sheet, even if it has not changed", action="store_true"
+    )
+    sp.add_argument(
+        "-j", "--jobs", help="Number of sheets to build in parallel", type=int, default=1
+    )
+    sp.add_argument(
+        "--compression",
+        choices=COMPRESSION_LEVELS,
+        help="How much to compress the spreadsheet (default: the project setting)",
+    )
+    sp.add_argument(
+        "--typed",
+        help="Write columns of numbers and booleans as numbers and booleans instead of text",
+        action="store_const",
+        const=True,
+    )
+    sp.add_argument(
+        "--shard-rows",
+        help="Split tables with more rows than this (after the header) across several sheets",
+        type=int,
     )
     sp.set_defaults(func=run_push)
 
@@ -139,16 +245,88 @@ def main():
     )
     sp.set_defaults(func=run_rm)
 
+    # ------------------------------- state -------------------------------
+    sp = subparsers.add_parser(
+        "state", parents=[global_parser], description=state_msg, usage="axle state BACKEND",
+    )
+    sp.add_argument("backend", help="How to store the project state", choices=BACKENDS)
+    sp.set_defaults(func=run_state)
+
+    # ------------------------------- status -------------------------------
+    sp = subparsers.add_parser(
+        "status", parents=[global_parser], description=status_msg, usage="axle status",
+    )
+    sp.set_defaults(func=run_status)
+
+    # ------------------------------- watch -------------------------------
+    sp = subparsers.add_parser(
+        "watch",
+        parents=[global_parser],
+        description=watch_msg,
+        usage="axle watch [-d DELAY --poll -i INTERVAL -3 -s -e ENGINE]",
+    )
+    sp.add_argument(
+        "-d",
+        "--delay",
+        help="Seconds to wait after the last change before syncing (default: 1)",
+        type=float,
+        default=1.0,
+    )
+    sp.add_argument(
+        "--poll",
+        help="Check the files at an interval instead of using inotify",
+        action="store_true",
+    )
+    sp.add_argument(
+        "-i",
+        "--interval",
+        help="Seconds between checks when polling (default: 1)",
+        type=float,
+        default=1.0,
+    )
+    sp.add_argument(
+        "-s",
+        "--streaming",
+        help="Read and write the spreadsheet one row at a time",
+        action="store_true",
+    )
+    sp.add_argument(
+        "-e", "--engine", help="Engine used to fetch", choices=ENGINES, default="openpyxl"
+    )
+    add_merge_arguments(sp)
+    sp.set_defaults(func=run_watch)
+
     args = parser.parse_args()
     if not hasattr(args, "func"):
         print(usage())
         print("ERROR: a command is required")
         sys.exit(1)
-    args.func(args)
+    if args.profile:
+        start_profile(args.cmd)
+    try:
+        args.func(args)
+    finally:
+        if args.profile:
+            write_profile(args.profile)
+
+
+def add_merge_arguments(sp):
+    """Add the options for merging tables to a subparser."""
+    sp.add_argument(
+        "-3",
+        "--three-way",
+        help="Merge the rows changed in the spreadsheet and in the tables since the last push",
+        action="store_true",
+    )
+    sp.add_argument(
+        "-k", "--key", help="Match rows by the value in this column in a three-way merge",
+    )
 
 
 def run_add(args):
     """Wrapper for add function."""
+    from .add import add
+
     try:
         add(
             args.path,
@@ -164,8 +342,10 @@ def run_add(args):
 
 def run_apply(args):
     """Wrapper for apply function."""
+    from .apply import apply
+
     try:
-        apply(args.paths, verbose=args.verbose)
+        apply(args.paths, write_xlsx=args.write_xlsx, verbose=args.verbose)
     except AxleError as e:
         logging.critical(str(e))
         sys.exit(1)
@@ -173,8 +353,29 @@ def run_apply(args):
 
 def run_clear(args):
     """Wrapper for clear function."""
+    from .clear import clear
+
+    try:
+        clear(
+            args.keyword,
+            on_sheets=args.title,
+            cell_range=args.cell_range,
+            rows=args.rows,
+            columns=args.columns,
+            verbose=args.verbose,
+        )
+    except AxleError as e:
+        logging.critical(str(e))
+        sys.exit(1)
+
+
+def run_diff(args):
+    """Wrapper for diff function."""
+    from .diff import diff
+
     try:
-        clear(args.keyword, on_sheets=args.title, verbose=args.verbose)
+        for line in diff(args.title, verbose=args.verbose):
+            print(line)
     except AxleError as e:
         logging.critical(str(e))
         sys.exit(1)
@@ -182,8 +383,10 @@ def run_clear(args):
 
 def run_fetch(args):
     """Wrapper for fetch function."""
+    from .fetch import fetch
+
     try:
-        fetch(args.verbose)
+        fetch(streaming=args.streaming, engine=args.engine, verbose=args.verbose)
     except AxleError as e:
         logging.critical(str(e))
         sys.exit(1)
@@ -196,12 +399,16 @@ def run_help(args):
 
 def run_init(args):
     """Wrapper for init function."""
+    from .init import init
+
     try:
         success = init(
             args.title,
             filepath=args.path,
             directory=args.directory,
             file_format=args.file_format,
+            state=args.state,
+            compression=args.compression,
             verbose=args.verbose,
         )
         if not success:
@@ -217,8 +424,10 @@ def run_init(args):
 
 def run_merge(args):
     """Wrapper for merge function."""
+    from .merge import merge
+
     try:
-        merge(verbose=args.verbose)
+        merge(three_way=args.three_way, key=args.key, verbose=args.verbose)
     except AxleError as e:
         logging.critical(str(e))
         sys.exit(1)
@@ -226,9 +435,15 @@ def run_merge(args):
 
 def run_pull(args):
     """Wrapper for pull function."""
+    from .fetch import fetch
+    from .merge import merge
+
     try:
-        fetch(verbose=args.verbose)
-        merge(verbose=args.verbose)
+        # Only update the tables for sheets that changed in the spreadsheet, in this fetch or in
+        # an earlier fetch that was not merged
+        changed = fetch(streaming=args.streaming, engine=args.engine, verbose=args.verbose)
+        changed = set(changed) | set(get_changed_sheets(validate_axle_project()))
+        merge(on_sheets=changed, three_way=args.three_way, key=args.key, verbose=args.verbose)
     except AxleError as e:
         logging.critical(str(e))
         sys.exit(1)
@@ -236,15 +451,27 @@ def run_pull(args):
 
 def run_push(args):
     """Wrapper for push function."""
+    from .push import push
+
     try:
-        push(verbose=args.verbose)
+        push(
+            streaming=args.streaming,
+            full=args.full,
+            jobs=args.jobs,
+            compression=args.compression,
+            typed=args.typed,
+            shard_rows=args.shard_rows,
+            verbose=args.verbose,
+        )
     except AxleError as e:
         logging.critical(str(e))
         sys.exit(1)
 
 
 def run_rm(args):
-    """Wrapper for push function."""
+    """Wrapper for rm function."""
+    from .rm import rm
+
     try:
         rm(args.titles, keep=args.keep, verbose=args.verbose)
     except AxleError as e:
@@ -252,6 +479,53 @@ def run_rm(args):
         sys.exit(1)
 
 
+def run_state(args):
+    """Wrapper for state function."""
+    from .state import state
+
+    try:
+        state(args.backend, verbose=args.verbose)
+    except AxleError as e:
+        logging.critical(str(e))
+        sys.exit(1)
+
+
+def run_status(args):
+    """Wrapper for status function."""
+    from .status import status
+
+    try:
+        result = status(verbose=args.verbose)
+    except AxleError as e:
+        logging.critical(str(e))
+        sys.exit(1)
+    print(f"Spreadsheet: {result['Spreadsheet']}")
+    for sheet_title, changes in result["Sheets"].items():
+        print(f"  {sheet_title}: {', '.join(changes) or 'up to date'}")
+
+
+def run_watch(args):
+    """Wrapper for watch function."""
+    from .watch import watch
+
+    try:
+        watch(
+            delay=args.delay,
+            interval=args.interval,
+            polling=args.poll,
+            three_way=args.three_way,
+            key=args.key,
+            streaming=args.streaming,
+            engine=args.engine,
+            verbose=args.verbose,
+        )
+    except AxleError as e:
+        logging.critical(str(e))
+        sys.exit(1)
+    except KeyboardInterrupt:
+        pass
+
+
 def version(args):
     """Print AXLE version information."""
     v = get_version()
@@ -0,0 +1,158 @@
+"""Access to the private parts of zipfile and openpyxl that AXLE uses to read and write spreadsheets
+faster. These are only used here (and by the writers in xlsx.py that extend the openpyxl writers),
+and each is checked before it is used: if it is missing, e.g., in a newer version than those in
+requirements.txt and setup.py, the public API is used instead, which is slower but gives the same
+spreadsheet."""
+import struct
+import time
+import zipfile
+
+from copy import copy
+from openpyxl.writer.excel import ExcelWriter
+from .exceptions import AxleError
+
+try:
+    from openpyxl.cell._writer import write_cell
+    from openpyxl.worksheet._write_only import WriteOnlyWorksheet
+    from openpyxl.worksheet._writer import WorksheetWriter
+except ImportError:
+    # The writers that extend these are not used (see HAS_WRITERS)
+    write_cell = None
+    WriteOnlyWorksheet = None
+    WorksheetWriter = object
+
+# Size of the chunks used to stream large parts
+CHUNK_SIZE = 1024 * 1024
+
+# Whether the openpyxl writers can be extended to stream worksheets into the package, keep their
+# dimensions, and write shared strings (see StreamingExcelWriter and use_worksheet_writer)
+HAS_WRITERS = (
+    write_cell is not None
+    and all(hasattr(WorksheetWriter, x) for x in ["write_row", "write_top", "write", "close"])
+    and all(hasattr(ExcelWriter, x) for x in ["write_data", "write_worksheet"])
+    and hasattr(WriteOnlyWorksheet, "_writer")
+)
+
+# Parts of a ZipFile that are needed to add compressed data to it as-is (see copy_raw)
+RAW_ZIP_ATTRS = ["fp", "filelist", "NameToInfo", "start_dir", "_writecheck"]
+HAS_RAW_ZIP = hasattr(zipfile, "sizeFileHeader") and hasattr(zipfile.ZipInfo, "FileHeader")
+
+# Attributes of the style of an openpyxl cell, for when its style array is not available
+STYLE_ATTRS = ["font", "fill", "border", "alignment", "protection", "number_format"]
+
+
+def copy_raw(src_zf, out_zf, name, new_name=None):
+    """Copy a part from one ZIP archive to another without decompressing and recompressing it. If
+    the ZIP archives do not have the private attributes this needs, the part is decompressed and
+    recompressed instead."""
+    info = src_zf.getinfo(name)
+    raw = HAS_RAW_ZIP and hasattr(src_zf, "fp") and all(hasattr(out_zf, x) for x in RAW_ZIP_ATTRS)
+    if not raw:
+        zinfo = zipfile.ZipInfo(new_name or name, date_time=info.date_time)
+        zinfo.compress_type = info.compress_type
+        zinfo.external_attr = info.external_attr
+        with src_zf.open(info) as fr, out_zf.open(zinfo, "w") as fw:
+            while True:
+                chunk = fr.read(CHUNK_SIZE)
+                if not chunk:
+                    break
+                fw.write(chunk)
+        return
+
+    zinfo = zipfile.ZipInfo(new_name or name, date_time=info.date_time)
+    zinfo.compress_type = info.compress_type
+    zinfo.CRC = info.CRC
+    zinfo.compress_size = info.compress_size
+    zinfo.file_size = info.file_size
+    zinfo.external_attr = info.external_attr
+    # The sizes are written to the local header, so there is no data descriptor
+    zinfo.flag_bits = info.flag_bits & ~0x08
+
+    # Find the start of the compressed data after the local file header
+    src_zf.fp.seek(info.header_offset)
+    header = src_zf.fp.read(zipfile.sizeFileHeader)
+    name_length, extra_length = struct.unpack("<HH", header[26:30])
+    src_zf.fp.seek(info.header_offset + zipfile.sizeFileHeader + name_length + extra_length)
+
+    # zipfile has no public API to add compressed data, so write the entry the way ZipFile.write
+    # does and register it so that it is included in the central directory
+    out_zf._writecheck(zinfo)
+    out_zf._didModify = True
+    zinfo.header_offset = out_zf.fp.tell()
+    out_zf.fp.write(zinfo.FileHeader())
+    remaining = info.compress_size
+    while remaining > 0:
+        data = src_zf.fp.read(min(CHUNK_SIZE, remaining))
+        if not data:
+            raise AxleError(f"Unexpected end of data for {name}")
+        out_zf.fp.write(data)
+        remaining -= len(data)
+    out_zf.start_dir = out_zf.fp.tell()
+    out_zf.filelist.append(zinfo)
+    out_zf.NameToInfo[zinfo.filename] = zinfo
+
+
+def get_cell_styles(wb):
+    """Return the style arrays of the cell style records of a workbook, and the indexes of the
+    records for dates and for time deltas."""
+    try:
+        return wb._cell_styles, wb._date_formats, wb._timedelta_formats
+    except AttributeError:
+        raise AxleError(
+            "The cell styles of a workbook cannot be read with this version of openpyxl - use the "
+            "openpyxl engine instead"
+        )
+
+
+def get_worksheet_writer(ws):
+    """Return the openpyxl WorksheetWriter of a write-only worksheet, or None."""
+    return getattr(ws, "_writer", None)
+
+
+def get_style(cell):
+    """Return a copy of the style of an openpyxl cell, to apply to other cells (see set_style)."""
+    if hasattr(cell, "_style"):
+        return copy(cell._style)
+    return {attr: getattr(cell, attr) for attr in STYLE_ATTRS}
+
+
+def get_style_key(cell):
+    """Return a key for the style record of a cell, or None if the cell does not have a style."""
+    if not getattr(cell, "has_style", False):
+        return None
+    # Read-only cells only store the index of their style record
+    style_id = getattr(cell, "_style_id", None)
+    if style_id is not None:
+        return style_id
+    if hasattr(cell, "_style"):
+        return tuple(cell._style)
+    return cell.style_id
+
+
+def new_zip_info(out_zf, name):
+    """Return a ZipInfo for a new part in the output package, compressed like the package. If the
+    compression level of a ZipInfo cannot be set, return the name, so that the ZIP archive sets it
+    when the part is written."""
+    zinfo = zipfile.ZipInfo(name, date_time=time.localtime(time.time())[:6])
+    zinfo.compress_type = out_zf.compression
+    # Set the same way ZipFile.open sets it for new parts that are given by name
+    for attr in ["compress_level", "_compresslevel"]:
+        if attr in zipfile.ZipInfo.__slots__:
+            setattr(zinfo, attr, out_zf.compresslevel)
+            return zinfo
+    return name
+
+
+def set_style(cell, style):
+    """Apply a style from get_style to an openpyxl cell."""
+    if isinstance(style, dict):
+        for attr, value in style.items():
+            setattr(cell, attr, value)
+    else:
+        cell._style = copy(style)
+
+
+def set_worksheet_writer(ws, writer):
+    """Make a write-only worksheet write its rows with the given openpyxl WorksheetWriter."""
+    ws._writer = writer
+    writer.write_top()
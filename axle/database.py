@@ -0,0 +1,299 @@
+"""Store the state of an AXLE project (sheets, formats, and notes) in a single SQLite database
+instead of the TSV and JSON files in the AXLE directory. Formatted and noted cells are stored with
+their row and column numbers (and the last row and column of a range), keyed by sheet, row, and
+column, so that the cells of one sheet or area can be read, and only the cells that changed are
+written."""
+import json
+import sqlite3
+
+from contextlib import closing
+
+DB_NAME = "state.db"
+
+# Stored in the user_version of the database, which is 0 for databases created before it was set
+SCHEMA_VERSION = 2
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS sheet (
+    title TEXT PRIMARY KEY,
+    path TEXT,
+    frozen_rows TEXT,
+    frozen_columns TEXT,
+    shards TEXT
+);
+CREATE TABLE IF NOT EXISTS style (
+    id INTEGER PRIMARY KEY,
+    format TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS format (
+    sheet TEXT NOT NULL,
+    cell TEXT NOT NULL,
+    row INTEGER,
+    col INTEGER,
+    last_row INTEGER,
+    last_col INTEGER,
+    format_id INTEGER NOT NULL
+);
+CREATE TABLE IF NOT EXISTS note (
+    sheet TEXT NOT NULL,
+    cell TEXT NOT NULL,
+    row INTEGER,
+    col INTEGER,
+    text TEXT,
+    author TEXT
+);
+"""
+
+# Replace the indexes of version 1 with unique keys. The key of a cell or range is NULL if its label
+# is not valid, so any number of those can be stored. If more than one label has the same key, the
+# last one added is kept, as it is the one that is applied.
+MIGRATION = """
+DROP INDEX IF EXISTS format_cell;
+DROP INDEX IF EXISTS note_cell;
+DELETE FROM format WHERE row IS NOT NULL AND rowid NOT IN (
+    SELECT MAX(rowid) FROM format WHERE row IS NOT NULL GROUP BY sheet, row, col, last_row, last_col
+);
+DELETE FROM note WHERE row IS NOT NULL AND rowid NOT IN (
+    SELECT MAX(rowid) FROM note WHERE row IS NOT NULL GROUP BY sheet, row, col
+);
+CREATE UNIQUE INDEX IF NOT EXISTS format_key ON format (sheet, row, col, last_row, last_col);
+CREATE UNIQUE INDEX IF NOT EXISTS note_key ON note (sheet, row, col);
+"""
+
+# The columns of the formats and notes after the sheet title. The key columns follow the cell.
+FORMAT_COLUMNS = ["cell", "row", "col", "last_row", "last_col", "format_id"]
+FORMAT_KEY = ["row", "col", "last_row", "last_col"]
+NOTE_COLUMNS = ["cell", "row", "col", "text", "author"]
+NOTE_KEY = ["row", "col"]
+
+
+def connect(path):
+    """Return a connection to the state database at path. The tables are created, or updated to the
+    current schema, the first time a database is opened."""
+    conn = sqlite3.connect(path)
+    if conn.execute("PRAGMA user_version").fetchone()[0] < SCHEMA_VERSION:
+        migrate(conn)
+    return conn
+
+
+def delete_rows(conn, table, key, sheet_title, rows):
+    """Delete rows (with the columns after the sheet title) from the formats or notes of a sheet by
+    their key, or by their cell if they do not have one."""
+    conditions = " AND ".join(f"{k} = ?" for k in key)
+    keyed = [(sheet_title,) + row[1 : len(key) + 1] for row in rows if row[1] is not None]
+    conn.executemany(f"DELETE FROM {table} WHERE sheet = ? AND {conditions}", keyed)
+    conn.executemany(
+        f"DELETE FROM {table} WHERE sheet = ? AND cell = ? AND row IS NULL",
+        [(sheet_title, row[0]) for row in rows if row[1] is None],
+    )
+
+
+def get_formats(path, sheet_titles=None, area=None):
+    """Return a dict of sheet title -> cell or range -> format ID, in the order they were added.
+    If sheet_titles is provided, only get the formats for those sheets. If an area is provided (see
+    with_area), only get the formats of cells and ranges that overlap it."""
+    query = "SELECT sheet, cell, format_id FROM format"
+    query, params = with_sheets(query, sheet_titles)
+    query, params = with_area(query, params, area, "row", "col", "last_row", "last_col")
+    sheet_formats = {}
+    with closing(connect(path)) as conn:
+        for sheet_title, cell, fmt_id in conn.execute(query + " ORDER BY rowid", params):
+            sheet_formats.setdefault(sheet_title, {})[cell] = fmt_id
+    return sheet_formats
+
+
+def get_new_rows(rows, key_length):
+    """Return a dict of cell -> row from rows to write. If more than one row has the same key, only
+    the last is kept, as it is the one that is applied."""
+    new = {}
+    cells = {}
+    for row in rows:
+        key = row[1 : key_length + 1]
+        if row[1] is not None:
+            if key in cells:
+                del new[cells[key]]
+            cells[key] = row[0]
+        new[row[0]] = tuple(row)
+    return new
+
+
+def get_notes(path, sheet_titles=None, area=None):
+    """Return a dict of sheet title -> cell -> note (text and author). If sheet_titles is provided,
+    only get the notes for those sheets. If an area is provided (see with_area), only get the notes
+    in it."""
+    query = "SELECT sheet, cell, text, author FROM note"
+    query, params = with_sheets(query, sheet_titles)
+    query, params = with_area(query, params, area, "row", "col", "row", "col")
+    sheet_notes = {}
+    with closing(connect(path)) as conn:
+        for sheet_title, cell, text, author in conn.execute(query + " ORDER BY rowid", params):
+            sheet_notes.setdefault(sheet_title, {})[cell] = {"text": text, "author": author}
+    return sheet_notes
+
+
+def get_sheets(path):
+    """Return a list of the sheets in the project as dicts like the rows of sheet.tsv."""
+    with closing(connect(path)) as conn:
+        return [
+            {
+                "Title": title,
+                "Path": p,
+                "Frozen Rows": rows,
+                "Frozen Columns": cols,
+                "Shards": shards or "",
+            }
+            for title, p, rows, cols, shards in conn.execute(
+                "SELECT title, path, frozen_rows, frozen_columns, shards FROM sheet ORDER BY rowid"
+            )
+        ]
+
+
+def get_styles(path):
+    """Return a dict of format ID -> format."""
+    with closing(connect(path)) as conn:
+        return {k: json.loads(v) for k, v in conn.execute("SELECT id, format FROM style")}
+
+
+def set_sheets(path, sheet_rows):
+    """Replace the sheets in the project with a list of dicts like the rows of sheet.tsv."""
+    with closing(connect(path)) as conn, conn:
+        conn.execute("DELETE FROM sheet")
+        conn.executemany(
+            "INSERT INTO sheet VALUES (?, ?, ?, ?, ?)",
+            [
+                (
+                    row["Title"],
+                    row.get("Path"),
+                    str(row.get("Frozen Rows", 0)),
+                    str(row.get("Frozen Columns", 0)),
+                    str(row.get("Shards") or ""),
+                )
+                for row in sheet_rows
+            ],
+        )
+
+
+def set_styles(path, id_to_format):
+    """Replace the formats with a dict of format ID -> format."""
+    with closing(connect(path)) as conn, conn:
+        conn.execute("DELETE FROM style")
+        conn.executemany(
+            "INSERT INTO style VALUES (?, ?)",
+            [(k, json.dumps(v, sort_keys=True)) for k, v in id_to_format.items()],
+        )
+
+
+def migrate(conn):
+    """Create the tables of the state database, or update them from an earlier version."""
+    conn.executescript(SCHEMA)
+    columns = [row[1] for row in conn.execute("PRAGMA table_info(sheet)")]
+    if "shards" not in columns:
+        conn.execute("ALTER TABLE sheet ADD COLUMN shards TEXT")
+    # The keys and the version are set together, so that this is only done once
+    conn.executescript(f"BEGIN; {MIGRATION} PRAGMA user_version = {SCHEMA_VERSION}; COMMIT;")
+
+
+def remove_formats(path, sheet_rows):
+    """Remove formats, given as a dict of sheet title -> rows of (cell or range, first row, first
+    column, last row, last column), from the database. Return True if any were removed."""
+    with closing(connect(path)) as conn, conn:
+        total_changes = conn.total_changes
+        for sheet_title, rows in sheet_rows.items():
+            delete_rows(conn, "format", FORMAT_KEY, sheet_title, rows)
+        return conn.total_changes > total_changes
+
+
+def remove_notes(path, sheet_rows):
+    """Remove notes, given as a dict of sheet title -> rows of (cell, row, column), from the
+    database. Return True if any were removed."""
+    with closing(connect(path)) as conn, conn:
+        total_changes = conn.total_changes
+        for sheet_title, rows in sheet_rows.items():
+            delete_rows(conn, "note", NOTE_KEY, sheet_title, rows)
+        return conn.total_changes > total_changes
+
+
+def with_sheets(query, sheet_titles):
+    """Add a condition on the sheet titles to a query, if there are any. Return the query and its
+    parameters."""
+    if sheet_titles is None:
+        return query, []
+    sheet_titles = list(sheet_titles)
+    return query + f" WHERE sheet IN ({', '.join('?' * len(sheet_titles))})", sheet_titles
+
+
+def update_formats(path, sheet_rows, sheet_titles=None):
+    """Replace the formats of the given sheets (or of all sheets) with a dict of sheet title -> rows
+    of (cell or range, first row, first column, last row, last column, format ID). Only the rows
+    that changed are written. Return True if the formats changed."""
+    with closing(connect(path)) as conn, conn:
+        return update_rows(conn, "format", FORMAT_COLUMNS, FORMAT_KEY, sheet_rows, sheet_titles)
+
+
+def update_notes(path, sheet_rows, sheet_titles=None):
+    """Replace the notes of the given sheets (or of all sheets) with a dict of sheet title -> rows
+    of (cell, row, column, text, author). Only the rows that changed are written. Return True if
+    the notes changed."""
+    with closing(connect(path)) as conn, conn:
+        return update_rows(conn, "note", NOTE_COLUMNS, NOTE_KEY, sheet_rows, sheet_titles)
+
+
+def update_rows(conn, table, columns, key, sheet_rows, sheet_titles):
+    """Replace the formats or notes of the given sheets (or of all sheets) by deleting the rows that
+    were removed and upserting the rows that were added or changed. Return True if any changed."""
+    if sheet_titles is None:
+        sheet_titles = [row[0] for row in conn.execute(f"SELECT DISTINCT sheet FROM {table}")]
+        sheet_titles += [st for st in sheet_rows if st not in sheet_titles]
+    upsert = (
+        f"INSERT INTO {table} (sheet, {', '.join(columns)}) "
+        f"VALUES ({', '.join('?' * (len(columns) + 1))}) "
+        f"ON CONFLICT (sheet, {', '.join(key)}) DO UPDATE SET "
+        + ", ".join(f"{c} = excluded.{c}" for c in columns if c not in key)
+    )
+    changed = False
+    for sheet_title in sheet_titles:
+        old = {
+            row[0]: row
+            for row in conn.execute(
+                f"SELECT {', '.join(columns)} FROM {table} WHERE sheet = ? ORDER BY rowid",
+                (sheet_title,),
+            )
+        }
+        new = get_new_rows(sheet_rows.get(sheet_title, []), len(key))
+        if list(new.items()) == list(old.items()):
+            continue
+        changed = True
+        # Later rows are applied over earlier ones, so they are kept in the order they were added.
+        # Changed rows keep their place and added rows go last - if that is not the new order, the
+        # rows of the sheet are replaced.
+        order = [cell for cell in old if cell in new] + [cell for cell in new if cell not in old]
+        if not new or list(new) != order:
+            conn.execute(f"DELETE FROM {table} WHERE sheet = ?", (sheet_title,))
+            rows = list(new.values())
+        else:
+            # Rows without a key cannot be upserted, so those that changed are deleted as well
+            removed = [
+                row
+                for cell, row in old.items()
+                if cell not in new or (row[1] is None and new[cell] != row)
+            ]
+            delete_rows(conn, table, key, sheet_title, removed)
+            rows = [row for cell, row in new.items() if old.get(cell) != row]
+        conn.executemany(upsert, [(sheet_title,) + row for row in rows])
+    return changed
+
+
+def with_area(query, params, area, first_row, first_col, last_row, last_col):
+    """Add a condition to a query so that only the cells and ranges that overlap an area are
+    returned. The area is (first row, first column, last row, last column), where a side is None if
+    the area is not bounded on that side. Return the query and its parameters."""
+    if area is None:
+        return query, params
+    conditions = [f"{first_row} IS NOT NULL"]
+    columns = [last_row, last_col, first_row, first_col]
+    for column, op, bound in zip(columns, [">=", ">=", "<=", "<="], area):
+        if bound is not None:
+            conditions.append(f"{column} {op} ?")
+            params = params + [bound]
+    query += (" AND " if " WHERE " in query else " WHERE ") + " AND ".join(conditions)
+    return query, params
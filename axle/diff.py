@@ -0,0 +1,54 @@
+import csv
+import json
+import os
+
+from itertools import zip_longest
+from .exceptions import DiffError
+from .helpers import (
+    col_to_a1,
+    get_cached_path,
+    get_tracked_sheets,
+    set_logging,
+    validate_axle_project,
+)
+
+
+def diff(sheet_title, verbose=False):
+    """Yield the lines of a cell-level diff between the cached copy of a sheet (the version in the
+    spreadsheet as of the last push or fetch) and its local table. Both tables are read one row at
+    a time. Each changed cell gets a '-' line with its cached value and/or a '+' line with its local
+    value."""
+    set_logging(verbose)
+    axle_dir = validate_axle_project()
+    tracked_sheets = get_tracked_sheets(axle_dir)
+    if sheet_title not in tracked_sheets:
+        raise DiffError(f"'{sheet_title}' is not a tracked sheet")
+    local_path = tracked_sheets[sheet_title]["Path"]
+    cached_path = get_cached_path(axle_dir, sheet_title)
+    for path in [local_path, cached_path]:
+        if not os.path.exists(path):
+            raise DiffError(f"Unable to diff '{sheet_title}' because {path} does not exist")
+
+    delimiter = "\t"
+    if local_path.endswith(".csv"):
+        delimiter = ","
+    yield f"--- {cached_path}"
+    yield f"+++ {local_path}"
+    with open(cached_path, "r") as fc, open(local_path, "r") as fl:
+        cached_rows = csv.reader(fc, delimiter="\t")
+        local_rows = csv.reader(fl, delimiter=delimiter)
+        for row_number, (old, new) in enumerate(zip_longest(cached_rows, local_rows), start=1):
+            if old == new:
+                continue
+            old = old or []
+            new = new or []
+            for col in range(max(len(old), len(new))):
+                old_value = old[col] if col < len(old) else None
+                new_value = new[col] if col < len(new) else None
+                if old_value == new_value:
+                    continue
+                cell = col_to_a1(col + 1) + str(row_number)
+                if old_value is not None:
+                    yield f"- {cell}: {json.dumps(old_value)}"
+                if new_value is not None:
+                    yield f"+ {cell}: {json.dumps(new_value)}"
@@ -14,9 +14,29 @@ class ClearError(AxleError):
     """Used to indicate an error occurred during the clear step."""
 
 
+class DiffError(AxleError):
+    """Used to indicate an error occurred during the diff step."""
+
+
+class FetchError(AxleError):
+    """Used to indicate an error occurred during the fetch step."""
+
+
 class InitError(AxleError):
     """Used to indicate an error occurred during the init step."""
 
 
+class MergeError(AxleError):
+    """Used to indicate an error occurred during the merge step."""
+
+
+class PushError(AxleError):
+    """Used to indicate an error occurred during the push step."""
+
+
 class RmError(AxleError):
     """Used to indicate an error occurred during the rm step."""
+
+
+class StateError(AxleError):
+    """Used to indicate an error occurred while changing how the project state is stored."""
@@ -4,28 +4,64 @@ import json
 import logging
 import os
 import re
+import zipfile
 
-from openpyxl import load_workbook
+from types import SimpleNamespace
+from openpyxl import load_workbook, Workbook
+from openpyxl.cell.read_only import ReadOnlyCell
+from openpyxl.styles.proxy import StyleProxy
+from openpyxl.styles.stylesheet import apply_stylesheet
+from openpyxl.utils.datetime import CALENDAR_MAC_1904, CALENDAR_WINDOWS_1900
+from .compat import get_cell_styles, get_style_key
+from .exceptions import FetchError
 from .helpers import (
+    ENGINES,
+    a1_range_to_rowcols,
+    col_to_a1,
+    get_base_path,
     get_cached_path,
+    get_cached_state,
     get_config,
     get_format_dict,
+    get_manifest,
+    get_shard_titles,
     get_tracked_sheets,
     a1_to_rowcol,
+    replace_if_changed,
+    rowcols_to_a1_range,
     set_logging,
+    update_format_dict,
     update_formats,
     update_notes,
+    update_tracked_sheets,
     validate_axle_project,
 )
+from .profile import count, span
+from .xlsx import (
+    MAIN_NS,
+    iter_sheet_rows,
+    read_dimension,
+    read_package,
+    read_sheet_details,
+    read_shared_strings,
+)
 
 
-def fetch(verbose=False):
-    """Update cached copies of sheets based on the XLSX spreadsheet. Do not update local copies."""
+def fetch(streaming=False, engine="openpyxl", verbose=False):
+    """Update cached copies of sheets based on the XLSX spreadsheet. Do not update local copies.
+    If streaming, the spreadsheet is read in read-only mode and each row is written to the cached
+    copy as it is read, so memory use does not grow with the size of the spreadsheet. If engine is
+    'fast', the worksheets are parsed directly instead of through openpyxl (this also streams each
+    row). Files in the AXLE directory are only replaced if their contents change. Return a list of
+    the titles of the sheets whose cached copies changed."""
     set_logging(verbose)
+    if engine not in ENGINES:
+        raise FetchError(f"Unknown engine '{engine}' - must be one of: " + ", ".join(ENGINES))
     axle_dir = validate_axle_project()
     config = get_config(axle_dir)
-    wb = load_workbook(config["Spreadsheet Path"])
+    spreadsheet_path = config["Spreadsheet Path"]
     tracked_sheets = get_tracked_sheets(axle_dir)
+    pushed = {x["Title"]: x for x in get_manifest(axle_dir).get("Sheets", [])}
 
     # TODO: handle renames, data validation
 
@@ -35,80 +71,259 @@ def fetch(verbose=False):
 
     # Format ID to format for cell formatting
     id_to_format = get_format_dict(axle_dir)
-    if id_to_format:
-        # Format to format ID
-        format_to_id = {json.dumps(v, sort_keys=True): k for k, v in id_to_format.items()}
-        # Next ID for new formats
-        format_ids = list(id_to_format.keys())
-        format_ids.sort()
-        next_fmt_id = int(format_ids[-1]) + 1
-    else:
-        format_to_id = {}
-        next_fmt_id = 1
+    # Format to format ID
+    format_to_id = {json.dumps(v, sort_keys=True): k for k, v in id_to_format.items()}
+    # Style record -> (format without hyperlink, hyperlink -> format ID)
+    # A spreadsheet has few distinct style records, so each is only turned into a format once
+    style_to_format = {}
+
+    # Read-only worksheets do not include frozen panes, hyperlinks, or notes,
+    # so these are read from the worksheet parts separately
+    wb = None
+    zf = None
+    package = None
+    with span("load workbook"):
+        if engine == "fast":
+            zf = zipfile.ZipFile(spreadsheet_path)
+            package = read_package(zf)
+            sheet_titles = list(package["sheets"].keys())
+            strings = read_shared_strings(zf, package["shared_strings"])
+            style_formats, date_styles, timedelta_styles = get_style_formats(zf, package["styles"])
+            for style_id, fmt in enumerate(style_formats):
+                if fmt is not None:
+                    style_to_format[style_id] = (fmt, {})
+            epoch = CALENDAR_WINDOWS_1900
+            workbook_pr = package["workbook_root"].find(f"{{{MAIN_NS}}}workbookPr")
+            if workbook_pr is not None and workbook_pr.get("date1904") in ["1", "true"]:
+                epoch = CALENDAR_MAC_1904
+        else:
+            wb = load_workbook(spreadsheet_path, read_only=streaming)
+            sheet_titles = wb.sheetnames
+            if streaming:
+                zf = zipfile.ZipFile(spreadsheet_path)
+                package = read_package(zf)
+
+    def get_style_format_id(style_key, hyperlink):
+        """Return the format ID for a style record and hyperlink, or None for no format."""
+        # Formats are cached by hyperlink (usually just None)
+        fmt, hyperlink_to_id = style_to_format[style_key]
+        if hyperlink not in hyperlink_to_id:
+            if hyperlink:
+                fmt = dict(fmt, hyperlink=hyperlink)
+            hyperlink_to_id[hyperlink] = get_format_id(fmt, format_to_id, id_to_format)
+        return hyperlink_to_id[hyperlink]
+
+    # Tables split into shards (see push) are read from the sheets of their shards, in order
+    shard_to_table = {}
+    for st, details in tracked_sheets.items():
+        titles = get_shard_titles(st, details.get("Shards"))
+        if len(titles) > 1:
+            shard_to_table.update({title: st for title in titles})
+    table_sheets = {}
+    for sheet_title in sheet_titles:
+        table_title = shard_to_table.get(sheet_title, sheet_title)
+        table_sheets.setdefault(table_title, []).append(sheet_title)
+    for table_title, titles in table_sheets.items():
+        if len(titles) > 1:
+            order = get_shard_titles(table_title, tracked_sheets[table_title]["Shards"])
+            titles.sort(key=lambda t: order.index(t) if t in order else -1)
 
     new_sheets = []
     sheet_frozen = {}
-    for sheet_title in wb.get_sheet_names():
-        if sheet_title not in tracked_sheets:
-            new_sheets.append(sheet_title)
-        sheet = wb.get_sheet_by_name(sheet_title)
-        frozen = sheet.freeze_panes
-        if frozen:
-            row, col = a1_to_rowcol(frozen)
-            sheet_frozen[sheet_title] = {
-                "row": row - 1,
-                "col": col - 1,
-            }
-        else:
-            sheet_frozen[sheet_title] = {"row": 0, "col": 0}
+    # Sheets with changed cached copies
+    changed = []
+    for table_title, titles in table_sheets.items():
+        if table_title not in tracked_sheets:
+            new_sheets.append(table_title)
 
-        rows = []
-        cell_to_note = {}
+        cell_count = 0
+        styled_count = 0
+        # Cells with the same format are coalesced into ranges as the rows are read
         cell_to_format_id = {}
-        for row in sheet.iter_rows():
-            cells = []
-            for cell in row:
-                cells.append(cell.value)
-
-                # Handle notes
-                # These are called comments in openpyxl, but they're actually notes in Excel
-                # Excel comments are not supported
-                note = cell.comment
-                if note:
-                    cell_to_note[cell.coordinate] = {"text": note.text, "author": note.author}
-
-                # Handle formatting
-                fmt = get_cell_format(cell)
-                if not fmt:
-                    continue
-                fmt_key = json.dumps(fmt, sort_keys=True)
-                if fmt_key in format_to_id:
-                    # Format already exists, assign that ID
-                    fmt_id = format_to_id[fmt_key]
+        open_ranges = {}
+        table_notes = {}
+        # Number of rows of the table read so far, and the width of each sheet's rows
+        table_rows = 0
+        widths = []
+        resize = False
+        # Booleans are only written as TRUE and FALSE for tables pushed with typed values
+        typed = pushed.get(table_title, {}).get("Typed", False)
+        cached_path = get_cached_path(axle_dir, table_title)
+        # Write to a temporary file so the cached copy is only replaced if it has changed
+        tmp_path = cached_path + ".tmp"
+        with span("iterate cells", sheet=table_title), open(tmp_path, "w") as fw:
+            writer = csv.writer(fw, delimiter="\t", lineterminator="\n")
+            for shard, sheet_title in enumerate(titles, start=1):
+                if wb:
+                    sheet = wb[sheet_title]
+                if package:
+                    part = package["sheets"][sheet_title]
+                    frozen, cell_to_hyperlink, cell_to_note = read_sheet_details(zf, part)
+                else:
+                    frozen = sheet.freeze_panes
+                    cell_to_hyperlink = {}
+                    cell_to_note = {}
+                if shard == 1:
+                    if frozen:
+                        row, col = a1_to_rowcol(frozen)
+                        sheet_frozen[table_title] = {
+                            "row": row - 1,
+                            "col": col - 1,
+                        }
+                    else:
+                        sheet_frozen[table_title] = {"row": 0, "col": 0}
+
+                # The header is repeated in each shard, so it is only read from the first; the
+                # rows after it are numbered from the end of the previous shard
+                skip = 0 if shard == 1 else 1
+                offset = table_rows - skip
+                row_number = 0
+                if engine == "fast":
+                    rows = iter_sheet_rows(
+                        zf,
+                        part,
+                        strings,
+                        date_styles=date_styles,
+                        timedelta_styles=timedelta_styles,
+                        epoch=epoch,
+                    )
+                    # Like openpyxl, every row is as wide as the widest row in the sheet, which is
+                    # usually given by the dimension of the sheet
+                    dimension = read_dimension(zf, part) or (0, 0)
+                    width = dimension[1]
+                    max_col = 0
+                    for next_row_number, cells in rows:
+                        # Fill in missing rows
+                        while row_number < next_row_number - 1:
+                            row_number += 1
+                            if row_number > skip:
+                                writer.writerow([None] * width)
+                        row_number = next_row_number
+                        values = [None] * max(width, cells[-1][0])
+                        row_formats = {}
+                        for col, value, style_id in cells:
+                            values[col - 1] = get_text_value(value, typed)
+                            max_col = max(max_col, col)
+                            if style_id not in style_to_format:
+                                continue
+                            coordinate = col_to_a1(col) + str(row_number)
+                            hyperlink = cell_to_hyperlink.get(coordinate)
+                            fmt_id = get_style_format_id(style_id, hyperlink)
+                            if fmt_id:
+                                row_formats[col] = fmt_id
+                        if row_number <= skip:
+                            continue
+                        add_row_formats(
+                            cell_to_format_id, open_ranges, offset + row_number, row_formats
+                        )
+                        writer.writerow(values)
+                        cell_count += len(cells)
+                        styled_count += len(row_formats)
+                    # openpyxl creates cells for notes and hyperlinks, even outside of the values
+                    max_row = row_number
+                    for coordinate in list(cell_to_note.keys()) + list(cell_to_hyperlink.keys()):
+                        row, col = a1_to_rowcol(coordinate)
+                        max_row = max(max_row, row)
+                        max_col = max(max_col, col)
+                    while row_number < max_row:
+                        row_number += 1
+                        if row_number > skip:
+                            writer.writerow([None] * width)
+                    # If the dimension was missing or wrong, the rows need to be resized
+                    widths.append(max_col)
+                    resize = resize or max_col != width
                 else:
-                    # Assign a new ID and add to master dict
-                    fmt_id = next_fmt_id
-                    format_to_id[fmt_key] = fmt_id
-                    id_to_format[fmt_id] = fmt
-                    next_fmt_id += 1
-                # openpyxl doesn't accept ranges, so don't worry about ranges of formats
-                # each cell gets its own entry in format.tsv
-                cell_to_format_id[cell.coordinate] = fmt_id
-
-            # Add all cells to the rows for this sheet
-            rows.append(cells)
+                    sheet_width = 0
+                    # Without a dimension, read-only rows end at their last cell
+                    min_width = None
+                    for row_number, row in enumerate(sheet.iter_rows(), start=1):
+                        cells = []
+                        row_formats = {}
+                        for col, cell in enumerate(row, start=1):
+                            cells.append(get_text_value(cell.value, typed))
+
+                            # Handle notes
+                            # These are called comments in openpyxl, but they're actually notes in
+                            # Excel. Excel comments are not supported
+                            if not streaming:
+                                note = cell.comment
+                                if note:
+                                    cell_to_note[cell.coordinate] = {
+                                        "text": note.text,
+                                        "author": note.author,
+                                    }
+
+                            # Handle formatting
+                            style_key = get_style_key(cell)
+                            if style_key is None:
+                                continue
+                            if style_key not in style_to_format:
+                                fmt = get_cell_format(cell)
+                                # Hyperlinks belong to the cell, not the style
+                                fmt.pop("hyperlink", None)
+                                style_to_format[style_key] = (fmt, {})
+                            if streaming:
+                                hyperlink = cell_to_hyperlink.get(cell.coordinate)
+                            else:
+                                hyperlink = get_hyperlink(cell)
+                            fmt_id = get_style_format_id(style_key, hyperlink)
+                            if fmt_id:
+                                row_formats[col] = fmt_id
+
+                        # Write this row to the cached copy
+                        sheet_width = max(sheet_width, len(cells))
+                        if min_width is None or len(cells) < min_width:
+                            min_width = len(cells)
+                        if row_number <= skip:
+                            continue
+                        add_row_formats(
+                            cell_to_format_id, open_ranges, offset + row_number, row_formats
+                        )
+                        writer.writerow(cells)
+                        cell_count += len(cells)
+                        styled_count += len(row_formats)
+                    widths.append(sheet_width)
+                    resize = resize or (min_width is not None and min_width < sheet_width)
+                table_rows += max(row_number - skip, 0)
+                for coordinate, note in cell_to_note.items():
+                    row, col = a1_to_rowcol(coordinate)
+                    if row > skip:
+                        table_notes[col_to_a1(col) + str(offset + row)] = note
+            # Close the ranges that reach the last row
+            add_row_formats(cell_to_format_id, open_ranges, None, {})
+        if resize or len(set(widths)) > 1:
+            # Shards may also have been edited to different widths
+            resize_rows(tmp_path, max(widths))
+        count("cells", cell_count)
+        count("styled cells", styled_count)
+        count("notes", len(table_notes))
+        with span("write caches", sheet=table_title):
+            # Keep the last pushed version of the sheet as the base for three-way merges
+            backup_path = None
+            pushed_cached = pushed.get(table_title, {}).get("Cached")
+            if (
+                pushed_cached
+                and os.path.exists(cached_path)
+                and get_cached_state(cached_path) == pushed_cached
+            ):
+                backup_path = get_base_path(axle_dir, table_title)
+            if replace_if_changed(tmp_path, cached_path, backup_path=backup_path):
+                logging.info(f"'{table_title}' has changed")
+                changed.append(table_title)
 
         # If the sheet had any formats or notes, add them to the master dicts
         if cell_to_format_id:
-            sheet_formats[sheet_title] = cell_to_format_id
-        if cell_to_note:
-            sheet_notes[sheet_title] = cell_to_note
+            sheet_formats[table_title] = dict(
+                sorted(cell_to_format_id.items(), key=lambda x: a1_range_to_rowcols(x[0]))
+            )
+        if table_notes:
+            sheet_notes[table_title] = table_notes
 
-        # Write to cached copy
-        cached_path = get_cached_path(axle_dir, sheet_title)
-        with open(cached_path, "w") as fw:
-            writer = csv.writer(fw, delimiter="\t", lineterminator="\n")
-            writer.writerows(rows)
+    if wb and streaming:
+        wb.close()
+    if zf:
+        zf.close()
+    count("distinct formats", len(style_to_format))
 
     # Get updated sheet details
     sheet_rows = []
@@ -129,23 +344,66 @@ def fetch(verbose=False):
             }
         )
 
-    # Rewrite formats JSON with new dict
-    with open(f"{axle_dir}/formats.json", "w") as f:
-        f.write(json.dumps(id_to_format, sort_keys=True, indent=4))
-    # Update config files for formats and notes
-    update_formats(axle_dir, sheet_formats)
-    update_notes(axle_dir, sheet_notes)
-
-    # Update sheet.tsv
-    with open(f"{axle_dir}/sheet.tsv", "w") as fw:
-        writer = csv.DictWriter(
-            fw,
-            delimiter="\t",
-            lineterminator="\n",
-            fieldnames=["Title", "Path", "Frozen Rows", "Frozen Columns"],
-        )
-        writer.writeheader()
-        writer.writerows(sheet_rows)
+    with span("write state"):
+        # Rewrite formats JSON with new dict
+        update_format_dict(axle_dir, id_to_format)
+        # Update config files for formats and notes
+        update_formats(axle_dir, sheet_formats)
+        update_notes(axle_dir, sheet_notes)
+
+        # Update sheet.tsv
+        update_tracked_sheets(axle_dir, sheet_rows)
+    return changed
+
+
+def add_row_formats(cell_to_format_id, open_ranges, row_number, col_to_format_id):
+    """Add the formats of a row (column number -> format ID) to the formats of a sheet as ranges.
+    Runs of cells with the same format become a range, which is extended down while the rows below
+    have the same run. open_ranges maps (first column, last column, format ID) -> [first row, last
+    row] of the ranges that may still be extended; the others are added to cell_to_format_id as
+    range -> format ID. Call with no formats after the last row to add the remaining ranges."""
+    runs = []
+    for col, fmt_id in sorted(col_to_format_id.items()):
+        if runs and runs[-1][1] == col - 1 and runs[-1][2] == fmt_id:
+            runs[-1][1] = col
+        else:
+            runs.append([col, col, fmt_id])
+    extended = {}
+    for first_col, last_col, fmt_id in runs:
+        key = (first_col, last_col, fmt_id)
+        rows = open_ranges.get(key)
+        if rows and rows[1] == row_number - 1:
+            rows[1] = row_number
+            del open_ranges[key]
+        else:
+            rows = [row_number, row_number]
+        extended[key] = rows
+    for (first_col, last_col, fmt_id), (first_row, last_row) in open_ranges.items():
+        cell_to_format_id[rowcols_to_a1_range(first_row, first_col, last_row, last_col)] = fmt_id
+    open_ranges.clear()
+    open_ranges.update(extended)
+
+
+def get_style_formats(zf, part):
+    """Return the format (without hyperlink) of each cell style record in the stylesheet part of a
+    spreadsheet, or None if the record does not have a style, as well as the indexes of the
+    records for dates and for time deltas."""
+    wb = Workbook()
+    if part:
+        # openpyxl reads the stylesheet from the usual part name, which this part may not have
+        apply_stylesheet(SimpleNamespace(read=lambda name: zf.read(part)), wb)
+    formats = []
+    cell_styles, date_styles, timedelta_styles = get_cell_styles(wb)
+    for style_id, style in enumerate(cell_styles):
+        if not any(style):
+            formats.append(None)
+            continue
+        # Format a cell with this style the same way as when reading with openpyxl
+        fmt = get_cell_format(ReadOnlyCell(wb.active, 1, 1, None, style_id=style_id))
+        if fmt:
+            fmt.pop("hyperlink", None)
+        formats.append(fmt)
+    return formats, date_styles, timedelta_styles
 
 
 def get_attributes(o):
@@ -183,11 +441,13 @@ def get_attributes(o):
 
 def get_cell_format(cell):
     """Return the cell format as a dictionary, or None if the cell does not have a style."""
-    if not cell.has_style:
+    # Empty cells in read-only mode do not have styles
+    if not getattr(cell, "has_style", False):
         return None
     fmt = {}
     for attr in ["alignment", "border", "fill", "font", "hyperlink", "number_format"]:
-        v = getattr(cell, attr)
+        # Read-only cells do not have hyperlinks
+        v = getattr(cell, attr, None)
         if not v or callable(v):
             continue
         if attr == "hyperlink":
@@ -198,6 +458,10 @@ def get_cell_format(cell):
         ):
             fmt[attr] = v
         else:
+            if not isinstance(v, StyleProxy):
+                # Read-only cells return the style itself - wrap it like a normal cell's style
+                # so that the same attributes are found
+                v = StyleProxy(v)
             more_attrs = get_attributes(v)
             if attr == "fill" and not more_attrs.get("patternType"):
                 # Special case: no fill, but openpyxl returns #000 as fill color with null pattern
@@ -207,6 +471,53 @@ def get_cell_format(cell):
     return fmt
 
 
+def get_format_id(fmt, format_to_id, id_to_format):
+    """Return the ID of a format, assigning a new ID if the format does not exist yet.
+    Return None for an empty format."""
+    if not fmt:
+        return None
+    fmt_key = json.dumps(fmt, sort_keys=True)
+    if fmt_key in format_to_id:
+        # Format already exists, assign that ID
+        return format_to_id[fmt_key]
+    # Assign a new ID and add to master dict
+    fmt_id = max(id_to_format.keys(), default=0) + 1
+    format_to_id[fmt_key] = fmt_id
+    id_to_format[fmt_id] = fmt
+    return fmt_id
+
+
+def get_hyperlink(cell):
+    """Return the external hyperlink target of a cell, or None."""
+    hyperlink = cell.hyperlink
+    if hyperlink and isinstance(hyperlink.target, str):
+        return hyperlink.target
+    return None
+
+
+def get_text_value(value, typed=False):
+    """Return a cell value to write to a table. If typed, booleans are written as TRUE and FALSE,
+    the way Excel shows them, so that booleans written by a typed push (see push) are fetched as
+    the same text. Other values are written as they are by the CSV writer."""
+    if typed:
+        if value is True:
+            return "TRUE"
+        if value is False:
+            return "FALSE"
+    return value
+
+
+def resize_rows(path, width):
+    """Pad or truncate each row of a TSV file to the given number of columns."""
+    tmp_path = path + ".tmp"
+    with open(path, "r", newline="") as fr, open(tmp_path, "w") as fw:
+        reader = csv.reader(fr, delimiter="\t")
+        writer = csv.writer(fw, delimiter="\t", lineterminator="\n")
+        for row in reader:
+            writer.writerow((row + [None] * width)[:width])
+    os.replace(tmp_path, path)
+
+
 def get_new_path(sheet_title, directory, file_format):
     """Create a distinct local sheet path for a sheet."""
     basename = re.sub(r"[^A-Za-z0-9]+", "_", sheet_title.lower()).strip("_")
@@ -1,12 +1,25 @@
 import csv
+import hashlib
 import json
 import logging
 import os
-import pkg_resources
 import re
 
+from . import database
 from .exceptions import AxleError
 
+# Levels of compression for writing the spreadsheet (see push)
+COMPRESSION_LEVELS = ["stored", "fast", "default", "max"]
+
+# Engines for reading the spreadsheet (see fetch)
+ENGINES = ["openpyxl", "fast"]
+
+# Maximum number of rows in a sheet
+MAX_ROWS = 1048576
+
+# Columns of sheet.tsv
+SHEET_FIELDS = ["Title", "Path", "Frozen Rows", "Frozen Columns", "Shards"]
+
 
 def a1_to_rowcol(label):
     """Adapted from gspead.utils."""
@@ -23,6 +36,26 @@ def a1_to_rowcol(label):
     return row, col
 
 
+def a1_range_to_rowcols(label):
+    """Return the first row, first column, last row, and last column of a cell or range of cells
+    (e.g., A2:A300000), or None if the label is not valid."""
+    if ":" not in label:
+        start = a1_to_rowcol(label)
+        if not start:
+            return None
+        return start + start
+    start = a1_to_rowcol(label.split(":", 1)[0])
+    end = a1_to_rowcol(label.split(":", 1)[1])
+    if not start or not end:
+        return None
+    return (
+        min(start[0], end[0]),
+        min(start[1], end[1]),
+        max(start[0], end[0]),
+        max(start[1], end[1]),
+    )
+
+
 def col_to_a1(n):
     string = ""
     while n > 0:
@@ -31,12 +64,58 @@ def col_to_a1(n):
     return string
 
 
+def rowcols_to_a1_range(first_row, first_col, last_row, last_col):
+    """Return the label of a range of cells, or of a single cell if the range only has one cell."""
+    start = col_to_a1(first_col) + str(first_row)
+    if first_row == last_row and first_col == last_col:
+        return start
+    return f"{start}:{col_to_a1(last_col)}{last_row}"
+
+
+def get_base_path(axle_dir, sheet_title):
+    """Return the path to the last pushed version of a sheet, which is kept when fetch replaces the
+    cached version. This is the base for three-way merges."""
+    return get_cached_path(axle_dir, sheet_title)[: -len(".tsv")] + ".base.tsv"
+
+
 def get_cached_path(axle_dir, sheet_title):
     """Return the path to the cached version of a sheet based on its title."""
     filename = re.sub(r"[^A-Za-z0-9]+", "_", sheet_title.lower())
     return f"{axle_dir}/tracked/{filename}.tsv"
 
 
+def get_cached_state(cached_path):
+    """Return the size and modification time of a cached sheet."""
+    st = os.stat(cached_path)
+    return {"Size": st.st_size, "Mtime": st.st_mtime_ns}
+
+
+def get_changed_sheets(axle_dir):
+    """Return the titles of the tracked sheets whose cached copies changed since the last push,
+    i.e., the sheets that changed in the spreadsheet (or that have not been pushed)."""
+    pushed = {x["Title"]: x for x in get_manifest(axle_dir).get("Sheets", [])}
+    changed = []
+    for sheet_title in get_tracked_sheets(axle_dir):
+        cached_path = get_cached_path(axle_dir, sheet_title)
+        if not os.path.exists(cached_path):
+            continue
+        if get_cached_state(cached_path) != pushed.get(sheet_title, {}).get("Cached"):
+            changed.append(sheet_title)
+    return changed
+
+
+def get_compression(config, compression=None):
+    """Return the level of compression to write the spreadsheet with: the given level, or else the
+    Compression setting of the project, or else "default"."""
+    compression = compression or config.get("Compression") or "default"
+    if compression not in COMPRESSION_LEVELS:
+        raise AxleError(
+            f"Unknown compression level '{compression}' - must be one of: "
+            + ", ".join(COMPRESSION_LEVELS)
+        )
+    return compression
+
+
 def get_config(axle_dir):
     """Get the configuration for this project as a dict."""
     config = {}
@@ -50,8 +129,41 @@ def get_config(axle_dir):
     return config
 
 
+def get_entries_hash(entries):
+    """Return a hash of a dict of cell -> format or note."""
+    return hashlib.sha256(json.dumps(entries, sort_keys=True).encode("utf-8")).hexdigest()
+
+
+def get_file_hash(path):
+    """Return the SHA-256 hex digest of a file, reading it in blocks."""
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1024 * 1024), b""):
+            h.update(block)
+    return h.hexdigest()
+
+
+def get_file_state(path, previous=None):
+    """Return the size, modification time and hash of a file as a dict. If the size and
+    modification time match the previous state, reuse its hash instead of reading the file."""
+    st = os.stat(path)
+    if (
+        previous
+        and previous.get("Path") == path
+        and previous.get("Size") == st.st_size
+        and previous.get("Mtime") == st.st_mtime_ns
+    ):
+        file_hash = previous["Hash"]
+    else:
+        file_hash = get_file_hash(path)
+    return {"Path": path, "Size": st.st_size, "Mtime": st.st_mtime_ns, "Hash": file_hash}
+
+
 def get_format_dict(axle_dir):
     """Get a dict of numerical format ID -> the format dict."""
+    db = get_state_db(axle_dir)
+    if db:
+        return database.get_styles(db)
     if (
         os.path.exists(f"{axle_dir}/formats.json")
         and not os.stat(f"{axle_dir}/formats.json").st_size == 0
@@ -62,14 +174,80 @@ def get_format_dict(axle_dir):
     return {}
 
 
-def get_sheet_formats(axle_dir):
-    """Get a dict of sheet ID -> formatted cells."""
+def get_format_hash(cell_formats, id_to_format):
+    """Return a hash of the formats on the cells of a sheet. The format itself is hashed rather
+    than its ID so that changes to formats.json are detected."""
+    return get_entries_hash(
+        {cell: id_to_format.get(fmt_id) for cell, fmt_id in cell_formats.items()}
+    )
+
+
+def get_manifest(axle_dir):
+    """Get the details of the last push from manifest.json, or an empty dict if there are none."""
+    if (
+        os.path.exists(f"{axle_dir}/manifest.json")
+        and not os.stat(f"{axle_dir}/manifest.json").st_size == 0
+    ):
+        with open(f"{axle_dir}/manifest.json", "r") as f:
+            return json.loads(f.read())
+    return {}
+
+
+def get_shard_locations(row, shard_rows, shards):
+    """Return a list of (shard number, row number in the shard) for a row of a table that is split
+    into shards of shard_rows rows after the header (see get_shard_rows). The header row is repeated
+    in every shard. Rows and shards are numbered from 1."""
+    if shards <= 1:
+        return [(1, row)]
+    if row <= 1:
+        return [(shard, row) for shard in range(1, shards + 1)]
+    shard = (row - 2) // shard_rows + 1
+    return [(shard, row - (shard - 1) * shard_rows)]
+
+
+def get_shard_rows(config, shard_rows=None):
+    """Return the maximum number of rows after the header in each sheet that a table is pushed to:
+    the given number, or else the Shard Rows setting of the project. Return None if tables are not
+    split into shards (see get_shard_titles)."""
+    shard_rows = shard_rows or config.get("Shard Rows")
+    if not shard_rows:
+        return None
+    try:
+        shard_rows = int(shard_rows)
+    except ValueError:
+        shard_rows = 0
+    if not 0 < shard_rows < MAX_ROWS:
+        raise AxleError(f"Shard rows must be a number from 1 to {MAX_ROWS - 1}")
+    return shard_rows
+
+
+def get_shard_titles(sheet_title, shards):
+    """Return the titles of the sheets that a table is pushed to: the title of the table, or, if it
+    is split into more than one shard, the title followed by the number of each shard (e.g.,
+    "terms (1)", "terms (2)")."""
+    shards = int(shards or 1)
+    if shards <= 1:
+        return [sheet_title]
+    return [f"{sheet_title} ({shard})" for shard in range(1, shards + 1)]
+
+
+def get_sheet_formats(axle_dir, sheet_titles=None, area=None):
+    """Get a dict of sheet ID -> formatted cells. A cell may be a range of cells (e.g., A2:A300000),
+    which is not expanded. If sheet_titles is provided, only get the formats for those sheets. If an
+    area is provided (see subtract_range), only get the cells and ranges that overlap it."""
+    db = get_state_db(axle_dir)
+    if db:
+        return database.get_formats(db, sheet_titles=sheet_titles, area=area)
     sheet_to_formats = {}
     with open(f"{axle_dir}/format.tsv", "r") as f:
         reader = csv.DictReader(f, delimiter="\t")
         for row in reader:
             sheet_title = row["Sheet Title"]
+            if sheet_titles is not None and sheet_title not in sheet_titles:
+                continue
             cell = row["Cell"]
+            if area is not None and not in_area(a1_range_to_rowcols(cell), area):
+                continue
             fmt = int(row["Format ID"])
             if sheet_title in sheet_to_formats:
                 cell_to_format = sheet_to_formats[sheet_title]
@@ -80,14 +258,22 @@ def get_sheet_formats(axle_dir):
     return sheet_to_formats
 
 
-def get_sheet_notes(axle_dir):
-    """Get a dict of sheet ID -> notes on cells."""
+def get_sheet_notes(axle_dir, sheet_titles=None, area=None):
+    """Get a dict of sheet ID -> notes on cells. If sheet_titles is provided, only get the notes for
+    those sheets. If an area is provided (see subtract_range), only get the notes in it."""
+    db = get_state_db(axle_dir)
+    if db:
+        return database.get_notes(db, sheet_titles=sheet_titles, area=area)
     sheet_to_notes = {}
     with open(f"{axle_dir}/note.tsv") as f:
         reader = csv.DictReader(f, delimiter="\t")
         for row in reader:
             sheet_title = row["Sheet Title"]
+            if sheet_titles is not None and sheet_title not in sheet_titles:
+                continue
             cell = row["Cell"]
+            if area is not None and not in_area(a1_range_to_rowcols(cell), area):
+                continue
             note = row["Note"]
             author = row["Author"]
             if sheet_title in sheet_to_notes:
@@ -99,28 +285,104 @@ def get_sheet_notes(axle_dir):
     return sheet_to_notes
 
 
+def get_state_db(axle_dir):
+    """Return the path to the SQLite database of the project state, or None if the project state is
+    stored in TSV and JSON files."""
+    path = os.path.join(axle_dir, database.DB_NAME)
+    if os.path.exists(path):
+        return path
+    return None
+
+
+def get_state_file_states(axle_dir, previous=None):
+    """Return a dict of file name -> file state (see get_file_state) of the files in the AXLE
+    directory that store the formats and notes of the sheets."""
+    if get_state_db(axle_dir):
+        names = [database.DB_NAME]
+    else:
+        names = ["format.tsv", "note.tsv", "formats.json"]
+    previous = previous or {}
+    states = {}
+    for name in names:
+        path = os.path.join(axle_dir, name)
+        if os.path.exists(path):
+            states[name] = get_file_state(path, previous.get(name))
+    return states
+
+
 def get_tracked_sheets(axle_dir):
     """Get the current tracked sheets in this project from sheet.tsv as a dict of sheet title ->
     details. They may or may not have corresponding cached/local sheets."""
+    db = get_state_db(axle_dir)
+    if db:
+        rows = database.get_sheets(db)
+    else:
+        with open(f"{axle_dir}/sheet.tsv", "r") as f:
+            rows = list(csv.DictReader(f, delimiter="\t"))
     sheets = {}
-    with open(f"{axle_dir}/sheet.tsv", "r") as f:
-        reader = csv.DictReader(f, delimiter="\t")
-        for row in reader:
-            title = row["Title"]
-            if not title:
-                continue
-            del row["Title"]
-            sheets[title] = row
+    for row in rows:
+        title = row["Title"]
+        if not title:
+            continue
+        del row["Title"]
+        sheets[title] = row
     return sheets
 
 
 def get_version():
+    """Return the version of the installed package from its metadata."""
     try:
-        return pkg_resources.require("ontodev-axle")[0].version
-    except pkg_resources.DistributionNotFound:
+        from importlib.metadata import PackageNotFoundError, version
+    except ImportError:
+        # Python < 3.8
+        import pkg_resources
+
+        try:
+            return pkg_resources.require("ontodev-axle")[0].version
+        except pkg_resources.DistributionNotFound:
+            return "developer-version"
+    try:
+        return version("ontodev-axle")
+    except PackageNotFoundError:
         return "developer-version"
 
 
+def in_area(rowcols, area):
+    """Return True if a cell or range, given as (first row, first column, last row, last column),
+    overlaps an area (see subtract_range). Return False if there is no cell or range."""
+    if not rowcols:
+        return False
+    return subtract_range(rowcols, area) != [rowcols]
+
+
+def iter_row_entries(cell_to_value):
+    """Yield a dict of column number -> value for each row, starting at row 1, from a dict of cell
+    or range of cells (e.g., A2:A300000) -> value. Ranges are only expanded one row at a time.
+    Where entries overlap, the later entry is used. Stop after the last row with an entry."""
+    # First row -> list of (entry number, last row, first column, last column, value)
+    row_to_entries = {}
+    for i, (label, value) in enumerate(cell_to_value.items()):
+        rowcols = a1_range_to_rowcols(label)
+        if not rowcols:
+            logging.warning(f"Skipping invalid cell or range '{label}'")
+            continue
+        first_row, first_col, last_row, last_col = rowcols
+        row_to_entries.setdefault(first_row, []).append((i, last_row, first_col, last_col, value))
+    if not row_to_entries:
+        return
+    last = max(entry[1] for entries in row_to_entries.values() for entry in entries)
+    active = []
+    for row in range(1, last + 1):
+        if row in row_to_entries:
+            active = sorted(active + row_to_entries.pop(row))
+        col_to_value = {}
+        for _, last_row, first_col, last_col, value in active:
+            for col in range(first_col, last_col + 1):
+                col_to_value[col] = value
+        yield col_to_value
+        active = [entry for entry in active if entry[1] > row]
+
+
 def set_logging(verbose):
     """Set logging for AXLE based on -v/--verbose."""
     if verbose:
@@ -129,23 +391,122 @@ def set_logging(verbose):
         logging.basicConfig(level=logging.WARNING, format="%(levelname)s: %(message)s")
 
 
-def update_formats(axle_dir, sheet_formats):
-    """Update format.tsv with current formatting from XLSX."""
+def replace_if_changed(tmp_path, path, backup_path=None):
+    """Atomically replace path with the file at tmp_path if their contents differ. Otherwise, remove
+    tmp_path and leave path (and its modification time) as it is. If backup_path is provided, the
+    old file is moved there before it is replaced. Return True if path changed."""
+    if (
+        os.path.exists(path)
+        and os.stat(path).st_size == os.stat(tmp_path).st_size
+        and get_file_hash(path) == get_file_hash(tmp_path)
+    ):
+        os.remove(tmp_path)
+        return False
+    if backup_path and os.path.exists(path):
+        os.replace(path, backup_path)
+    os.replace(tmp_path, path)
+    return True
+
+
+def subtract_range(rowcols, area):
+    """Return the parts of a range of cells that are outside of an area as a list of ranges. Both
+    are given as (first row, first column, last row, last column), but a side of the area may be
+    None if the area is not bounded on that side."""
+    first_row, first_col, last_row, last_col = rowcols
+    # The part of the range inside the area
+    inner_first_row = first_row if area[0] is None else max(first_row, area[0])
+    inner_first_col = first_col if area[1] is None else max(first_col, area[1])
+    inner_last_row = last_row if area[2] is None else min(last_row, area[2])
+    inner_last_col = last_col if area[3] is None else min(last_col, area[3])
+    if inner_first_row > inner_last_row or inner_first_col > inner_last_col:
+        return [rowcols]
+    parts = []
+    if first_row < inner_first_row:
+        parts.append((first_row, first_col, inner_first_row - 1, last_col))
+    if first_col < inner_first_col:
+        parts.append((inner_first_row, first_col, inner_last_row, inner_first_col - 1))
+    if inner_last_col < last_col:
+        parts.append((inner_first_row, inner_last_col + 1, inner_last_row, last_col))
+    if inner_last_row < last_row:
+        parts.append((inner_last_row + 1, first_col, last_row, last_col))
+    return parts
+
+
+def update_format_dict(axle_dir, id_to_format):
+    """Update formats.json with a dict of numerical format ID -> the format dict. Return True if the
+    formats changed."""
+    db = get_state_db(axle_dir)
+    if db:
+        if database.get_styles(db) == id_to_format:
+            return False
+        database.set_styles(db, id_to_format)
+        return True
+    return write_if_changed(
+        f"{axle_dir}/formats.json",
+        lambda f: f.write(json.dumps(id_to_format, sort_keys=True, indent=4)),
+    )
+
+
+def update_formats(axle_dir, sheet_formats, sheet_titles=None):
+    """Update format.tsv with current formatting from XLSX. The cells may be ranges of cells. If
+    sheet_titles is provided, only the formats of those sheets are replaced. Return True if the
+    formats changed."""
+    db = get_state_db(axle_dir)
+    if db:
+        sheet_rows = {
+            sheet_title: [
+                (cell,) + (a1_range_to_rowcols(cell) or (None,) * 4) + (fmt,)
+                for cell, fmt in formats.items()
+            ]
+            for sheet_title, formats in sheet_formats.items()
+        }
+        return database.update_formats(db, sheet_rows, sheet_titles=sheet_titles)
+    if sheet_titles is not None:
+        # Keep the formats of the other sheets
+        all_formats = get_sheet_formats(axle_dir)
+        for sheet_title in sheet_titles:
+            all_formats[sheet_title] = sheet_formats.get(sheet_title, {})
+        sheet_formats = all_formats
     fmt_rows = []
     for sheet_title, formats in sheet_formats.items():
         for cell, fmt in formats.items():
             fmt_rows.append({"Sheet Title": sheet_title, "Cell": cell, "Format ID": fmt})
-    with open(f"{axle_dir}/format.tsv", "w") as f:
+
+    def write(f):
         writer = csv.DictWriter(
             f, delimiter="\t", lineterminator="\n", fieldnames=["Sheet Title", "Cell", "Format ID"],
         )
         writer.writeheader()
         writer.writerows(fmt_rows)
 
+    return write_if_changed(f"{axle_dir}/format.tsv", write)
+
+
+def update_manifest(axle_dir, manifest):
+    """Update manifest.json with the details of the last push."""
+    with open(f"{axle_dir}/manifest.json", "w") as f:
+        f.write(json.dumps(manifest, sort_keys=True, indent=4))
 
-def update_notes(axle_dir, sheet_notes):
-    """Update note.tsv with current remote notes.
-    Remove any lines with a Sheet ID in removed_ids."""
+
+def update_notes(axle_dir, sheet_notes, sheet_titles=None):
+    """Update note.tsv with current remote notes. If sheet_titles is provided, only the notes of
+    those sheets are replaced. Return True if the notes changed."""
+    db = get_state_db(axle_dir)
+    if db:
+        sheet_rows = {
+            sheet_title: [
+                (cell,) + (a1_to_rowcol(cell) or (None, None)) + (note["text"], note["author"])
+                for cell, note in notes.items()
+            ]
+            for sheet_title, notes in sheet_notes.items()
+        }
+        return database.update_notes(db, sheet_rows, sheet_titles=sheet_titles)
+    if sheet_titles is not None:
+        # Keep the notes of the other sheets
+        all_notes = get_sheet_notes(axle_dir)
+        for sheet_title in sheet_titles:
+            all_notes[sheet_title] = sheet_notes.get(sheet_title, {})
+        sheet_notes = all_notes
     note_rows = []
     for sheet_title, notes in sheet_notes.items():
         for cell, note in notes.items():
@@ -157,7 +518,8 @@ def update_notes(axle_dir, sheet_notes):
                     "Author": note["author"],
                 }
             )
-    with open(f"{axle_dir}/note.tsv", "w") as f:
+
+    def write(f):
         writer = csv.DictWriter(
             f,
             delimiter="\t",
@@ -167,6 +529,28 @@ def update_notes(axle_dir, sheet_notes):
         writer.writeheader()
         writer.writerows(note_rows)
 
+    return write_if_changed(f"{axle_dir}/note.tsv", write)
+
+
+def update_tracked_sheets(axle_dir, sheet_rows):
+    """Update sheet.tsv with a list of sheet details (including the title)."""
+    db = get_state_db(axle_dir)
+    if db:
+        database.set_sheets(db, sheet_rows)
+        return
+
+    def write(f):
+        writer = csv.DictWriter(
+            f,
+            delimiter="\t",
+            lineterminator="\n",
+            fieldnames=SHEET_FIELDS,
+        )
+        writer.writeheader()
+        writer.writerows(sheet_rows)
+
+    write_if_changed(f"{axle_dir}/sheet.tsv", write)
+
 
 def validate_axle_project():
     """Validate that there is a valid AXLE project in this or the parents of this directory. If not,
@@ -181,7 +565,22 @@ def validate_axle_project():
 
     if not axle_dir:
         raise AxleError("An AXLE project has not been initialized in this or parent directories!")
+    if get_state_db(axle_dir):
+        return axle_dir
     for r in ["sheet.tsv"]:  # TODO: format.tsv, note.tsv, validation.tsv
         if not os.path.exists(f"{axle_dir}/{r}") or os.stat(f"{axle_dir}/{r}").st_size == 0:
             raise AxleError(f"AXLE directory '{axle_dir}' is missing {r}")
     return axle_dir
+
+
+def write_if_changed(path, write):
+    """Write the new contents of a file by calling write with a temporary file open for writing.
+    path is only replaced if its contents changed. Return True if path changed."""
+    tmp_path = path + ".tmp"
+    try:
+        with open(tmp_path, "w") as f:
+            write(f)
+        return replace_if_changed(tmp_path, path)
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
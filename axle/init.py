@@ -6,8 +6,10 @@ import os
 from openpyxl import Workbook
 from .add import add
 from .exceptions import InitError
-from .helpers import get_version, set_logging
+from .helpers import COMPRESSION_LEVELS, SHEET_FIELDS, get_version, set_logging
 from .push import push
+from .state import BACKENDS, import_state
+from .xlsx import save_workbook
 
 
 DEFAULT_FORMATS = {
@@ -53,7 +55,15 @@ DEFAULT_FORMATS = {
 }
 
 
-def init(title, filepath=None, directory=None, file_format="tsv", verbose=False):
+def init(
+    title,
+    filepath=None,
+    directory=None,
+    file_format="tsv",
+    state="tsv",
+    compression="default",
+    verbose=False,
+):
     set_logging(verbose)
     cwd = os.getcwd()
     if os.path.exists(".axle"):
@@ -63,12 +73,20 @@ def init(title, filepath=None, directory=None, file_format="tsv", verbose=False)
 
     if file_format.lower() not in ["tsv", "csv"]:
         raise InitError("Unknown default file format: " + file_format)
+    if state not in BACKENDS:
+        raise InitError("Unknown state backend: " + state)
+    if compression not in COMPRESSION_LEVELS:
+        raise InitError("Unknown compression level: " + compression)
 
     logging.info(f"initializing AXLE project '{title}' in {cwd}/.axle/")
     os.mkdir(".axle")
     if not filepath:
         filepath = title.replace(" ", "_") + ".xlsx"
-    write_data(title, filepath, directory=directory, file_format=file_format)
+    write_data(
+        title, filepath, directory=directory, file_format=file_format, compression=compression
+    )
+    if state == "sqlite":
+        import_state(os.path.abspath(".axle"))
 
     if os.path.exists(filepath):
         logging.warning("A spreadsheet already exists at " + filepath)
@@ -76,7 +94,7 @@ def init(title, filepath=None, directory=None, file_format="tsv", verbose=False)
     else:
         # Create new XLSX spreadsheet
         wb = Workbook()
-        wb.save(filepath)
+        save_workbook(wb, filepath, compression)
 
     # Add all from provided directory
     if directory:
@@ -91,7 +109,7 @@ def init(title, filepath=None, directory=None, file_format="tsv", verbose=False)
     return True
 
 
-def write_data(title, filepath, directory=None, file_format="tsv"):
+def write_data(title, filepath, directory=None, file_format="tsv", compression="default"):
     """Create AXLE data files in .axle directory: sheet.tsv."""
     # Create the "tracked" directory
     os.mkdir(".axle/tracked")
@@ -106,6 +124,7 @@ def write_data(title, filepath, directory=None, file_format="tsv"):
         writer.writerow({"Key": "Spreadsheet Path", "Value": filepath})
         writer.writerow({"Key": "Directory", "Value": directory})
         writer.writerow({"Key": "File Format", "Value": file_format.lower()})
+        writer.writerow({"Key": "Compression", "Value": compression})
 
     with open(f".axle/note.tsv", "w") as f:
         writer = csv.DictWriter(
@@ -133,6 +152,6 @@ def write_data(title, filepath, directory=None, file_format="tsv"):
             f,
             delimiter="\t",
             lineterminator="\n",
-            fieldnames=["Title", "Path", "Frozen Rows", "Frozen Columns"],
+            fieldnames=SHEET_FIELDS,
         )
         writer.writeheader()
@@ -1,23 +1,190 @@
 import csv
+import logging
+import os
 import shutil
 
-from .helpers import get_cached_path, get_tracked_sheets, validate_axle_project
+from itertools import zip_longest
+from .exceptions import MergeError
+from .helpers import (
+    get_base_path,
+    get_cached_path,
+    get_cached_state,
+    get_manifest,
+    get_tracked_sheets,
+    replace_if_changed,
+    set_logging,
+    validate_axle_project,
+)
+from .profile import span
+from .table import Table
 
 
-def merge(verbose=False):
+def merge(on_sheets=None, three_way=False, key=None, verbose=False):
     """Update local copies of sheets based on cached copies.
-    This does not read the XLSX spreadsheet."""
+    This does not read the XLSX spreadsheet. If on_sheets is provided, only those sheets (and any
+    sheets that do not have a local copy yet) are updated.
+
+    By default, local copies are overwritten. With three_way, the rows that changed in the
+    spreadsheet since the last push are merged with the rows that changed in the local copy, using
+    the last pushed version as the base. Rows are matched by position, or by the value in the key
+    column if provided. Rows that changed on both sides are conflicts: the local row is kept.
+    Return a dict of sheet title -> list of conflicts."""
     # TODO: handle renamed sheets
+    set_logging(verbose)
     axle_dir = validate_axle_project()
+    pushed = {x["Title"]: x for x in get_manifest(axle_dir).get("Sheets", [])}
+    sheet_conflicts = {}
     for sheet_title, details in get_tracked_sheets(axle_dir).items():
         local_path = details["Path"]
+        if on_sheets is not None and sheet_title not in on_sheets and os.path.exists(local_path):
+            continue
         cached_path = get_cached_path(axle_dir, sheet_title)
-        if local_path.endswith(".csv"):
-            with open(cached_path, "r") as fr:
-                reader = csv.reader(fr, delimiter="\t")
-                with open(local_path, "w") as fw:
-                    writer = csv.writer(fw, delimiter=",", lineterminator="\n")
-                    for row in reader:
-                        writer.writerow(row)
+        if (three_way or key) and os.path.exists(local_path):
+            base_path = get_base_path(axle_dir, sheet_title)
+            if not os.path.exists(base_path):
+                # Without a base, the cached copy is the base if it has not changed since the push
+                pushed_cached = pushed.get(sheet_title, {}).get("Cached")
+                if not pushed_cached or get_cached_state(cached_path) != pushed_cached:
+                    logging.warning(
+                        f"'{sheet_title}' has not been pushed, so it cannot be merged with "
+                        f"{local_path} - run merge without --three-way to overwrite it"
+                    )
+                    continue
+                base_path = cached_path
+            with span("merge sheet", sheet=sheet_title):
+                conflicts = merge_three_way(base_path, local_path, cached_path, key=key)
+            for conflict in conflicts:
+                logging.warning(f"Conflict in '{sheet_title}': {conflict}")
+            if conflicts:
+                sheet_conflicts[sheet_title] = conflicts
+            continue
+        with span("merge sheet", sheet=sheet_title):
+            if local_path.endswith(".csv"):
+                with open(cached_path, "r") as fr:
+                    reader = csv.reader(fr, delimiter="\t")
+                    with open(local_path, "w") as fw:
+                        writer = csv.writer(fw, delimiter=",", lineterminator="\n")
+                        for row in reader:
+                            writer.writerow(row)
+            else:
+                shutil.copy(cached_path, local_path)
+    return sheet_conflicts
+
+
+def get_row_hash(row):
+    """Return a hash of a row (list of values), or None if the row does not exist."""
+    if row is None:
+        return None
+    return hash(tuple(row))
+
+
+def merge_row(base_hash, local, remote):
+    """Return the merged version of a row (or None if it was deleted) from the hash of the base
+    version and the local and remote versions, and True if the row changed on both sides."""
+    local_hash = get_row_hash(local)
+    remote_hash = get_row_hash(remote)
+    if local_hash == remote_hash or remote_hash == base_hash:
+        return local, False
+    if local_hash == base_hash:
+        return remote, False
+    return local, True
+
+
+def merge_three_way(base_path, local_path, cached_path, key=None):
+    """Merge the changes to a sheet in the spreadsheet (its cached copy) into its local copy, using
+    the last pushed version as the base. Each row is hashed so that only one version of each row
+    needs to be compared. Without a key, rows are matched by position and the tables are read one
+    row at a time. With a key, rows are matched by the value in the key column; new rows from the
+    spreadsheet are added to the end. The local copy is only replaced if it changes. Return a list
+    of conflicts."""
+    delimiter = "\t"
+    if local_path.endswith(".csv"):
+        delimiter = ","
+    conflicts = []
+    tmp_path = local_path + ".tmp"
+    with open(base_path, "r") as fb, open(local_path, "r") as fl, open(cached_path, "r") as fc:
+        base_rows = csv.reader(fb, delimiter="\t")
+        local_rows = csv.reader(fl, delimiter=delimiter)
+        remote_rows = csv.reader(fc, delimiter="\t")
+        if key:
+            rows = merge_rows_by_key(base_rows, local_rows, remote_rows, key, conflicts)
         else:
-            shutil.copy(cached_path, local_path)
+            rows = merge_rows_by_position(base_rows, local_rows, remote_rows, conflicts)
+        try:
+            with open(tmp_path, "w") as fw:
+                writer = csv.writer(fw, delimiter=delimiter, lineterminator="\n")
+                for row in rows:
+                    writer.writerow(row)
+        except MergeError:
+            os.remove(tmp_path)
+            raise
+    replace_if_changed(tmp_path, local_path)
+    return conflicts
+
+
+def merge_rows_by_key(base_rows, local_rows, remote_rows, key, conflicts):
+    """Yield the merged rows of a table, matching rows by the value in the key column. The headers
+    are merged like any other row. The base is kept as a dict of key -> row hash and the remote
+    version as a Table with a dict of key -> row number, and the local rows are read one at a
+    time."""
+    base_header = next(base_rows, None)
+    local_header = next(local_rows, None)
+    remote_header = next(remote_rows, None)
+    header, conflict = merge_row(get_row_hash(base_header), local_header, remote_header)
+    if conflict:
+        conflicts.append("row 1 (headers) changed in both versions")
+    if header is not None:
+        yield header
+
+    base = {}
+    for value, row in iter_keyed_rows(base_rows, base_header, key, "last pushed version"):
+        base[value] = get_row_hash(row)
+    remote = Table(header=False)
+    remote_keys = {}
+    for value, row in iter_keyed_rows(remote_rows, remote_header, key, "spreadsheet"):
+        remote_keys[value] = len(remote)
+        remote.append(row)
+    for value, local in iter_keyed_rows(local_rows, local_header, key, "local table"):
+        remote_row = None
+        if value in remote_keys:
+            remote_row = remote.get_row(remote_keys.pop(value))
+        row, conflict = merge_row(base.get(value), local, remote_row)
+        if conflict:
+            conflicts.append(f"row with {key} '{value}' changed in both versions")
+        if row is not None:
+            yield row
+    # Rows that are not in the local table
+    for value, row_number in remote_keys.items():
+        row, conflict = merge_row(base.get(value), None, remote.get_row(row_number))
+        if conflict:
+            conflicts.append(f"row with {key} '{value}' was removed locally and changed remotely")
+        if row is not None:
+            yield row
+
+
+def merge_rows_by_position(base_rows, local_rows, remote_rows, conflicts):
+    """Yield the merged rows of a table, matching rows by position."""
+    for row_number, (base, local, remote) in enumerate(
+        zip_longest(base_rows, local_rows, remote_rows), start=1
+    ):
+        row, conflict = merge_row(get_row_hash(base), local, remote)
+        if conflict:
+            conflicts.append(f"row {row_number} changed in both versions")
+        if row is not None:
+            yield row
+
+
+def iter_keyed_rows(rows, header, key, name):
+    """Yield the value in the key column and the row for each row of a table."""
+    if header is None:
+        return
+    if key not in header:
+        raise MergeError(f"Key column '{key}' does not exist in the {name}")
+    idx = header.index(key)
+    seen = set()
+    for row in rows:
+        value = row[idx] if idx < len(row) else ""
+        if value in seen:
+            raise MergeError(f"More than one row in the {name} has '{value}' in key column '{key}'")
+        seen.add(value)
+        yield value, row
@@ -0,0 +1,99 @@
+"""Profile the phases of AXLE commands. When profiling has been started (e.g., with the global
+--profile option), each phase wrapped in a span is timed and counters are added up, and the trace
+can be written as JSON. When it has not been started, span returns a shared context manager that
+does nothing and count returns right away, so profiling costs almost nothing."""
+import json
+import os
+import sys
+import time
+
+from contextlib import contextmanager, nullcontext
+
+NULL_SPAN = nullcontext()
+
+# The trace of the current command, or None when not profiling
+trace = None
+
+
+def start_profile(command):
+    """Start profiling a command. Any trace that was already started is discarded."""
+    global trace
+    trace = {
+        "command": command,
+        "argv": sys.argv[1:],
+        "pid": os.getpid(),
+        "start": time.perf_counter(),
+        "spans": [],
+        "stack": [],
+        "counters": {},
+    }
+
+
+def stop_profile():
+    """Stop profiling and return the trace as a dict, or None if profiling was not started. Each
+    span has a name, its parent span, and its start (relative to the start of the command) and
+    duration in seconds; the totals have the number of calls and total duration of each span."""
+    global trace
+    if trace is None:
+        return None
+    end = time.perf_counter()
+    totals = {}
+    for s in trace["spans"]:
+        total = totals.setdefault(s["name"], {"calls": 0, "duration": 0.0})
+        total["calls"] += 1
+        total["duration"] += s["duration"]
+    result = {
+        "command": trace["command"],
+        "argv": trace["argv"],
+        "duration": end - trace["start"],
+        "spans": sorted(trace["spans"], key=lambda s: s["start"]),
+        "totals": totals,
+        "counters": trace["counters"],
+    }
+    trace = None
+    return result
+
+
+def count(name, n=1):
+    """Add n to a counter if profiling."""
+    if trace is None:
+        return
+    counters = trace["counters"]
+    counters[name] = counters.get(name, 0) + n
+
+
+def span(name, **attributes):
+    """Return a context manager that times a phase as a span if profiling. Any attributes (e.g.,
+    the sheet title) are added to the span."""
+    if trace is None:
+        return NULL_SPAN
+    return timed_span(name, attributes)
+
+
+@contextmanager
+def timed_span(name, attributes):
+    """Time a span and add it to the trace when it ends."""
+    stack = trace["stack"]
+    parent = stack[-1] if stack else None
+    stack.append(name)
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        end = time.perf_counter()
+        stack.pop()
+        if trace is not None:
+            s = {"name": name, "parent": parent}
+            s.update(attributes)
+            s["start"] = start - trace["start"]
+            s["duration"] = end - start
+            trace["spans"].append(s)
+
+
+def write_profile(path):
+    """Stop profiling and write the trace to path as JSON."""
+    result = stop_profile()
+    if result is None:
+        return
+    with open(path, "w") as f:
+        f.write(json.dumps(result, indent=4))
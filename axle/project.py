@@ -0,0 +1,165 @@
+"""Run AXLE commands from Python on a project that is loaded once. The project state is read when it
+is first needed and changes to it are kept in memory until they are committed, so that scripts that
+run many commands (e.g., adding thousands of tables) do not read and write the state each time."""
+import logging
+
+from .add import add_sheets
+from .apply import apply_to_sheets, iter_messages
+from .clear import clear_formats, clear_notes, get_area, get_clear_sheets
+from .fetch import fetch
+from .helpers import (
+    get_config,
+    get_sheet_formats,
+    get_sheet_notes,
+    get_tracked_sheets,
+    set_logging,
+    update_formats,
+    update_notes,
+    update_tracked_sheets,
+    validate_axle_project,
+)
+from .push import push
+from .rm import remove_sheet_files, remove_sheets
+
+
+class Project:
+    """An AXLE project in this or a parent directory. The add, rm, clear, and apply methods work
+    like the commands with the same names, but only change the project in memory until commit is
+    called. Used as a context manager, the changes are committed on exit, unless there was an
+    error. The fetch and push methods commit any changes first."""
+
+    def __init__(self, verbose=False):
+        set_logging(verbose)
+        self.axle_dir = validate_axle_project()
+        self.config = get_config(self.axle_dir)
+        self.load()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.commit()
+
+    def load(self):
+        """Load the tracked sheets and discard any changes that have not been committed. The
+        formats and notes are loaded when they are first needed."""
+        self.sheets = get_tracked_sheets(self.axle_dir)
+        self.path_to_title = {details["Path"]: title for title, details in self.sheets.items()}
+        self.sheet_formats = None
+        self.sheet_notes = None
+        self.sheets_changed = False
+        # Titles of the sheets whose formats or notes changed
+        self.formats_changed = set()
+        self.notes_changed = set()
+        # (sheet titles, table paths, keep) for each rm
+        self.removed = []
+
+    def get_sheet_formats(self):
+        """Return the dict of sheet title -> cell -> format ID, loading it if needed."""
+        if self.sheet_formats is None:
+            self.sheet_formats = get_sheet_formats(self.axle_dir)
+        return self.sheet_formats
+
+    def get_sheet_notes(self):
+        """Return the dict of sheet title -> cell -> note, loading it if needed."""
+        if self.sheet_notes is None:
+            self.sheet_notes = get_sheet_notes(self.axle_dir)
+        return self.sheet_notes
+
+    def add(self, path, title=None, freeze_row=0, freeze_column=0):
+        """Add a table, or the tables in a directory (see add). Return the titles of the new
+        sheets."""
+        added = add_sheets(
+            self.sheets,
+            path,
+            title=title,
+            freeze_row=freeze_row,
+            freeze_column=freeze_column,
+            path_to_title=self.path_to_title,
+        )
+        self.sheets_changed = True
+        return added
+
+    def rm(self, paths, keep=False):
+        """Stop tracking the tables at paths (see rm). The tables (unless keep is True) and the
+        cached copies of their sheets are removed when the changes are committed. Return the titles
+        of the removed sheets."""
+        removed = remove_sheets(self.sheets, paths)
+        for details in removed.values():
+            del self.path_to_title[details["Path"]]
+        self.removed.append((list(removed.keys()), paths, keep))
+        self.sheets_changed = True
+        return list(removed.keys())
+
+    def clear(self, keyword, on_sheets=None, cell_range=None, rows=None, columns=None):
+        """Remove formats and/or notes from one or more sheets (see clear)."""
+        on_sheets = get_clear_sheets(keyword, self.sheets, on_sheets=on_sheets)
+        area = get_area(cell_range=cell_range, rows=rows, columns=columns)
+        if keyword in ["formats", "all"]:
+            sheet_formats = self.get_sheet_formats()
+            for st in on_sheets:
+                sheet_formats[st] = clear_formats(st, sheet_formats.get(st), area=area)
+            self.formats_changed.update(on_sheets)
+        if keyword in ["notes", "all"]:
+            sheet_notes = self.get_sheet_notes()
+            for st in on_sheets:
+                sheet_notes[st] = clear_notes(st, sheet_notes.get(st), area=area)
+            self.notes_changed.update(on_sheets)
+
+    def apply(self, paths):
+        """Apply one or more message tables to the sheets as formats and notes (see apply). Return
+        a dict of sheet title -> level -> number of messages applied."""
+        sheet_formats = self.get_sheet_formats()
+        sheet_notes = self.get_sheet_notes()
+        counts = apply_to_sheets(
+            self.sheets, sheet_formats, sheet_notes, [iter_messages(p) for p in paths]
+        )
+        # Applied formats and notes are replaced in every sheet
+        self.formats_changed.update(sheet_formats.keys())
+        self.notes_changed.update(sheet_notes.keys())
+        return counts
+
+    def commit(self):
+        """Write the changes to the project state. Each state file is replaced in one step, and
+        only if its contents changed. The tracked sheets are written after the formats and notes,
+        and the removed tables and cached copies are only deleted after that."""
+        if self.formats_changed:
+            update_formats(self.axle_dir, self.sheet_formats, sheet_titles=self.formats_changed)
+            self.formats_changed = set()
+        if self.notes_changed:
+            update_notes(self.axle_dir, self.sheet_notes, sheet_titles=self.notes_changed)
+            self.notes_changed = set()
+        if self.sheets_changed:
+            update_tracked_sheets(
+                self.axle_dir, [dict(details, Title=t) for t, details in self.sheets.items()]
+            )
+            self.sheets_changed = False
+        for sheet_titles, paths, keep in self.removed:
+            remove_sheet_files(self.axle_dir, sheet_titles, paths, keep=keep)
+        self.removed = []
+
+    def fetch(self, streaming=False, engine="openpyxl"):
+        """Commit any changes, then fetch the spreadsheet (see fetch) and reload the project.
+        Return the titles of the sheets whose cached copies changed."""
+        self.commit()
+        changed = fetch(streaming=streaming, engine=engine)
+        self.load()
+        return changed
+
+    def push(
+        self, streaming=False, full=False, jobs=1, compression=None, typed=None, shard_rows=None
+    ):
+        """Commit any changes, then push the tables to the spreadsheet (see push) and reload the
+        tracked sheets, which record the shards of each table."""
+        self.commit()
+        logging.info(f"pushing {len(self.sheets)} sheet(s) to {self.config['Spreadsheet Path']}")
+        push(
+            streaming=streaming,
+            full=full,
+            jobs=jobs,
+            compression=compression,
+            typed=typed,
+            shard_rows=shard_rows,
+        )
+        self.load()
@@ -1,21 +1,67 @@
 import csv
 import logging
 import os
+import re
+import tempfile
 
+from collections import defaultdict
+from concurrent.futures import ProcessPoolExecutor
+from itertools import islice
 from openpyxl import Workbook
+from openpyxl.cell import WriteOnlyCell
 from openpyxl.comments import Comment
 from openpyxl.styles import Alignment, Border, Color, Font, PatternFill, Side
+from .compat import get_style, set_style
+from .exceptions import PushError
 from .helpers import (
+    MAX_ROWS,
+    a1_to_rowcol,
     col_to_a1,
+    get_base_path,
     get_cached_path,
+    get_cached_state,
+    get_compression,
     get_config,
+    get_entries_hash,
+    get_file_state,
     get_format_dict,
+    get_format_hash,
+    get_manifest,
+    get_shard_locations,
+    get_shard_rows,
+    get_shard_titles,
     get_sheet_formats,
     get_sheet_notes,
+    get_state_file_states,
     get_tracked_sheets,
+    iter_row_entries,
     set_logging,
+    update_manifest,
+    update_tracked_sheets,
     validate_axle_project,
 )
+from .profile import count, span
+from .table import Table
+from .xlsx import assemble, save_workbook, use_worksheet_writer
+
+# Sheet state that determines the contents of a sheet in the spreadsheet
+SHEET_STATE_KEYS = [
+    "Path",
+    "Hash",
+    "Format Hash",
+    "Note Hash",
+    "Frozen Rows",
+    "Frozen Columns",
+    "Typed",
+    "Shard Rows",
+]
+
+# Matches a column of values (each followed by a newline) that can all be written as numbers: no
+# sign on zero, no leading zeros, no trailing zeros after the decimal point, and no exponent
+NUMBER_COLUMN_RE = re.compile(r"(?:(?!-0\n)-?(?:0|[1-9]\d*)(?:\.\d*[1-9])?\n)*")
+
+# Number of rows whose column types are found together in streaming mode
+TYPE_BATCH_SIZE = 10000
 
 
 def apply_format(cell, fmt):
@@ -68,6 +114,24 @@ def apply_format(cell, fmt):
         cell.number_format = number_format
 
 
+def apply_format_id(cell, fmt_id, id_to_format, style_cache):
+    """Apply a format to a cell by its format ID. The style for each format ID is only built once
+    per workbook; after that, the cached style is copied to each cell that uses that format."""
+    cached = style_cache.get(fmt_id)
+    if cached:
+        style, hyperlink = cached
+        set_style(cell, style)
+        if hyperlink:
+            cell.hyperlink = hyperlink
+        return
+    fmt = id_to_format.get(fmt_id)
+    if not fmt:
+        logging.error("Unknown format ID: " + str(fmt_id))
+        return
+    apply_format(cell, fmt)
+    style_cache[fmt_id] = (get_style(cell), fmt.get("hyperlink"))
+
+
 def clear_xlsx_sheets(wb, tracked_sheets):
     """Clear all data from XLSX sheets and return a map of sheet title -> sheet obj."""
     xlsx_sheets = {}
@@ -82,73 +146,694 @@ def clear_xlsx_sheets(wb, tracked_sheets):
     return xlsx_sheets
 
 
-def push_data(axle_dir, wb, tracked_sheets):
-    """Push all tracked sheets to the spreadsheet."""
-    sheet_formats = get_sheet_formats(axle_dir)
-    sheet_notes = get_sheet_notes(axle_dir)
-    id_to_format = get_format_dict(axle_dir)
+def get_column_type(values):
+    """Return the type to write a column of table values as: "number" if every value is written the
+    way Excel writes that number (with at most 15 significant digits, which Excel keeps exactly),
+    "bool" if every value is TRUE or FALSE, or None to write the values as text. Empty values are
+    ignored. Values written as numbers or booleans are fetched as the same text."""
+    values = [v for v in values if v]
+    if not values:
+        return None
+    # The whole column is checked with one match, so text columns are rejected quickly
+    text = "\n".join(values) + "\n"
+    if NUMBER_COLUMN_RE.fullmatch(text):
+        if "\n".join([format(float(v), ".15g") for v in values]) + "\n" == text:
+            return "number"
+        return None
+    if set(values) <= {"TRUE", "FALSE"}:
+        return "bool"
+    return None
+
+
+def get_sheet_state(
+    details, cell_formats, cell_notes, id_to_format, previous=None, typed=False, shard_rows=None
+):
+    """Return the state of a tracked sheet that determines its contents in the spreadsheet: the
+    table file, the formats and notes on its cells, the frozen rows & columns, whether its values
+    are typed, and the number of rows in each shard."""
+    state = get_file_state(details["Path"], previous)
+    state["Format Hash"] = get_format_hash(cell_formats, id_to_format)
+    state["Note Hash"] = get_entries_hash(cell_notes)
+    state["Frozen Rows"] = details["Frozen Rows"]
+    state["Frozen Columns"] = details["Frozen Columns"]
+    if typed:
+        state["Typed"] = True
+    if shard_rows:
+        state["Shard Rows"] = shard_rows
+    return state
+
+
+def set_column_types(table, column_types=None):
+    """Replace the values of the number and boolean columns (see get_column_type) of a table below
+    the header with ints, floats, and bools. Only the distinct values of each column are checked
+    and converted. Empty values are not changed. If column_types (a list of the type of each column)
+    is provided, the columns are converted to those types instead of checking their values."""
+    for col, values in enumerate(table.values):
+        if column_types is None:
+            column_type = get_column_type(values[1:])
+        else:
+            column_type = column_types[col] if col < len(column_types) else None
+        if column_type == "bool":
+            table.map_values(col, lambda v: v == "TRUE" if v else v)
+        elif column_type == "number":
+            table.map_values(col, lambda v: (float(v) if "." in v else int(v)) if v else v)
+
+
+def get_column_types(rows):
+    """Return a list of the type of each column (see get_column_type) of the table values after the
+    header. The rows are checked in batches of TYPE_BATCH_SIZE, so only one batch is held in memory,
+    and a column is only typed if it has the same type in every batch with values in it, so that the
+    types are the same as for the whole table."""
+    rows = iter(rows)
+    next(rows, None)
+    col_to_type = {}
+    batch = list(islice(rows, TYPE_BATCH_SIZE))
+    while batch:
+        for col, values in enumerate(Table(batch, header=False).values):
+            if not any(values[1:]):
+                continue
+            column_type = get_column_type(values[1:])
+            if col_to_type.setdefault(col, column_type) != column_type:
+                col_to_type[col] = None
+        batch = list(islice(rows, TYPE_BATCH_SIZE))
+    return [col_to_type.get(col) for col in range(max(col_to_type, default=-1) + 1)]
+
+
+def iter_typed_rows(rows, column_types):
+    """Yield each row of table values with a copy of the row with its values converted to the types
+    of the columns (see set_column_types). The values are converted for each batch of
+    TYPE_BATCH_SIZE rows after the header, so only one batch is held in memory."""
+    rows = iter(rows)
+    header = next(rows, None)
+    if header is None:
+        return
+    yield header, header
+    batch = list(islice(rows, TYPE_BATCH_SIZE))
+    while batch:
+        table = Table(batch, header=False)
+        set_column_types(table, column_types)
+        yield from zip(batch, table)
+        batch = list(islice(rows, TYPE_BATCH_SIZE))
+
+
+def new_workbook(streaming=False):
+    """Create an empty workbook to push sheets to."""
+    if streaming:
+        return Workbook(write_only=True)
+    wb = Workbook()
+    wb.remove_sheet(wb.get_sheet_by_name("Sheet"))
+    return wb
+
+
+def push_data(
+    axle_dir,
+    wb,
+    tracked_sheets,
+    streaming=False,
+    sheet_formats=None,
+    sheet_notes=None,
+    id_to_format=None,
+    strings=None,
+    shard_rows=None,
+):
+    """Push all tracked sheets to the spreadsheet. If streaming, the workbook must be write-only and
+    each row is written to the sheet as soon as it is read from the table. The formats and notes
+    are read from the AXLE directory unless provided.
+
+    If strings is not None, the values of number and boolean columns are written as numbers and
+    booleans, and text is written as shared strings, which are added to the strings dict (this must
+    then be given to save_workbook).
+
+    If shard_rows is given, a table with more rows than that after the header is split into
+    shards, which are written to sheets with the header repeated (see get_shard_titles). Return a
+    dict of sheet title -> number of shards for the tables that were pushed."""
+    if sheet_formats is None:
+        sheet_formats = get_sheet_formats(axle_dir)
+    if sheet_notes is None:
+        sheet_notes = get_sheet_notes(axle_dir)
+    if id_to_format is None:
+        id_to_format = get_format_dict(axle_dir)
+    # Format ID -> cached cell style for this workbook
+    style_cache = {}
+    sheet_shards = {}
     for sheet_title, details in tracked_sheets.items():
         sheet_path = details["Path"]
-        delimiter = "\t"
-        if sheet_path.endswith(".csv"):
-            delimiter = ","
-        rows = []
-        cols = 0
         if not os.path.exists(sheet_path):
             logging.warning(f"'{sheet_title}' exists in XLSX but has not been pulled")
             continue
 
-        with open(sheet_path, "r") as fr:
-            reader = csv.reader(fr, delimiter=delimiter)
-            cached_sheet = get_cached_path(axle_dir, sheet_title)
-            with open(cached_sheet, "w") as fw:
-                writer = csv.writer(fw, delimiter="\t", lineterminator="\n")
-                for row in reader:
-                    writer.writerow(row)
-                    row_len = len(row)
-                    if row_len > cols:
-                        cols = row_len
-                    rows.append(row)
-
         logging.info(f"pushing data from {sheet_path} to XLSX sheet '{sheet_title}'")
-        sheet = wb.create_sheet(sheet_title)
-
         cell_formats = sheet_formats.get(sheet_title, {})
         cell_notes = sheet_notes.get(sheet_title, {})
 
         # TODO: push validation
 
-        for row in range(0, len(rows)):
-            for col in range(0, cols):
-                value = rows[row][col]
-                cell = sheet.cell(column=col + 1, row=row + 1, value=value)
-                fmt_id = cell_formats.get(cell.coordinate)
-                if fmt_id:
-                    fmt = id_to_format.get(fmt_id)
-                    if not fmt:
-                        logging.error("Unknown format ID: " + str(fmt_id))
-                    apply_format(cell, fmt)
-                note = cell_notes.get(cell.coordinate)
-                if note:
-                    cell.comment = Comment(note["text"], note["author"])
-
-        # Add frozen rows & cols
-        frozen_row = int(details["Frozen Rows"]) + 1
-        frozen_col = col_to_a1(int(details["Frozen Columns"]) + 1)
-        sheet.freeze_panes = frozen_col + str(frozen_row)
-
-
-def push(verbose=False):
+        cached_sheet = get_cached_path(axle_dir, sheet_title)
+        if streaming:
+            sheet_shards[sheet_title] = push_sheet_streaming(
+                wb,
+                sheet_title,
+                details,
+                cached_sheet,
+                cell_formats,
+                cell_notes,
+                id_to_format,
+                style_cache,
+                strings=strings,
+                shard_rows=shard_rows,
+            )
+        else:
+            sheet_shards[sheet_title] = push_sheet(
+                wb,
+                sheet_title,
+                details,
+                cached_sheet,
+                cell_formats,
+                cell_notes,
+                id_to_format,
+                style_cache,
+                typed=strings is not None,
+                shard_rows=shard_rows,
+            )
+    count("distinct formats", len(style_cache))
+    return sheet_shards
+
+
+def push_sheet(
+    wb,
+    sheet_title,
+    details,
+    cached_sheet,
+    cell_formats,
+    cell_notes,
+    id_to_format,
+    style_cache,
+    typed=False,
+    shard_rows=None,
+):
+    """Read a table into memory (see Table) and write its cells to a sheet, or to one sheet for each
+    shard of the table (see push_data), then apply the formats and attach the notes within the
+    table. Only the cells with values, formats, or notes are created, plus the last cell of each
+    sheet so that the sheet has the size of its part of the table. If typed, the values of number
+    and boolean columns are written as numbers and booleans (see set_column_types). Return the
+    number of shards."""
+    sheet_path = details["Path"]
+    delimiter = "\t"
+    if sheet_path.endswith(".csv"):
+        delimiter = ","
+    with span("read tables", sheet=sheet_title), open(sheet_path, "r") as fr:
+        reader = csv.reader(fr, delimiter=delimiter)
+        with open(cached_sheet, "w") as fw:
+            writer = csv.writer(fw, delimiter="\t", lineterminator="\n")
+            table = Table(write_rows(writer, reader))
+
+    if typed:
+        with span("find column types", sheet=sheet_title):
+            set_column_types(table)
+
+    shards = 1
+    if shard_rows and len(table) - 1 > shard_rows:
+        shards = -(-(len(table) - 1) // shard_rows)
+    elif len(table) > MAX_ROWS:
+        raise PushError(f"'{sheet_title}' has more than {MAX_ROWS} rows (see --shard-rows)")
+    sheets = [create_sheet(wb, title, details) for title in get_shard_titles(sheet_title, shards)]
+
+    with span("build cells", sheet=sheet_title):
+        cells = 0
+        for row, col, value in table.iter_values():
+            for shard, shard_row in get_shard_locations(row + 1, shard_rows, shards):
+                sheets[shard - 1].cell(row=shard_row, column=col + 1, value=value)
+            cells += 1
+        if len(table) and table.width:
+            for shard, sheet in enumerate(sheets, start=1):
+                last_row = len(table)
+                if shards > 1:
+                    last_row = min(len(table), shard * shard_rows + 1) - (shard - 1) * shard_rows
+                # An empty cell is written as an empty string, otherwise openpyxl skips it
+                cell = sheet.cell(row=last_row, column=table.width)
+                if cell.value is None:
+                    cell.value = ""
+    count("cells", cells)
+
+    with span("apply formats", sheet=sheet_title):
+        styled = table.set_formats(cell_formats)
+        for row, col, fmt_id in table.iter_formats():
+            for shard, shard_row in get_shard_locations(row + 1, shard_rows, shards):
+                cell = sheets[shard - 1].cell(row=shard_row, column=col + 1)
+                apply_format_id(cell, fmt_id, id_to_format, style_cache)
+    count("styled cells", styled)
+
+    with span("attach notes", sheet=sheet_title):
+        noted = table.set_notes(cell_notes)
+        for row, col, note in table.iter_notes():
+            for shard, shard_row in get_shard_locations(row + 1, shard_rows, shards):
+                cell = sheets[shard - 1].cell(row=shard_row, column=col + 1)
+                cell.comment = Comment(note["text"], note["author"])
+    count("notes", noted)
+    return shards
+
+
+def push_sheet_streaming(
+    wb,
+    sheet_title,
+    details,
+    cached_sheet,
+    cell_formats,
+    cell_notes,
+    id_to_format,
+    style_cache,
+    strings=None,
+    shard_rows=None,
+):
+    """Write a table to a write-only sheet one row at a time, or to one sheet for each shard of the
+    table (see push_data). Only the current row is held in memory; cells with a format or a note
+    are written as styled cells. As in push_sheet, empty values are skipped except for the last cell
+    of each sheet. If strings is not None, the text is written as shared strings (see push_data)
+    and the column types are found before the sheet is written by reading the table one batch of
+    rows at a time (see get_column_types). Return the number of shards."""
+    sheet_path = details["Path"]
+    delimiter = "\t"
+    if sheet_path.endswith(".csv"):
+        delimiter = ","
+
+    # Ranges of formats are expanded one row at a time, and notes are indexed by row number so each
+    # row only looks at its own cells
+    row_formats = iter_row_entries(cell_formats)
+    row_to_notes = defaultdict(dict)
+    for coordinate, note in cell_notes.items():
+        row, col = a1_to_rowcol(coordinate)
+        row_to_notes[row][col] = note
+
+    cells = 0
+    styled = 0
+    noted = 0
+    width = 0
+    sheet = None
+    shards = 0
+    # Tables are read as the cells are built, so both are in one span
+    with span("build cells", sheet=sheet_title), open(sheet_path, "r") as fr:
+        reader = csv.reader(fr, delimiter=delimiter)
+        if strings is not None:
+            # The types are found for the whole table first, as they are for a table in memory
+            with span("find column types", sheet=sheet_title):
+                column_types = get_column_types(reader)
+            fr.seek(0)
+            rows = iter_typed_rows(csv.reader(fr, delimiter=delimiter), column_types)
+        else:
+            rows = ((row, row) for row in reader)
+        with open(cached_sheet, "w") as fw:
+            writer = csv.writer(fw, delimiter="\t", lineterminator="\n")
+            for row_idx, ((row, typed_row), last) in enumerate(mark_last(rows), start=1):
+                writer.writerow(row)
+                width = max(width, len(row))
+                formats = next(row_formats, {})
+                notes = row_to_notes.pop(row_idx, {})
+                # Empty values are not written
+                values = [None if value == "" else value for value in typed_row]
+                cells += len(values) - values.count(None)
+                if row_idx == 1:
+                    header = (values, formats, notes)
+                if sheet is None:
+                    sheet = create_sheet(wb, sheet_title, details, strings=strings)
+                    shards = 1
+                elif shard_rows and row_idx > 2 and (row_idx - 2) % shard_rows == 0:
+                    # Start the next shard, with the same header as the first
+                    if shards == 1:
+                        sheet.title = get_shard_titles(sheet_title, 2)[0]
+                    shards += 1
+                    title = get_shard_titles(sheet_title, shards)[-1]
+                    sheet = create_sheet(wb, title, details, strings=strings)
+                    styled_header, noted_header = append_row(
+                        sheet, *header, id_to_format, style_cache
+                    )
+                    styled += styled_header
+                    noted += noted_header
+                elif not shard_rows and row_idx > MAX_ROWS:
+                    # Finish the sheet first, so that it is not left open when the push stops
+                    sheet.close()
+                    raise PushError(
+                        f"'{sheet_title}' has more than {MAX_ROWS} rows (see --shard-rows)"
+                    )
+                end_of_shard = shard_rows and row_idx > 1 and (row_idx - 1) % shard_rows == 0
+                if width and (last or end_of_shard):
+                    # An empty cell is written as an empty string, otherwise openpyxl skips it
+                    values.extend([None] * (width - len(values)))
+                    if values[-1] is None:
+                        values[-1] = ""
+                styled_row, noted_row = append_row(
+                    sheet, values, formats, notes, id_to_format, style_cache
+                )
+                styled += styled_row
+                noted += noted_row
+    if sheet is None:
+        # The table is empty
+        create_sheet(wb, sheet_title, details, strings=strings)
+        shards = 1
+    count("cells", cells)
+    count("styled cells", styled)
+    count("notes", noted)
+    return shards
+
+
+def push(
+    streaming=False,
+    full=False,
+    jobs=1,
+    compression=None,
+    typed=None,
+    shard_rows=None,
+    verbose=False,
+):
     """Push TSV/CSV tables to XLSX spreadsheet as sheets. Only the sheets in sheet.tsv will be
     pushed. If a sheet in the spreadsheet does not exist in sheet.tsv, it will be removed. Any sheet
-    in sheet.tsv that does not exist in the spreadsheet will be created."""
+    in sheet.tsv that does not exist in the spreadsheet will be created. If streaming, rows are
+    written straight to a write-only workbook so memory use does not grow with the table size.
+
+    Sheets that have not changed since the last push are copied from the current spreadsheet and
+    only the changed sheets are rebuilt, unless full is True or the spreadsheet itself has been
+    changed since the last push. With more than one job, the sheets are built in parallel.
+
+    The spreadsheet is written with the given level of compression, or else the Compression setting
+    of the project (see get_compression). It is written to a temporary file that then replaces the
+    spreadsheet, so the spreadsheet is never left partly written.
+
+    If typed (or, if typed is None, if the Typed setting of the project is "true"), columns of
+    numbers and booleans are written as numbers and booleans instead of text, and text is written
+    as shared strings, so that each distinct string is stored once (see push_data).
+
+    Tables with more rows after the header than shard_rows (or, if shard_rows is None, the Shard
+    Rows setting of the project) are split into shards, each pushed to its own sheet with the
+    header repeated (see get_shard_titles). The number of shards of each table is recorded in
+    sheet.tsv so that fetch can join them back together. Without shard rows, a table with more
+    rows than a sheet can hold cannot be pushed."""
     set_logging(verbose)
     axle_dir = validate_axle_project()
     config = get_config(axle_dir)
+    spreadsheet_path = config["Spreadsheet Path"]
+    compression = get_compression(config, compression)
+    if typed is None:
+        typed = config.get("Typed", "").lower() == "true"
+    shard_rows = get_shard_rows(config, shard_rows)
+
+    with span("read state"):
+        tracked_sheets = get_tracked_sheets(axle_dir)
+        sheet_formats = get_sheet_formats(axle_dir)
+        sheet_notes = get_sheet_notes(axle_dir)
+        id_to_format = get_format_dict(axle_dir)
+        manifest = get_manifest(axle_dir)
+
+    pushed = {x["Title"]: x for x in manifest.get("Sheets", [])}
+    sheet_states = {}
+    with span("hash sheets"):
+        for sheet_title, details in tracked_sheets.items():
+            if not os.path.exists(details["Path"]):
+                logging.warning(f"'{sheet_title}' exists in XLSX but has not been pulled")
+                continue
+            sheet_states[sheet_title] = get_sheet_state(
+                details,
+                sheet_formats.get(sheet_title, {}),
+                sheet_notes.get(sheet_title, {}),
+                id_to_format,
+                previous=pushed.get(sheet_title),
+                typed=typed,
+                shard_rows=shard_rows,
+            )
+
+    # Find the sheets that can be copied from the current spreadsheet
+    clean = []
+    previous = manifest.get("Spreadsheet")
+    if (
+        not full
+        and previous
+        and os.path.exists(spreadsheet_path)
+        and get_file_state(spreadsheet_path, previous) == previous
+    ):
+        for sheet_title, state in sheet_states.items():
+            if sheet_title not in pushed:
+                continue
+            if all(state.get(k) == pushed[sheet_title].get(k) for k in SHEET_STATE_KEYS):
+                clean.append(sheet_title)
+
+    push_kwargs = {
+        "streaming": streaming,
+        "sheet_formats": sheet_formats,
+        "sheet_notes": sheet_notes,
+        "id_to_format": id_to_format,
+        "compression": compression,
+        "typed": typed,
+        "shard_rows": shard_rows,
+    }
+    if not clean and (jobs <= 1 or not sheet_states):
+        wb = new_workbook(streaming)
+        strings = {} if typed else None
+        sheet_shards = push_data(
+            axle_dir,
+            wb,
+            {st: tracked_sheets[st] for st in sheet_states},
+            streaming=streaming,
+            sheet_formats=sheet_formats,
+            sheet_notes=sheet_notes,
+            id_to_format=id_to_format,
+            strings=strings,
+            shard_rows=shard_rows,
+        )
+        with span("save zip"):
+            save_workbook(wb, spreadsheet_path, compression, strings=strings)
+    elif clean and list(sheet_states.keys()) == clean and clean == list(pushed.keys()):
+        logging.info(f"{spreadsheet_path} is already up to date")
+        sheet_shards = {st: pushed[st].get("Shards", 1) for st in clean}
+    else:
+        dirty = {st: tracked_sheets[st] for st in sheet_states if st not in clean}
+        if clean:
+            logging.info(f"reusing {len(clean)} unchanged sheet(s) from {spreadsheet_path}")
+        # Write to a temporary directory next to the spreadsheet so it can be replaced in one step
+        spreadsheet_dir = os.path.dirname(os.path.abspath(spreadsheet_path))
+        with tempfile.TemporaryDirectory(dir=spreadsheet_dir) as tmp:
+            sources = build_sheets(axle_dir, tmp, dirty, jobs=jobs, **push_kwargs)
+            for sheet_title in clean:
+                sources[sheet_title] = (spreadsheet_path, pushed[sheet_title].get("Shards", 1))
+            if clean:
+                base_path = spreadsheet_path
+            else:
+                # Nothing to reuse, so start from the spreadsheet the first sheet was built in
+                base_path = sources[next(iter(sheet_states))][0]
+            sheets = []
+            sheet_shards = {}
+            for sheet_title in sheet_states.keys():
+                path, shards = sources[sheet_title]
+                sheets.extend((title, path) for title in get_shard_titles(sheet_title, shards))
+                sheet_shards[sheet_title] = shards
+            out_path = os.path.join(tmp, "out.xlsx")
+            with span("assemble zip"):
+                assemble(out_path, base_path, sheets, compression)
+                os.replace(out_path, spreadsheet_path)
+
+    with span("write caches"):
+        # The cached copies are now the last pushed versions, so older bases are no longer needed
+        for sheet_title in sheet_states.keys():
+            base_path = get_base_path(axle_dir, sheet_title)
+            if os.path.exists(base_path):
+                os.remove(base_path)
+
+        # Clean sheets were not read, so make sure their cached copies still match the tables
+        for sheet_title in clean:
+            cached_path = get_cached_path(axle_dir, sheet_title)
+            cached = pushed[sheet_title].get("Cached")
+            if not os.path.exists(cached_path) or cached != get_cached_state(cached_path):
+                write_cached_copy(tracked_sheets[sheet_title]["Path"], cached_path)
+
+    with span("write manifest"):
+        sheets = []
+        for sheet_title, state in sheet_states.items():
+            state["Title"] = sheet_title
+            state["Cached"] = get_cached_state(get_cached_path(axle_dir, sheet_title))
+            if sheet_shards[sheet_title] > 1:
+                state["Shards"] = sheet_shards[sheet_title]
+            sheets.append(state)
+        update_manifest(
+            axle_dir,
+            {
+                "Spreadsheet": get_file_state(spreadsheet_path, previous),
+                "Sheets": sheets,
+                "State": get_state_file_states(axle_dir, manifest.get("State")),
+            },
+        )
+
+        # Record the shards of each table so that fetch can join them
+        changed = False
+        for sheet_title, shards in sheet_shards.items():
+            details = tracked_sheets[sheet_title]
+            value = str(shards) if shards > 1 else ""
+            if (details.get("Shards") or "") != value:
+                details["Shards"] = value
+                changed = True
+        if changed:
+            update_tracked_sheets(axle_dir, [dict(d, Title=t) for t, d in tracked_sheets.items()])
+
+
+def build_sheets(
+    axle_dir,
+    tmp_dir,
+    tracked_sheets,
+    jobs=1,
+    streaming=False,
+    sheet_formats=None,
+    sheet_notes=None,
+    id_to_format=None,
+    compression="default",
+    typed=False,
+    shard_rows=None,
+):
+    """Build tracked sheets in new spreadsheets in tmp_dir. With one job, all sheets are built in
+    one spreadsheet. Otherwise, each sheet is built in its own spreadsheet by a pool of worker
+    processes. Return a dict of sheet title -> path to the spreadsheet containing that sheet and
+    the number of shards it was split into (see push_data)."""
+    if not tracked_sheets:
+        return {}
+    if jobs <= 1:
+        path = os.path.join(tmp_dir, "sheets.xlsx")
+        wb = new_workbook(streaming)
+        strings = {} if typed else None
+        sheet_shards = push_data(
+            axle_dir,
+            wb,
+            tracked_sheets,
+            streaming=streaming,
+            sheet_formats=sheet_formats,
+            sheet_notes=sheet_notes,
+            id_to_format=id_to_format,
+            strings=strings,
+            shard_rows=shard_rows,
+        )
+        with span("save zip"):
+            save_workbook(wb, path, compression, strings=strings)
+        return {sheet_title: (path, shards) for sheet_title, shards in sheet_shards.items()}
+
+    futures = {}
+    with ProcessPoolExecutor(max_workers=jobs) as executor:
+        for i, (sheet_title, details) in enumerate(tracked_sheets.items()):
+            # Only send each worker the formats and notes for its own sheet
+            futures[sheet_title] = executor.submit(
+                build_sheet,
+                axle_dir,
+                os.path.join(tmp_dir, f"sheet{i + 1}.xlsx"),
+                sheet_title,
+                details,
+                streaming,
+                {sheet_title: sheet_formats.get(sheet_title, {})},
+                {sheet_title: sheet_notes.get(sheet_title, {})},
+                id_to_format,
+                compression,
+                typed,
+                shard_rows,
+            )
+    return {sheet_title: future.result() for sheet_title, future in futures.items()}
+
+
+def build_sheet(
+    axle_dir,
+    path,
+    sheet_title,
+    details,
+    streaming,
+    sheet_formats,
+    sheet_notes,
+    id_to_format,
+    compression,
+    typed,
+    shard_rows,
+):
+    """Build one tracked sheet in a new spreadsheet at path and return the path and the number of
+    shards of the sheet. This runs in a worker process."""
+    wb = new_workbook(streaming)
+    strings = {} if typed else None
+    sheet_shards = push_data(
+        axle_dir,
+        wb,
+        {sheet_title: details},
+        streaming=streaming,
+        sheet_formats=sheet_formats,
+        sheet_notes=sheet_notes,
+        id_to_format=id_to_format,
+        strings=strings,
+        shard_rows=shard_rows,
+    )
+    save_workbook(wb, path, compression, strings=strings)
+    return path, sheet_shards[sheet_title]
+
+
+def append_row(sheet, values, formats, notes, id_to_format, style_cache):
+    """Append a row of values to a write-only sheet, with the given formats and notes (dicts of
+    column number -> format ID or note), which may be past the end of the row. Empty values must
+    be None. Return the number of cells with a format and with a note."""
+    if not formats and not notes:
+        sheet.append(values)
+        return 0, 0
+
+    # Every value in this row is written as its own cell, otherwise openpyxl reuses a noted cell
+    # without a style for the values that come after it
+    values = [None if v is None else WriteOnlyCell(sheet, value=v) for v in values]
+    values.extend([None] * (max(list(formats) + list(notes)) - len(values)))
+    styled = 0
+    noted = 0
+    for col in set(formats.keys()) | set(notes.keys()):
+        cell = values[col - 1]
+        if cell is None:
+            cell = WriteOnlyCell(sheet)
+        fmt_id = formats.get(col)
+        if fmt_id:
+            apply_format_id(cell, fmt_id, id_to_format, style_cache)
+            styled += 1
+        note = notes.get(col)
+        if note:
+            cell.comment = Comment(note["text"], note["author"])
+            noted += 1
+        values[col - 1] = cell
+    sheet.append(values)
+    return styled, noted
+
+
+def create_sheet(wb, sheet_title, details, strings=None):
+    """Create a sheet in a workbook with the frozen rows and columns of a tracked table. Sheets of a
+    write-only workbook keep their dimension, and write text as shared strings if strings is not
+    None (see use_worksheet_writer)."""
+    sheet = wb.create_sheet(sheet_title)
+    # Add frozen rows & cols
+    # In write-only mode this must be set before any rows are written
+    frozen_row = int(details["Frozen Rows"]) + 1
+    frozen_col = col_to_a1(int(details["Frozen Columns"]) + 1)
+    sheet.freeze_panes = frozen_col + str(frozen_row)
+    if wb.write_only:
+        use_worksheet_writer(sheet, strings)
+    return sheet
+
+
+def mark_last(items):
+    """Yield each item with True if it is the last item, or False."""
+    items = iter(items)
+    previous = next(items, None)
+    if previous is None:
+        return
+    for item in items:
+        yield previous, False
+        previous = item
+    yield previous, True
+
+
+def write_rows(writer, rows):
+    """Write each row to a CSV writer as it is read, and yield it."""
+    for row in rows:
+        writer.writerow(row)
+        yield row
 
-    wb = Workbook()
-    wb.remove_sheet(wb.get_sheet_by_name("Sheet"))
 
-    tracked_sheets = get_tracked_sheets(axle_dir)
-    push_data(axle_dir, wb, tracked_sheets)
-    wb.save(config["Spreadsheet Path"])
+def write_cached_copy(sheet_path, cached_path):
+    """Write a table to its cached copy as TSV."""
+    delimiter = "\t"
+    if sheet_path.endswith(".csv"):
+        delimiter = ","
+    with open(sheet_path, "r") as fr, open(cached_path, "w") as fw:
+        reader = csv.reader(fr, delimiter=delimiter)
+        writer = csv.writer(fw, delimiter="\t", lineterminator="\n")
+        for row in reader:
+            writer.writerow(row)
@@ -1,8 +1,14 @@
-import csv
 import os
 
 from .exceptions import RmError
-from .helpers import get_cached_path, get_tracked_sheets, set_logging, validate_axle_project
+from .helpers import (
+    get_base_path,
+    get_cached_path,
+    get_tracked_sheets,
+    set_logging,
+    update_tracked_sheets,
+    validate_axle_project,
+)
 
 
 def rm(paths, keep=False, verbose=False):
@@ -11,6 +17,16 @@ def rm(paths, keep=False, verbose=False):
     set_logging(verbose)
     axle_dir = validate_axle_project()
     sheets = get_tracked_sheets(axle_dir)
+    removed = remove_sheets(sheets, paths)
+    remove_sheet_files(axle_dir, removed, paths, keep=keep)
+
+    # Update sheet.tsv
+    update_tracked_sheets(axle_dir, [dict(sheet, Title=title) for title, sheet in sheets.items()])
+
+
+def remove_sheets(sheets, paths):
+    """Remove the sheets for a set of table paths from a dict of sheet title -> details. Return a
+    dict of the removed sheet titles -> details."""
     path_to_sheet = {
         os.path.abspath(details["Path"]): sheet_title for sheet_title, details in sheets.items()
     }
@@ -24,36 +40,30 @@ def rm(paths, keep=False, verbose=False):
     if untracked:
         raise RmError(f"unable to remove untracked file(s): {', '.join(untracked)}.")
 
-    sheets_to_remove = {title: sheet for title, sheet in sheets.items() if sheet["Path"] in paths}
+    sheets_to_remove = [title for title, sheet in sheets.items() if sheet["Path"] in paths]
     # Make sure we are not deleting the last sheet
     if len(sheets) - len(sheets_to_remove) == 0:
         raise RmError(
             f"unable to remove {len(sheets_to_remove)} tracked sheet(s) - "
             "the spreadsheet must have at least one sheet."
         )
+    return {sheet_title: sheets.pop(sheet_title) for sheet_title in sheets_to_remove}
 
+
+def remove_sheet_files(axle_dir, sheet_titles, paths, keep=False):
+    """Remove the cached copies and last pushed versions of removed sheets, and the tables at
+    paths unless keep is True."""
     # Maybe remove local copies
     if not keep:
         for p in paths:
             if os.path.exists(p):
                 os.remove(p)
 
-    # Remove the cached copies
-    for sheet_title in sheets_to_remove.keys():
-        cached_path = get_cached_path(axle_dir, sheet_title)
-        if os.path.exists(cached_path):
-            os.remove(cached_path)
-
-    # Update sheet.tsv
-    with open(f"{axle_dir}/sheet.tsv", "w") as f:
-        writer = csv.DictWriter(
-            f,
-            delimiter="\t",
-            lineterminator="\n",
-            fieldnames=["Title", "Path", "Frozen Rows", "Frozen Columns",],
-        )
-        writer.writeheader()
-        for title, sheet in sheets.items():
-            if title not in sheets_to_remove.keys():
-                sheet["Title"] = title
-                writer.writerow(sheet)
+    # Remove the cached copies and the last pushed versions
+    for sheet_title in sheet_titles:
+        for path in [
+            get_cached_path(axle_dir, sheet_title),
+            get_base_path(axle_dir, sheet_title),
+        ]:
+            if os.path.exists(path):
+                os.remove(path)
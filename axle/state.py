@@ -0,0 +1,96 @@
+import logging
+import os
+
+from . import database
+from .exceptions import StateError
+from .helpers import (
+    get_format_dict,
+    get_sheet_formats,
+    get_sheet_notes,
+    get_state_db,
+    get_tracked_sheets,
+    set_logging,
+    update_format_dict,
+    update_formats,
+    update_notes,
+    update_tracked_sheets,
+    validate_axle_project,
+)
+
+# Ways of storing the project state
+BACKENDS = ["tsv", "sqlite"]
+
+# Files in the AXLE directory that are replaced by the SQLite database
+STATE_FILES = ["sheet.tsv", "format.tsv", "note.tsv", "formats.json"]
+
+
+def state(backend, verbose=False):
+    """Change how the state of the project (sheets, formats, and notes) is stored. 'sqlite' imports
+    the TSV and JSON files in the AXLE directory into a SQLite database, and 'tsv' exports the
+    database back to those files."""
+    set_logging(verbose)
+    axle_dir = validate_axle_project()
+    if backend == "sqlite":
+        import_state(axle_dir)
+    elif backend == "tsv":
+        export_state(axle_dir)
+    else:
+        raise StateError(f"Unknown backend '{backend}' - must be one of: " + ", ".join(BACKENDS))
+
+
+def export_state(axle_dir):
+    """Export the SQLite database of the project state to TSV and JSON files, then remove it."""
+    db = get_state_db(axle_dir)
+    if not db:
+        logging.info("project state is already stored in TSV files")
+        return
+    project_state = read_state(axle_dir)
+    # Move the database aside so that the helpers write to the files
+    tmp_db = db + ".tmp"
+    os.replace(db, tmp_db)
+    try:
+        write_state(axle_dir, project_state)
+    except Exception:
+        os.replace(tmp_db, db)
+        raise
+    os.remove(tmp_db)
+    logging.info(f"exported project state to {', '.join(STATE_FILES)}")
+
+
+def import_state(axle_dir):
+    """Import the TSV and JSON files of the project state into a SQLite database, then remove
+    them."""
+    if get_state_db(axle_dir):
+        logging.info("project state is already stored in " + database.DB_NAME)
+        return
+    project_state = read_state(axle_dir)
+    db = os.path.join(axle_dir, database.DB_NAME)
+    # Once the database exists, the helpers write to it
+    database.connect(db).close()
+    try:
+        write_state(axle_dir, project_state)
+    except Exception:
+        os.remove(db)
+        raise
+    for f in STATE_FILES:
+        if os.path.exists(os.path.join(axle_dir, f)):
+            os.remove(os.path.join(axle_dir, f))
+    logging.info("imported project state into " + database.DB_NAME)
+
+
+def read_state(axle_dir):
+    """Read the sheets, formats, and notes of the project."""
+    return {
+        "sheets": [dict(d, Title=t) for t, d in get_tracked_sheets(axle_dir).items()],
+        "format_dict": get_format_dict(axle_dir),
+        "formats": get_sheet_formats(axle_dir),
+        "notes": get_sheet_notes(axle_dir),
+    }
+
+
+def write_state(axle_dir, project_state):
+    """Write the sheets, formats, and notes of the project."""
+    update_tracked_sheets(axle_dir, project_state["sheets"])
+    update_format_dict(axle_dir, project_state["format_dict"])
+    update_formats(axle_dir, project_state["formats"])
+    update_notes(axle_dir, project_state["notes"])
@@ -0,0 +1,81 @@
+import os
+
+from .helpers import (
+    get_cached_path,
+    get_cached_state,
+    get_config,
+    get_entries_hash,
+    get_file_state,
+    get_format_dict,
+    get_format_hash,
+    get_manifest,
+    get_sheet_formats,
+    get_sheet_notes,
+    get_state_file_states,
+    get_tracked_sheets,
+    set_logging,
+    validate_axle_project,
+)
+
+
+def status(verbose=False):
+    """Compare the spreadsheet, the tracked tables, and their cached copies to the last push.
+    Files are only hashed if their size or modification time changed, and the formats and notes
+    are only compared if the files that store them changed, so this is fast when nothing has
+    changed. Return a dict with the status of the spreadsheet and a dict of sheet title -> list of
+    changes (empty if the sheet is up to date)."""
+    set_logging(verbose)
+    axle_dir = validate_axle_project()
+    spreadsheet_path = get_config(axle_dir)["Spreadsheet Path"]
+    manifest = get_manifest(axle_dir)
+    pushed = {x["Title"]: x for x in manifest.get("Sheets", [])}
+
+    previous = manifest.get("Spreadsheet")
+    if not os.path.exists(spreadsheet_path):
+        spreadsheet_status = "missing"
+    elif not previous:
+        spreadsheet_status = "not pushed"
+    elif get_file_state(spreadsheet_path, previous)["Hash"] != previous["Hash"]:
+        spreadsheet_status = "changed since last push"
+    else:
+        spreadsheet_status = "up to date"
+
+    # Only read the formats and notes if the files they are stored in changed since the push
+    sheet_formats = None
+    sheet_notes = None
+    if manifest.get("State") != get_state_file_states(axle_dir, manifest.get("State")):
+        sheet_formats = get_sheet_formats(axle_dir)
+        sheet_notes = get_sheet_notes(axle_dir)
+        id_to_format = get_format_dict(axle_dir)
+
+    tracked_sheets = get_tracked_sheets(axle_dir)
+    sheet_changes = {}
+    for sheet_title, details in tracked_sheets.items():
+        changes = []
+        sheet_changes[sheet_title] = changes
+        state = pushed.get(sheet_title)
+        if not state:
+            changes.append("not pushed")
+            continue
+        path = details["Path"]
+        if not os.path.exists(path):
+            changes.append("table missing")
+        elif path != state["Path"] or get_file_state(path, state)["Hash"] != state["Hash"]:
+            changes.append("table changed")
+        if sheet_formats is not None:
+            cell_formats = sheet_formats.get(sheet_title, {})
+            if get_format_hash(cell_formats, id_to_format) != state.get("Format Hash"):
+                changes.append("formats changed")
+            if get_entries_hash(sheet_notes.get(sheet_title, {})) != state.get("Note Hash"):
+                changes.append("notes changed")
+        frozen = (str(details["Frozen Rows"]), str(details["Frozen Columns"]))
+        if frozen != (str(state.get("Frozen Rows")), str(state.get("Frozen Columns"))):
+            changes.append("frozen rows or columns changed")
+        # The cached copy is replaced by fetch when the sheet changed in the spreadsheet
+        cached_path = get_cached_path(axle_dir, sheet_title)
+        if not os.path.exists(cached_path) or get_cached_state(cached_path) != state.get("Cached"):
+            changes.append("changed in spreadsheet")
+    for sheet_title in pushed.keys():
+        if sheet_title not in tracked_sheets:
+            sheet_changes[sheet_title] = ["removed"]
+    return {"Spreadsheet": spreadsheet_status, "Sheets": sheet_changes}
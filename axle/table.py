@@ -0,0 +1,160 @@
+"""A compact, column-oriented model of a table, used to hold tables in memory (see push and merge).
+Each column stores every distinct value once, plus an array with the index of the value of each
+row, so memory use grows with the number of distinct values instead of the number of cells."""
+from array import array
+from .helpers import a1_to_rowcol, iter_row_entries
+
+
+class Table:
+    """A table held column by column. Rows and columns are numbered from 0. If header is True, the
+    first row is the header, which is kept as a list and is not changed by map_values.
+
+    Index 0 of each column is used for cells past the end of a row that is shorter than the widest
+    row, so ragged rows are kept as they are. Formats (see set_formats) are kept in arrays of format
+    IDs for the columns that have any, and notes (see set_notes) in a dict of cell offset -> note,
+    so that both are looked up by position instead of by A1 label."""
+
+    def __init__(self, rows=(), header=True):
+        rows = iter(rows)
+        self.header = next(rows, None) if header else None
+        # For each column: the distinct values, a dict of value -> index, and the value indexes
+        self.values = []
+        self.indexes = []
+        self.cells = []
+        self.widths = array("I")
+        self.formats = []
+        self.notes = {}
+        for row in rows:
+            self.append(row)
+
+    def __iter__(self):
+        if self.header is not None:
+            yield list(self.header)
+        columns = list(zip(self.values, self.cells))
+        for i, width in enumerate(self.widths):
+            yield [values[cells[i]] for values, cells in columns[:width]]
+
+    def __len__(self):
+        return len(self.widths) + (self.header is not None)
+
+    @property
+    def width(self):
+        """The number of values in the widest row."""
+        return max(len(self.cells), len(self.header or []))
+
+    def append(self, row):
+        """Add a row (list of values) to the end of the table."""
+        height = len(self.widths)
+        while len(self.cells) < len(row):
+            self.values.append([None])
+            self.indexes.append({})
+            self.cells.append(array("I", [0]) * height)
+        for values, index, cells, value in zip(self.values, self.indexes, self.cells, row):
+            i = index.get(value)
+            if i is None:
+                i = len(values)
+                values.append(value)
+                index[value] = i
+            cells.append(i)
+        for cells in self.cells[len(row) :]:
+            cells.append(0)
+        self.widths.append(len(row))
+
+    def get_format_id(self, row, col):
+        """Return the format ID of a cell, or 0 if it has no format."""
+        formats = self.formats[col] if col < len(self.formats) else None
+        if formats is None:
+            return 0
+        return formats[row]
+
+    def get_note(self, row, col):
+        """Return the note on a cell, or None."""
+        return self.notes.get(row * self.width + col)
+
+    def get_row(self, row):
+        """Return a row as a list of values."""
+        if self.header is not None:
+            if row == 0:
+                return list(self.header)
+            row -= 1
+        return [self.values[col][self.cells[col][row]] for col in range(self.widths[row])]
+
+    def get_value(self, row, col):
+        """Return the value of a cell, or None if the row does not reach the column."""
+        if self.header is not None:
+            if row == 0:
+                return self.header[col] if col < len(self.header) else None
+            row -= 1
+        if col >= self.widths[row]:
+            return None
+        return self.values[col][self.cells[col][row]]
+
+    def iter_formats(self):
+        """Yield the row, column, and format ID of each cell with a format."""
+        for col, formats in enumerate(self.formats):
+            if formats is None:
+                continue
+            for row, fmt_id in enumerate(formats):
+                if fmt_id:
+                    yield row, col, fmt_id
+
+    def iter_notes(self):
+        """Yield the row, column, and note of each cell with a note."""
+        width = self.width
+        for offset, note in self.notes.items():
+            row, col = divmod(offset, width)
+            yield row, col, note
+
+    def iter_values(self):
+        """Yield the row, column, and value of each cell that is not empty (None or ""), column by
+        column after the header. Empty values are found once for each column."""
+        if self.header is not None:
+            for col, value in enumerate(self.header):
+                if value is not None and value != "":
+                    yield 0, col, value
+        start = int(self.header is not None)
+        for col, (values, cells) in enumerate(zip(self.values, self.cells)):
+            empty = [value is None or value == "" for value in values]
+            for row, i in enumerate(cells, start=start):
+                if not empty[i]:
+                    yield row, col, values[i]
+
+    def map_values(self, col, function):
+        """Replace each distinct value in a column below the header with function(value). Cells
+        past the end of a row are not changed. No rows can be added after this."""
+        values = self.values[col]
+        self.values[col] = [None] + [function(value) for value in values[1:]]
+        self.indexes[col] = None
+
+    def set_formats(self, cell_formats):
+        """Set the format IDs of the cells from a dict of cell or range of cells -> format ID (see
+        iter_row_entries). Formats outside of the table are skipped. Return the number of cells
+        with a format."""
+        height = len(self)
+        width = self.width
+        self.formats = [None] * width
+        styled = 0
+        for row, entries in zip(range(height), iter_row_entries(cell_formats)):
+            for col, fmt_id in entries.items():
+                if not fmt_id or col > width:
+                    continue
+                formats = self.formats[col - 1]
+                if formats is None:
+                    formats = array("I", [0]) * height
+                    self.formats[col - 1] = formats
+                if not formats[row]:
+                    styled += 1
+                formats[row] = fmt_id
+        return styled
+
+    def set_notes(self, cell_notes):
+        """Set the notes on the cells from a dict of cell -> note. Notes outside of the table are
+        skipped. Return the number of cells with a note."""
+        height = len(self)
+        width = self.width
+        self.notes = {}
+        for coordinate, note in cell_notes.items():
+            row, col = a1_to_rowcol(coordinate) or (0, 0)
+            if 0 < row <= height and 0 < col <= width:
+                self.notes[(row - 1) * width + col - 1] = note
+        return len(self.notes)
@@ -0,0 +1,335 @@
+"""Keep the tracked tables and the spreadsheet of an AXLE project in sync while they are edited.
+Changes are detected with inotify on Linux, or by checking the files at an interval elsewhere."""
+import ctypes
+import ctypes.util
+import logging
+import os
+import select
+import struct
+import time
+import zipfile
+
+from .database import DB_NAME
+from .exceptions import AxleError
+from .fetch import fetch
+from .helpers import (
+    get_config,
+    get_file_state,
+    get_tracked_sheets,
+    set_logging,
+    validate_axle_project,
+)
+from .merge import merge
+from .push import push
+
+# inotify event masks (see inotify(7))
+IN_MODIFY = 0x2
+IN_CLOSE_WRITE = 0x8
+IN_MOVED_FROM = 0x40
+IN_MOVED_TO = 0x80
+IN_CREATE = 0x100
+IN_DELETE = 0x200
+IN_Q_OVERFLOW = 0x4000
+WATCH_MASK = IN_MODIFY | IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE | IN_DELETE
+
+# wd, mask, cookie, and length of the name of an inotify event
+EVENT_HEADER = struct.Struct("iIII")
+
+# Files in the AXLE directory that store the project state
+STATE_FILES = ["config.tsv", "sheet.tsv", "format.tsv", "note.tsv", "formats.json", DB_NAME]
+
+# Errors raised while reading or writing a spreadsheet that is being saved or is locked by another
+# program - the sync is tried again later
+LOCKED_ERRORS = (OSError, zipfile.BadZipFile)
+
+# Errors raised by zipfile when reading a member of a spreadsheet that is only partly written (see
+# is_zip_error)
+ZIP_MEMBER_ERRORS = (EOFError, KeyError)
+
+# Number of times in a row that a sync can fail before it is given up until the files change again
+MAX_RETRIES = 10
+
+
+def get_lock_paths(spreadsheet_path):
+    """Return the paths of the lock files that Excel and LibreOffice create next to a spreadsheet
+    while it is open."""
+    directory, name = os.path.split(spreadsheet_path)
+    return [os.path.join(directory, "~$" + name), os.path.join(directory, f".~lock.{name}#")]
+
+
+def get_watched(axle_dir):
+    """Return a dict of the absolute paths to watch: the spreadsheet, a dict of table path -> sheet
+    title, and the state files."""
+    spreadsheet_path = os.path.abspath(get_config(axle_dir)["Spreadsheet Path"])
+    return {
+        "Spreadsheet": spreadsheet_path,
+        "Tables": {
+            os.path.abspath(details["Path"]): sheet_title
+            for sheet_title, details in get_tracked_sheets(axle_dir).items()
+        },
+        "State": [os.path.join(axle_dir, name) for name in STATE_FILES],
+    }
+
+
+def get_watched_paths(watched):
+    """Return a set of all paths to watch."""
+    paths = {watched["Spreadsheet"]}
+    paths.update(watched["Tables"].keys())
+    paths.update(watched["State"])
+    return paths
+
+
+def get_state(path, previous=None):
+    """Return the file state of a path (see get_file_state), or None if it does not exist."""
+    try:
+        return get_file_state(path, previous)
+    except FileNotFoundError:
+        return None
+
+
+def get_stat(path):
+    """Return the size and modification time of a path, or None if it does not exist."""
+    try:
+        st = os.stat(path)
+    except FileNotFoundError:
+        return None
+    return st.st_size, st.st_mtime_ns
+
+
+def is_zip_error(e):
+    """Return True if an error was raised by zipfile, e.g., a KeyError for a missing member."""
+    tb = e.__traceback__
+    while tb.tb_next:
+        tb = tb.tb_next
+    return tb.tb_frame.f_code.co_filename == zipfile.__file__
+
+
+def is_locked(spreadsheet_path):
+    """Return True if the spreadsheet is open in Excel or LibreOffice."""
+    return any(os.path.exists(p) for p in get_lock_paths(spreadsheet_path))
+
+
+def open_inotify():
+    """Return an inotify file descriptor and a function to add a watch on a directory, or None if
+    inotify is not available."""
+    try:
+        libc = ctypes.CDLL(ctypes.util.find_library("c") or "libc.so.6", use_errno=True)
+        fd = libc.inotify_init()
+        add_watch = libc.inotify_add_watch
+    except (AttributeError, OSError):
+        return None
+    if fd < 0:
+        return None
+    return fd, lambda directory: add_watch(fd, os.fsencode(directory), WATCH_MASK)
+
+
+def read_inotify(fd, wd_to_dir, timeout):
+    """Wait up to timeout seconds (or forever, if None) for inotify events. Return a set of the
+    paths that changed, or None if events were lost and any path may have changed."""
+    ready, _, _ = select.select([fd], [], [], timeout)
+    if not ready:
+        return set()
+    data = os.read(fd, 65536)
+    paths = set()
+    offset = 0
+    while offset < len(data):
+        wd, mask, _, length = EVENT_HEADER.unpack_from(data, offset)
+        offset += EVENT_HEADER.size
+        name = data[offset : offset + length].rstrip(b"\0")
+        offset += length
+        if mask & IN_Q_OVERFLOW:
+            return None
+        if wd in wd_to_dir and name:
+            paths.add(os.path.join(wd_to_dir[wd], os.fsdecode(name)))
+    return paths
+
+
+def sync(
+    axle_dir,
+    watched,
+    known,
+    changed,
+    three_way=False,
+    key=None,
+    streaming=False,
+    engine="openpyxl",
+):
+    """Sync the changed paths: if the spreadsheet changed, fetch it and merge the sheets that
+    changed (see merge for three_way and key); if any tables or state files changed, push. Without
+    a three-way merge, sheets that changed on both sides are not merged or pushed. The known states
+    of the files that are written are updated, so that they are not synced again. Return True if
+    the sync is done, None if the spreadsheet is open and the sync should wait for it to be
+    closed, or False if the spreadsheet could not be read or written and the sync should be tried
+    again later."""
+    spreadsheet_path = watched["Spreadsheet"]
+    changed_sheets = {watched["Tables"][p] for p in changed if p in watched["Tables"]}
+    state_changed = any(p in watched["State"] for p in changed)
+    try:
+        if spreadsheet_path in changed:
+            logging.info(f"fetching changes from {spreadsheet_path}")
+            fetched = fetch(streaming=streaming, engine=engine)
+            for path in watched["State"]:
+                known[path] = get_state(path, known.get(path))
+            known[spreadsheet_path] = get_state(spreadsheet_path, known.get(spreadsheet_path))
+            conflicts = set()
+            if not three_way and not key:
+                conflicts = set(fetched) & changed_sheets
+            for sheet_title in conflicts:
+                logging.warning(
+                    f"'{sheet_title}' changed in both the table and the spreadsheet - run "
+                    "`axle merge -3` to merge the changes or `axle push` to overwrite them"
+                )
+            # Sheets added to the spreadsheet are tracked by fetch
+            watched.update(get_watched(axle_dir))
+            merged = [st for st in fetched if st not in conflicts]
+            merge(on_sheets=merged, three_way=three_way, key=key)
+            for path, sheet_title in watched["Tables"].items():
+                if sheet_title in merged or path not in known:
+                    known[path] = get_state(path, known.get(path))
+            if conflicts:
+                # Pushing would overwrite the changes in the spreadsheet
+                return True
+        if changed_sheets or state_changed:
+            if is_locked(spreadsheet_path):
+                logging.warning(f"{spreadsheet_path} is open - waiting for it to be closed to push")
+                return None
+            logging.info(f"pushing changes to {spreadsheet_path}")
+            push(streaming=streaming)
+            known[spreadsheet_path] = get_state(spreadsheet_path, known.get(spreadsheet_path))
+    except LOCKED_ERRORS as e:
+        logging.warning(f"unable to sync {spreadsheet_path}, trying again: {e}")
+        return False
+    except ZIP_MEMBER_ERRORS as e:
+        if not is_zip_error(e):
+            raise
+        logging.warning(f"unable to sync {spreadsheet_path}, trying again: {e}")
+        return False
+    except AxleError as e:
+        logging.error(str(e))
+    return True
+
+
+def watch(
+    delay=1.0,
+    interval=1.0,
+    polling=False,
+    three_way=False,
+    key=None,
+    streaming=False,
+    engine="openpyxl",
+    verbose=False,
+):
+    """Watch the tracked tables, the spreadsheet, and the project state, and sync them when they
+    change: when the spreadsheet changes, fetch it and merge the sheets that changed, and when the
+    tables or the formats and notes change, push (only the changed sheets are rebuilt). Changes are
+    synced once no file has changed for delay seconds, so that files that are still being saved are
+    not read. If the spreadsheet cannot be read or written (e.g., it is locked while Excel saves
+    it), the sync is tried again after a longer delay each time, up to a minute, and given up
+    after MAX_RETRIES failures in a row until the files change again.
+
+    Changes are detected with inotify if it is available, unless polling is True - otherwise, the
+    files are checked every interval seconds. The tracked sheets and the states of the watched
+    files are kept in memory, and files are only hashed if their size or modification time changed.
+    Files written by the sync itself are not synced again. This runs until it is interrupted."""
+    set_logging(verbose)
+    axle_dir = validate_axle_project()
+    watched = get_watched(axle_dir)
+    paths = get_watched_paths(watched)
+    known = {path: get_state(path) for path in paths}
+
+    inotify = None if polling else open_inotify()
+    wd_to_dir = {}
+    stats = {}
+
+    def add_watches():
+        """Start watching any paths that are not watched yet."""
+        if inotify:
+            fd, add_watch = inotify
+            for directory in {os.path.dirname(p) for p in paths} - set(wd_to_dir.values()):
+                if os.path.isdir(directory):
+                    wd = add_watch(directory)
+                    if wd >= 0:
+                        wd_to_dir[wd] = directory
+        for path in paths - stats.keys():
+            stats[path] = get_stat(path)
+            if path not in known:
+                known[path] = get_state(path)
+
+    add_watches()
+    if inotify:
+        logging.info(f"watching {len(paths)} files with inotify")
+    else:
+        logging.info(f"watching {len(paths)} files every {interval} second(s)")
+
+    pending = set()
+    # Time to sync the pending paths at, and the delay before trying again if the sync fails
+    sync_time = None
+    retry_delay = delay
+    failures = 0
+    try:
+        while True:
+            if inotify:
+                timeout = None
+                if sync_time is not None:
+                    timeout = max(0, sync_time - time.monotonic())
+                events = read_inotify(inotify[0], wd_to_dir, timeout)
+                if events is None:
+                    events = set(paths)
+                events &= paths
+            else:
+                time.sleep(interval)
+                events = set()
+                for path in paths:
+                    stat = get_stat(path)
+                    if stat != stats.get(path):
+                        stats[path] = stat
+                        events.add(path)
+            if events:
+                pending |= events
+                sync_time = time.monotonic() + delay
+                continue
+            if sync_time is None or time.monotonic() < sync_time:
+                continue
+            sync_time = None
+
+            # Only sync the files whose contents changed
+            changed = {}
+            for path in pending:
+                state = get_state(path, known.get(path))
+                if (state and state["Hash"]) != (known[path] and known[path]["Hash"]):
+                    changed[path] = state
+            pending = set()
+            if not changed:
+                continue
+            previous = {path: known[path] for path in changed}
+            known.update(changed)
+            synced = sync(axle_dir, watched, known, changed, three_way, key, streaming, engine)
+            if synced:
+                retry_delay = delay
+                failures = 0
+            else:
+                # Files that were synced before the sync failed are not synced again
+                for path, state in previous.items():
+                    if known[path] is changed[path]:
+                        known[path] = state
+                if synced is False:
+                    failures += 1
+                if failures < MAX_RETRIES:
+                    pending |= changed.keys()
+                    sync_time = time.monotonic() + retry_delay
+                    retry_delay = min(retry_delay * 2, 60)
+                else:
+                    logging.error(
+                        f"unable to sync {watched['Spreadsheet']} after {failures} attempts - "
+                        "waiting for the files to change again"
+                    )
+                    retry_delay = delay
+                    failures = 0
+
+            # The tracked sheets may have changed
+            watched.update(get_watched(axle_dir))
+            paths = get_watched_paths(watched)
+            add_watches()
+    finally:
+        if inotify:
+            os.close(inotify[0])
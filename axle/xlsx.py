@@ -0,0 +1,1265 @@
+"""Read and write the parts of an XLSX package (ZIP archive) directly, without loading the
+spreadsheet through openpyxl. This is used to build a spreadsheet from sheets that already exist in
+other spreadsheets, e.g., to reuse the sheets of the last push that have not changed, and to read
+the cells of large spreadsheets quickly.
+
+The spreadsheets handled here are expected to have been written by openpyxl (i.e., by AXLE)."""
+import datetime
+import os
+import posixpath
+import re
+import tempfile
+import xml.etree.ElementTree as ET
+import zipfile
+
+from xml.sax.saxutils import escape
+from openpyxl.comments.comment_sheet import CommentRecord, CommentSheet
+from openpyxl.drawing.spreadsheet_drawing import SpreadsheetDrawing
+from openpyxl.formula.translate import Translator
+from openpyxl.utils.datetime import from_excel, from_ISO8601
+from openpyxl.writer.excel import ExcelWriter
+from openpyxl.xml.functions import Element, SubElement, tostring
+from .compat import (
+    CHUNK_SIZE,
+    HAS_WRITERS,
+    WorksheetWriter,
+    copy_raw,
+    get_worksheet_writer,
+    new_zip_info,
+    set_worksheet_writer,
+    write_cell,
+)
+from .exceptions import AxleError
+from .helpers import a1_range_to_rowcols, a1_to_rowcol, col_to_a1, rowcols_to_a1_range
+
+CT_NS = "http://schemas.openxmlformats.org/package/2006/content-types"
+MAIN_NS = "http://schemas.openxmlformats.org/spreadsheetml/2006/main"
+PKG_REL_NS = "http://schemas.openxmlformats.org/package/2006/relationships"
+REL_NS = "http://schemas.openxmlformats.org/officeDocument/2006/relationships"
+
+REL_COMMENTS = REL_NS + "/comments"
+REL_HYPERLINK = REL_NS + "/hyperlink"
+REL_OFFICE_DOCUMENT = REL_NS + "/officeDocument"
+REL_SHARED_STRINGS = REL_NS + "/sharedStrings"
+REL_STYLES = REL_NS + "/styles"
+REL_VML_DRAWING = REL_NS + "/vmlDrawing"
+REL_WORKSHEET = REL_NS + "/worksheet"
+
+CT_COMMENTS = "application/vnd.openxmlformats-officedocument.spreadsheetml.comments+xml"
+CT_SHARED_STRINGS = "application/vnd.openxmlformats-officedocument.spreadsheetml.sharedStrings+xml"
+CT_VML_DRAWING = "application/vnd.openxmlformats-officedocument.vmlDrawing"
+
+# Parts of packages written by openpyxl
+SHARED_STRINGS_PART = "xl/sharedStrings.xml"
+WORKBOOK_RELS_PART = "xl/_rels/workbook.xml.rels"
+
+# Compression level -> ZIP compression method and zlib level of new parts (None is zlib's default)
+COMPRESSION = {
+    "stored": (zipfile.ZIP_STORED, None),
+    "fast": (zipfile.ZIP_DEFLATED, 1),
+    "default": (zipfile.ZIP_DEFLATED, None),
+    "max": (zipfile.ZIP_DEFLATED, 9),
+}
+
+ET.register_namespace("r", REL_NS)
+
+# Matches the start tag of a cell (plus its value), row, or column in worksheet XML
+CELL_RE = re.compile(rb"<(c|row|col)\b([^>]*?)(/?)>(<v>(\d+)</v>)?")
+STYLE_ATTR_RE = re.compile(rb'(\s(?:s|style)=")(\d+)(")')
+SHARED_STRING_ATTR_RE = re.compile(rb'\st="s"')
+ATTR_RE = re.compile(rb'([\w:]+)="([^"]*)"')
+DIMENSION_RE = re.compile(rb"<(?:\w+:)?dimension\b([^>]*)>")
+HYPERLINK_RE = re.compile(rb"<(?:\w+:)?hyperlink\b([^>]*)>")
+PANE_RE = re.compile(rb"<(?:\w+:)?pane\b([^>]*)>")
+TAB_SELECTED_RE = re.compile(rb'\stabSelected="(?:1|true)"')
+
+# Used to patch the cells of a worksheet in place
+ROW_START_RE = re.compile(rb"<row\b([^>]*?)(/?)>")
+CELL_START_RE = re.compile(rb"<c\b([^>]*?)(/?)>")
+CELL_STYLE_RE = re.compile(rb'\ss="\d+"')
+ROW_SPANS_RE = re.compile(rb'\sspans="[^"]*"')
+SHEET_DATA_RE = re.compile(rb"<sheetData\s*/>|</sheetData>")
+LEGACY_DRAWING_RE = re.compile(rb"<legacyDrawing\b[^>]*/>")
+# Namespace declarations, and the first start tag of a document (its root element)
+XMLNS_RE = re.compile(rb'\sxmlns:([\w.-]+)="([^"]*)"')
+ROOT_START_RE = re.compile(rb"<(?![?!])[^>]*>")
+# Elements that come after dimension in a worksheet
+AFTER_DIMENSION_RE = re.compile(rb"<(?:sheetViews|sheetFormatPr|cols|sheetData)\b")
+# Elements that come after legacyDrawing in a worksheet
+AFTER_LEGACY_DRAWING_RE = re.compile(
+    rb"<(legacyDrawingHF|drawingHF|picture|oleObjects|controls|webPublishItems|tableParts|extLst)\b"
+    rb"|</worksheet>"
+)
+
+
+class SharedStringsArchive:
+    """Wraps the ZIP archive that openpyxl writes a workbook to, to add the shared strings part
+    when the workbook relationships are written (after the worksheets, so all strings are known)."""
+
+    def __init__(self, archive, strings):
+        self.archive = archive
+        self.strings = strings
+
+    def __getattr__(self, name):
+        return getattr(self.archive, name)
+
+    def writestr(self, name, data, *args, **kwargs):
+        if name == WORKBOOK_RELS_PART:
+            root = ET.fromstring(data)
+            rel_id = max([rel_number(el.get("Id")) for el in root] + [0]) + 1
+            el = ET.SubElement(root, f"{{{PKG_REL_NS}}}Relationship")
+            el.set("Id", f"rId{rel_id}")
+            el.set("Type", REL_SHARED_STRINGS)
+            el.set("Target", "sharedStrings.xml")
+            data = to_xml(root, PKG_REL_NS, source=data)
+            write_string_table(self.archive, SHARED_STRINGS_PART, self.strings)
+        self.archive.writestr(name, data, *args, **kwargs)
+
+
+class SharedStringsOverride:
+    """The content type of the shared strings part, for openpyxl's package manifest."""
+
+    path = "/" + SHARED_STRINGS_PART
+    mime_type = CT_SHARED_STRINGS
+
+
+class BoundedWorksheetWriter(WorksheetWriter):
+    """An openpyxl WorksheetWriter that keeps the last row and column of the cells it writes. This
+    is the dimension of a write-only worksheet, which openpyxl does not write because the top of the
+    worksheet is written before any rows (see StreamingExcelWriter)."""
+
+    def __init__(self, ws, out=None):
+        super().__init__(ws, out=out)
+        self.max_row = 0
+        self.max_col = 0
+
+    def track(self, row, row_idx):
+        """Yield each cell of a row, keeping the bounds of the cells. Write-only rows reuse one
+        cell object, so the bounds are kept as each cell is yielded."""
+        for cell in row:
+            self.max_row = row_idx
+            self.max_col = max(self.max_col, cell.column)
+            yield cell
+
+    def write_row(self, xf, row, row_idx):
+        super().write_row(xf, self.track(row, row_idx), row_idx)
+
+
+class SharedStringWorksheetWriter(BoundedWorksheetWriter):
+    """An openpyxl WorksheetWriter that writes text cells as indexes into a table of shared strings
+    instead of as inline strings, so that each distinct string is only stored once. `strings` is a
+    dict of string -> index, which new strings are added to."""
+
+    def __init__(self, ws, strings, out=None):
+        super().__init__(ws, out=out)
+        self.strings = strings
+
+    def write_row(self, xf, row, row_idx):
+        attrs = {"r": f"{row_idx}"}
+        attrs.update(self.ws.row_dimensions.get(row_idx, {}))
+        strings = self.strings
+        with xf.element("row", attrs):
+            for cell in self.track(row, row_idx):
+                if cell._comment is not None:
+                    self.ws._comments.append(CommentRecord.from_cell(cell))
+                value = cell._value
+                # Formulas, rich text, and cells with hyperlinks are written by openpyxl
+                if cell.data_type == "s" and type(value) is str and value and not cell.hyperlink:
+                    cell_attrs = {"r": cell.coordinate}
+                    if cell.has_style:
+                        cell_attrs["s"] = f"{cell.style_id}"
+                    cell_attrs["t"] = "s"
+                    el = Element("c", cell_attrs)
+                    SubElement(el, "v").text = str(strings.setdefault(value, len(strings)))
+                    xf.write(el)
+                elif value is not None or cell.has_style or cell._comment:
+                    write_cell(xf, self.ws, cell, cell.has_style)
+
+
+class StreamingExcelWriter(ExcelWriter):
+    """An openpyxl ExcelWriter that writes each worksheet straight into its part of the package as
+    the XML is produced, instead of writing it to a temporary file and then copying it in. If
+    strings is not None, text cells are written as shared strings (see
+    SharedStringWorksheetWriter)."""
+
+    def __init__(self, workbook, archive, strings=None):
+        super().__init__(workbook, archive)
+        self.strings = strings
+
+    def write_data(self):
+        if self.strings is None:
+            super().write_data()
+            return
+        self.manifest.append(SharedStringsOverride)
+        archive = self._archive
+        self._archive = SharedStringsArchive(archive, self.strings)
+        try:
+            super().write_data()
+        finally:
+            self._archive = archive
+
+    def write_worksheet(self, ws):
+        writer = get_worksheet_writer(ws)
+        if self.workbook.write_only and not isinstance(writer, BoundedWorksheetWriter):
+            super().write_worksheet(ws)
+            return
+        ws._drawing = SpreadsheetDrawing()
+        ws._drawing.charts = ws._charts
+        ws._drawing.images = ws._images
+        if self.workbook.write_only:
+            # Write-only worksheets were already written to temporary files as they were built, so
+            # they are copied in with their dimension added (see use_worksheet_writer)
+            if not ws.closed:
+                ws.close()
+            copy_with_dimension(
+                writer.out, self._archive, ws.path[1:], writer.max_row, writer.max_col
+            )
+            ws._rels = writer._rels
+            self.manifest.append(ws)
+            writer.cleanup()
+            return
+        with self._archive.open(new_zip_info(self._archive, ws.path[1:]), "w") as out:
+            if self.strings is None:
+                writer = WorksheetWriter(ws, out=out)
+            else:
+                writer = SharedStringWorksheetWriter(ws, self.strings, out=out)
+            try:
+                writer.write()
+            finally:
+                # Finish the XML before the part is closed, even if writing failed
+                writer.close()
+        ws._rels = writer._rels
+        self.manifest.append(ws)
+
+
+def assemble(out_path, base_path, sheets, compression="default"):
+    """Write a spreadsheet to out_path containing the given sheets, in order. `sheets` is a list of
+    (sheet title, source spreadsheet path) tuples, where each sheet is taken from the sheet with the
+    same title in its source. Parts from base_path are copied without being decompressed. Sheets
+    from other sources get new part names, and their styles and shared strings are added to those
+    of the base spreadsheet. New parts are compressed with the given level (see COMPRESSION)."""
+    sources = {}
+    base_zf = zipfile.ZipFile(base_path)
+    try:
+        base = read_package(base_zf)
+        base_titles = {title for title, path in sheets if path == base_path}
+        missing = base_titles - set(base["sheets"].keys())
+        if missing:
+            raise AxleError(f"Sheet(s) not found in {base_path}: " + ", ".join(sorted(missing)))
+
+        # Parts of the sheets that are not kept from the base spreadsheet
+        dropped = set()
+        for title, part in base["sheets"].items():
+            if title not in base_titles:
+                dropped.update(get_part_tree(base_zf, part))
+        # Parts that are rewritten instead of copied as-is
+        skip = dropped | {"[Content_Types].xml", base["workbook"], rels_path(base["workbook"])}
+        if base["styles"]:
+            skip.add(base["styles"])
+        if base["shared_strings"]:
+            skip.add(base["shared_strings"])
+
+        styles_xml = base_zf.read(base["styles"])
+        styles_root = ET.fromstring(styles_xml)
+        strings = {
+            "count": count_shared_strings(base_zf, base["shared_strings"]),
+            "new": [],
+            "index": {},
+        }
+        defaults = dict(base["defaults"])
+        overrides = {k: v for k, v in base["overrides"].items() if k not in dropped}
+        used = set(base_zf.namelist())
+        wb_rels = [r for r in base["workbook_rels"] if r["Target"] not in dropped]
+        next_rel_id = max([rel_number(r["Id"]) for r in base["workbook_rels"]] + [0]) + 1
+
+        base_sheet_elements = {}
+        for el in base["workbook_root"].iter(f"{{{MAIN_NS}}}sheet"):
+            base_sheet_elements[el.get("name")] = el
+        next_sheet_id = max([int(el.get("sheetId")) for el in base_sheet_elements.values()] + [0])
+        next_sheet_id += 1
+
+        with open_package(out_path, compression) as out_zf:
+            for name in base_zf.namelist():
+                if name not in skip:
+                    copy_raw(base_zf, out_zf, name)
+
+            sheet_elements = []
+            for title, path in sheets:
+                if path == base_path:
+                    sheet_elements.append(base_sheet_elements[title])
+                    continue
+                if path not in sources:
+                    sources[path] = open_source(path, styles_root, strings)
+                src_zf, src, xf_map, string_map = sources[path]
+                part = src["sheets"].get(title)
+                if not part:
+                    raise AxleError(f"Sheet '{title}' not found in {path}")
+
+                def rewrite(src_zf, part, out_zf, new_part):
+                    rewrite_worksheet(src_zf, part, out_zf, new_part, xf_map, string_map)
+
+                new_part = copy_part_tree(
+                    src_zf, src, part, out_zf, used, defaults, overrides, rewrite=rewrite
+                )
+                rel_id = f"rId{next_rel_id}"
+                next_rel_id += 1
+                wb_rels.append(
+                    {"Id": rel_id, "Type": REL_WORKSHEET, "Target": new_part, "TargetMode": None}
+                )
+                el = ET.Element(f"{{{MAIN_NS}}}sheet")
+                el.set("name", title)
+                el.set("sheetId", str(next_sheet_id))
+                el.set("state", "visible")
+                el.set(f"{{{REL_NS}}}id", rel_id)
+                next_sheet_id += 1
+                sheet_elements.append(el)
+
+            # Styles, with any new styles added to the end
+            out_zf.writestr(base["styles"], to_xml(styles_root, MAIN_NS, source=styles_xml))
+
+            # Shared strings, with any new strings added to the end
+            shared_strings = base["shared_strings"]
+            if not shared_strings and strings["new"]:
+                shared_strings = "xl/sharedStrings.xml"
+                overrides[shared_strings] = CT_SHARED_STRINGS
+                wb_rels.append(
+                    {
+                        "Id": f"rId{next_rel_id}",
+                        "Type": REL_SHARED_STRINGS,
+                        "Target": shared_strings,
+                        "TargetMode": None,
+                    }
+                )
+            if shared_strings:
+                write_shared_strings(
+                    base_zf, base["shared_strings"], out_zf, shared_strings, strings
+                )
+
+            # Workbook with the new list of sheets
+            wb_root = base["workbook_root"]
+            sheets_el = wb_root.find(f"{{{MAIN_NS}}}sheets")
+            for el in list(sheets_el):
+                sheets_el.remove(el)
+            sheets_el.extend(sheet_elements)
+            for view in wb_root.iter(f"{{{MAIN_NS}}}workbookView"):
+                for attr in ["activeTab", "firstSheet"]:
+                    if int(view.get(attr, 0)) >= len(sheet_elements):
+                        view.set(attr, "0")
+            out_zf.writestr(base["workbook"], to_xml(wb_root, MAIN_NS, source=base["workbook_xml"]))
+            write_rels(out_zf, base["workbook"], wb_rels)
+            write_content_types(out_zf, defaults, overrides)
+    finally:
+        for src_zf, _, _, _ in sources.values():
+            src_zf.close()
+        base_zf.close()
+
+
+def copy_with_dimension(path, out_zf, part, max_row, max_col):
+    """Copy a worksheet written by openpyxl from a file to a part of the output package, adding the
+    dimension of its cells (which must not already be given)."""
+    with open(path, "rb") as fr, out_zf.open(new_zip_info(out_zf, part), "w") as fw:
+        chunk = fr.read(CHUNK_SIZE)
+        m = AFTER_DIMENSION_RE.search(chunk)
+        if m and max_row and max_col:
+            ref = rowcols_to_a1_range(1, 1, max_row, max_col)
+            chunk = chunk[: m.start()] + f'<dimension ref="{ref}"/>'.encode() + chunk[m.start() :]
+        while chunk:
+            fw.write(chunk)
+            chunk = fr.read(CHUNK_SIZE)
+
+
+def copy_part_tree(src_zf, src, part, out_zf, used, defaults, overrides, rewrite=None):
+    """Copy a part and all the parts it references to the output package under new, unused names.
+    If provided, rewrite is called to write the top-level part instead of copying it.
+    Return the new name of the part."""
+    new_part = get_new_part_name(part, used)
+    rels = read_rels(src_zf, part)
+    for rel in rels:
+        if rel["TargetMode"] == "External":
+            continue
+        rel["Target"] = copy_part_tree(
+            src_zf, src, rel["Target"], out_zf, used, defaults, overrides
+        )
+    if rels:
+        write_rels(out_zf, new_part, rels)
+
+    if rewrite:
+        rewrite(src_zf, part, out_zf, new_part)
+    else:
+        copy_raw(src_zf, out_zf, part, new_part)
+
+    # Register the content type of the new part
+    ext = posixpath.splitext(part)[1].lstrip(".").lower()
+    content_type = src["overrides"].get(part)
+    if content_type:
+        overrides[new_part] = content_type
+    elif ext not in defaults and ext in src["defaults"]:
+        defaults[ext] = src["defaults"][ext]
+    return new_part
+
+
+def count_shared_strings(zf, part):
+    """Return the number of unique strings in a shared strings part."""
+    if not part:
+        return 0
+    count = 0
+    with zf.open(part) as f:
+        for _, el in ET.iterparse(f):
+            if el.tag == f"{{{MAIN_NS}}}si":
+                count += 1
+                el.clear()
+    return count
+
+
+def get_new_part_name(part, used):
+    """Return a name for a copy of part that is not already used in the output package."""
+    directory, filename = posixpath.split(part)
+    stem, ext = posixpath.splitext(filename)
+    stem = stem.rstrip("0123456789")
+    n = 1
+    while True:
+        name = posixpath.join(directory, f"{stem}{n}{ext}")
+        if name not in used:
+            used.add(name)
+            return name
+        n += 1
+
+
+def get_part_tree(zf, part):
+    """Return a set of the part, its relationships part, and all parts it references."""
+    parts = {part, rels_path(part)}
+    for rel in read_rels(zf, part):
+        if rel["TargetMode"] != "External":
+            parts.update(get_part_tree(zf, rel["Target"]))
+    return parts
+
+
+def merge_styles(out_root, src_root):
+    """Add the cell styles from one stylesheet to another, reusing any styles that already exist.
+    Return a list that maps each cell style index in the source to its index in the output."""
+    # Custom number formats are referenced by ID rather than position
+    out_num_fmts = out_root.find(f"{{{MAIN_NS}}}numFmts")
+    if out_num_fmts is None:
+        out_num_fmts = ET.Element(f"{{{MAIN_NS}}}numFmts")
+        out_root.insert(0, out_num_fmts)
+    code_to_id = {el.get("formatCode"): el.get("numFmtId") for el in out_num_fmts}
+    next_num_fmt = max([int(x) for x in code_to_id.values()] + [163]) + 1
+    num_fmt_map = {}
+    src_num_fmts = src_root.find(f"{{{MAIN_NS}}}numFmts")
+    for el in src_num_fmts if src_num_fmts is not None else []:
+        code = el.get("formatCode")
+        if code not in code_to_id:
+            code_to_id[code] = str(next_num_fmt)
+            new_el = ET.SubElement(out_num_fmts, f"{{{MAIN_NS}}}numFmt")
+            new_el.set("numFmtId", str(next_num_fmt))
+            new_el.set("formatCode", code)
+            next_num_fmt += 1
+        num_fmt_map[el.get("numFmtId")] = code_to_id[code]
+    out_num_fmts.set("count", str(len(out_num_fmts)))
+
+    # Fonts, fills, and borders are referenced by position
+    maps = {}
+    for tag in ["fonts", "fills", "borders"]:
+        maps[tag] = merge_style_list(out_root, src_root, tag)
+
+    src_xfs = src_root.find(f"{{{MAIN_NS}}}cellXfs")
+    for el in src_xfs:
+        num_fmt = el.get("numFmtId", "0")
+        el.set("numFmtId", num_fmt_map.get(num_fmt, num_fmt))
+        for attr, tag in [("fontId", "fonts"), ("fillId", "fills"), ("borderId", "borders")]:
+            el.set(attr, str(maps[tag][int(el.get(attr, 0))]))
+        el.set("xfId", "0")
+    return merge_style_list(out_root, src_root, "cellXfs")
+
+
+def merge_style_list(out_root, src_root, tag):
+    """Add the elements of a list of styles (e.g., fonts) to the matching list in the output,
+    reusing identical elements. Return a list that maps each source index to an output index."""
+    out_list = out_root.find(f"{{{MAIN_NS}}}{tag}")
+    index = {}
+    for i, el in enumerate(out_list):
+        index.setdefault(ET.tostring(el), i)
+    mapping = []
+    for el in src_root.find(f"{{{MAIN_NS}}}{tag}"):
+        key = ET.tostring(el)
+        if key not in index:
+            index[key] = len(out_list)
+            out_list.append(el)
+        mapping.append(index[key])
+    out_list.set("count", str(len(out_list)))
+    return mapping
+
+
+def new_cell(row, col, style):
+    """Return an empty cell element with a style, or nothing for the default style."""
+    if style is None:
+        return b""
+    return f'<c r="{col_to_a1(col)}{row}" s="{style}"/>'.encode()
+
+
+def open_package(out_path, compression="default"):
+    """Open a new ZIP archive at out_path to write a package to. New parts are compressed with the
+    given level (see COMPRESSION)."""
+    compress_type, compresslevel = COMPRESSION[compression]
+    return zipfile.ZipFile(
+        out_path, "w", compress_type, allowZip64=True, compresslevel=compresslevel
+    )
+
+
+def open_source(path, styles_root, strings):
+    """Open a source spreadsheet and add its styles and shared strings to the output. Return the
+    open ZIP file, package details, and the style and shared string index maps."""
+    src_zf = zipfile.ZipFile(path)
+    src = read_package(src_zf)
+    xf_map = merge_styles(styles_root, ET.fromstring(src_zf.read(src["styles"])))
+    string_map = []
+    if src["shared_strings"]:
+        with src_zf.open(src["shared_strings"]) as f:
+            for _, el in ET.iterparse(f):
+                if el.tag != f"{{{MAIN_NS}}}si":
+                    continue
+                si = to_xml(el, MAIN_NS)
+                if si not in strings["index"]:
+                    strings["index"][si] = strings["count"] + len(strings["new"])
+                    strings["new"].append(si)
+                string_map.append(strings["index"][si])
+                el.clear()
+    return src_zf, src, xf_map, string_map
+
+
+def patch_row(content, row, col_to_style):
+    """Return the cells of a row (the XML inside the row element) with the style index of the
+    given columns set (None for the default style), adding any cells that do not exist."""
+    new_cells = sorted(col_to_style.items())
+    i = 0
+    out = []
+    pos = 0
+    for m in CELL_START_RE.finditer(content):
+        col = a1_to_rowcol(get_attrs(m.group(1))["r"])[1]
+        out.append(content[pos : m.start()])
+        pos = m.start()
+        while i < len(new_cells) and new_cells[i][0] < col:
+            out.append(new_cell(row, *new_cells[i]))
+            i += 1
+        if i < len(new_cells) and new_cells[i][0] == col:
+            attrs = CELL_STYLE_RE.sub(b"", m.group(1))
+            if new_cells[i][1] is not None:
+                attrs += f' s="{new_cells[i][1]}"'.encode()
+            out.append(b"<c" + attrs + m.group(2) + b">")
+            pos = m.end()
+            i += 1
+    out.append(content[pos:])
+    out.extend(new_cell(row, col, style) for col, style in new_cells[i:])
+    return b"".join(out)
+
+
+def patch_sheets(out_path, path, styles_root, sheet_patches, compression="default"):
+    """Write a copy of the spreadsheet at path to out_path with the styles of some cells changed and
+    the notes of some sheets replaced. `sheet_patches` is a dict of sheet title -> (dict of (row,
+    column) -> index of a cell style in styles_root or None for the default style, dict of cell ->
+    note or None to keep the notes). Only the worksheets with patches and their notes are
+    rewritten (and compressed with the given level), and only the rows with changed cells are
+    parsed. All other parts are copied without being decompressed, so the sheets without patches
+    are unchanged."""
+    zf = zipfile.ZipFile(path)
+    try:
+        pkg = read_package(zf)
+        missing = set(sheet_patches.keys()) - set(pkg["sheets"].keys())
+        if missing:
+            raise AxleError(f"Sheet(s) not found in {path}: " + ", ".join(sorted(missing)))
+
+        skip = set()
+        styles = None
+        styles_xml = None
+        xf_map = []
+        if any(cell_styles for cell_styles, _ in sheet_patches.values()):
+            styles_xml = zf.read(pkg["styles"])
+            styles = ET.fromstring(styles_xml)
+            xf_map = merge_styles(styles, styles_root)
+            skip.add(pkg["styles"])
+
+        defaults = dict(pkg["defaults"])
+        overrides = dict(pkg["overrides"])
+        used = set(zf.namelist())
+        # Sheet part -> (cell styles, legacy drawing, rels or None, comments part, VML part, notes)
+        plans = {}
+        for title, (cell_styles, notes) in sheet_patches.items():
+            part = pkg["sheets"][title]
+            cell_styles = {
+                k: (xf_map[v] if v is not None else None) for k, v in cell_styles.items()
+            }
+            if notes is None:
+                plans[part] = (cell_styles, None, None, None, None, None)
+                skip.add(part)
+                continue
+
+            rels = read_rels(zf, part)
+            next_rel_id = max([rel_number(r["Id"]) for r in rels] + [0]) + 1
+            comments = next((r for r in rels if r["Type"] == REL_COMMENTS), None)
+            vml = next((r for r in rels if r["Type"] == REL_VML_DRAWING), None)
+            legacy_drawing = None
+            if not notes:
+                # Remove the notes and their drawing
+                for rel in [comments, vml]:
+                    if rel:
+                        rels.remove(rel)
+                        skip.add(rel["Target"])
+                        overrides.pop(rel["Target"], None)
+                if vml:
+                    legacy_drawing = ""
+            else:
+                if not comments:
+                    comments = {
+                        "Id": f"rId{next_rel_id}",
+                        "Type": REL_COMMENTS,
+                        "Target": get_new_part_name("xl/comments/comment1.xml", used),
+                        "TargetMode": None,
+                    }
+                    next_rel_id += 1
+                    rels.append(comments)
+                    overrides[comments["Target"]] = CT_COMMENTS
+                if not vml:
+                    vml = {
+                        "Id": f"rId{next_rel_id}",
+                        "Type": REL_VML_DRAWING,
+                        "Target": get_new_part_name("xl/drawings/commentsDrawing1.vml", used),
+                        "TargetMode": None,
+                    }
+                    rels.append(vml)
+                    defaults.setdefault("vml", CT_VML_DRAWING)
+                    legacy_drawing = vml["Id"]
+                skip.update([comments["Target"], vml["Target"]])
+            skip.update([part, rels_path(part)])
+            plans[part] = (
+                cell_styles,
+                legacy_drawing,
+                rels,
+                comments["Target"] if notes else None,
+                vml["Target"] if notes else None,
+                notes,
+            )
+        if defaults != pkg["defaults"] or overrides != pkg["overrides"]:
+            skip.add("[Content_Types].xml")
+
+        with open_package(out_path, compression) as out_zf:
+            for name in zf.namelist():
+                if name not in skip:
+                    copy_raw(zf, out_zf, name)
+            for part, (cell_styles, legacy_drawing, rels, comments, vml, notes) in plans.items():
+                patch_worksheet(zf, part, out_zf, cell_styles, legacy_drawing)
+                if rels is None:
+                    continue
+                if rels:
+                    write_rels(out_zf, part, rels)
+                if notes:
+                    write_comments(out_zf, comments, vml, notes)
+            if styles is not None:
+                data = to_xml(styles, MAIN_NS, source=styles_xml)
+                out_zf.writestr(new_zip_info(out_zf, pkg["styles"]), data)
+            if "[Content_Types].xml" in skip:
+                write_content_types(out_zf, defaults, overrides)
+    finally:
+        zf.close()
+
+
+def patch_worksheet(src_zf, part, out_zf, cell_styles, legacy_drawing=None):
+    """Stream a worksheet from one package to another, setting the style index of the given cells
+    (a dict of (row, column) -> style index, or None for the default style) and adding any cells
+    that do not exist. Rows without changed cells are copied as-is. If legacy_drawing is a
+    relationship ID, a legacyDrawing element (for notes) is added; if it is '', it is removed."""
+    row_to_styles = {}
+    for (row, col), style in cell_styles.items():
+        row_to_styles.setdefault(row, {})[col] = style
+    rows = sorted(row_to_styles.keys())
+    i = 0
+
+    def new_rows(before=None):
+        """Return the rows with changed cells that come before a row and do not exist yet."""
+        nonlocal i
+        out = []
+        while i < len(rows) and (before is None or rows[i] < before):
+            cells = patch_row(b"", rows[i], row_to_styles[rows[i]])
+            if cells:
+                out.append(f'<row r="{rows[i]}">'.encode() + cells + b"</row>")
+            i += 1
+        return b"".join(out)
+
+    def process(data, last=False):
+        nonlocal i
+        out = []
+        pos = 0
+        for m in ROW_START_RE.finditer(data):
+            if m.start() < pos:
+                continue
+            row = int(get_attrs(m.group(1))["r"])
+            out.append(data[pos : m.start()])
+            out.append(new_rows(before=row))
+            pos = m.start()
+            if i < len(rows) and rows[i] == row:
+                if m.group(2):
+                    content = b""
+                    pos = m.end()
+                else:
+                    end = data.index(b"</row>", m.end())
+                    content = data[m.end() : end]
+                    pos = end + len(b"</row>")
+                attrs = ROW_SPANS_RE.sub(b"", m.group(1))
+                cells = patch_row(content, row, row_to_styles[row])
+                out.append(b"<row" + attrs + b">" + cells + b"</row>")
+                i += 1
+        rest = data[pos:]
+        if last:
+            # Add the rest of the new rows at the end of the sheet data
+            m = SHEET_DATA_RE.search(rest)
+            if m:
+                start = b"" if m.group(0) == b"</sheetData>" else b"<sheetData>"
+                rest = rest[: m.start()] + start + new_rows() + b"</sheetData>" + rest[m.end() :]
+            if legacy_drawing == "":
+                rest = LEGACY_DRAWING_RE.sub(b"", rest)
+            elif legacy_drawing:
+                m = AFTER_LEGACY_DRAWING_RE.search(rest)
+                rest = (
+                    rest[: m.start()]
+                    + f'<legacyDrawing xmlns:r="{REL_NS}" r:id="{legacy_drawing}"/>'.encode()
+                    + rest[m.start() :]
+                )
+        out.append(rest)
+        return b"".join(out)
+
+    # Extend the dimension of the sheet to any new cells
+    bounds = [rowcol for rowcol, style in cell_styles.items() if style is not None]
+
+    def replace_dimension(m):
+        ref = get_attrs(m.group(1)).get("ref")
+        rowcols = a1_range_to_rowcols(ref) if ref else None
+        if not rowcols:
+            return m.group(0)
+        for row, col in bounds:
+            rowcols = (
+                min(rowcols[0], row),
+                min(rowcols[1], col),
+                max(rowcols[2], row),
+                max(rowcols[3], col),
+            )
+        return f'<dimension ref="{rowcols_to_a1_range(*rowcols)}"/>'.encode()
+
+    with src_zf.open(part) as fr, out_zf.open(new_zip_info(out_zf, part), "w") as fw:
+        buffer = b""
+        first = True
+        while True:
+            chunk = fr.read(CHUNK_SIZE)
+            if not chunk:
+                break
+            buffer += chunk
+            # Only process complete rows so that no row is split between chunks
+            end = buffer.rfind(b"</row>")
+            if end < 0:
+                continue
+            end += len(b"</row>")
+            data = buffer[:end]
+            if first:
+                data = DIMENSION_RE.sub(replace_dimension, data, count=1)
+                first = False
+            fw.write(process(data))
+            buffer = buffer[end:]
+        if first:
+            buffer = DIMENSION_RE.sub(replace_dimension, buffer, count=1)
+        fw.write(process(buffer, last=True))
+
+
+def read_package(zf):
+    """Return the details of an XLSX package needed to find and copy its parts."""
+    root_rels = read_rels(zf, "")
+    workbook = None
+    for rel in root_rels:
+        if rel["Type"] == REL_OFFICE_DOCUMENT:
+            workbook = rel["Target"]
+    if not workbook:
+        raise AxleError("Spreadsheet does not contain a workbook")
+    workbook_rels = read_rels(zf, workbook)
+    workbook_xml = zf.read(workbook)
+    workbook_root = ET.fromstring(workbook_xml)
+
+    rel_targets = {rel["Id"]: rel["Target"] for rel in workbook_rels}
+    sheets = {}
+    for el in workbook_root.iter(f"{{{MAIN_NS}}}sheet"):
+        sheets[el.get("name")] = rel_targets[el.get(f"{{{REL_NS}}}id")]
+    styles = None
+    shared_strings = None
+    for rel in workbook_rels:
+        if rel["Type"] == REL_STYLES:
+            styles = rel["Target"]
+        elif rel["Type"] == REL_SHARED_STRINGS:
+            shared_strings = rel["Target"]
+
+    ct_root = ET.fromstring(zf.read("[Content_Types].xml"))
+    defaults = {}
+    for el in ct_root.iter(f"{{{CT_NS}}}Default"):
+        defaults[el.get("Extension").lower()] = el.get("ContentType")
+    overrides = {}
+    for el in ct_root.iter(f"{{{CT_NS}}}Override"):
+        overrides[el.get("PartName").lstrip("/")] = el.get("ContentType")
+
+    return {
+        "workbook": workbook,
+        "workbook_rels": workbook_rels,
+        "workbook_root": workbook_root,
+        "workbook_xml": workbook_xml,
+        "sheets": sheets,
+        "styles": styles,
+        "shared_strings": shared_strings,
+        "defaults": defaults,
+        "overrides": overrides,
+    }
+
+
+def read_sheet_details(zf, part):
+    """Return the details of a worksheet that openpyxl does not provide in read-only mode, without
+    reading its cells: the top-left cell of the frozen pane (or None), a dict of cell -> external
+    hyperlink target, and a dict of cell -> note."""
+    rels = read_rels(zf, part)
+
+    # The frozen pane is in the sheet view, before the cells
+    frozen = None
+    with zf.open(part) as f:
+        data = b""
+        while b"<sheetData" not in data:
+            chunk = f.read(CHUNK_SIZE)
+            if not chunk:
+                break
+            data += chunk
+        m = PANE_RE.search(data.split(b"<sheetData", 1)[0])
+        if m:
+            frozen = get_attrs(m.group(1)).get("topLeftCell")
+
+        # Hyperlinks come after the cells, so only look for them if the sheet has external links
+        hyperlinks = {}
+        targets = {r["Id"]: r["Target"] for r in rels if r["Type"] == REL_HYPERLINK}
+        if targets:
+            while b"</sheetData>" not in data:
+                chunk = f.read(CHUNK_SIZE)
+                if not chunk:
+                    break
+                # Keep enough of the previous data to find the end tag if it was split
+                data = data[-16:] + chunk
+            tail = data.split(b"</sheetData>", 1)[-1] + f.read()
+            for m in HYPERLINK_RE.finditer(tail):
+                attrs = get_attrs(m.group(1))
+                target = targets.get(attrs.get("r:id"))
+                if not target or "ref" not in attrs:
+                    continue
+                for cell in get_range_cells(attrs["ref"]):
+                    hyperlinks[cell] = target
+
+    notes = {}
+    for rel in rels:
+        if rel["Type"] != REL_COMMENTS:
+            continue
+        authors = []
+        with zf.open(rel["Target"]) as f:
+            for _, el in ET.iterparse(f):
+                if el.tag == f"{{{MAIN_NS}}}author":
+                    # Like openpyxl, an empty author is read as 'None'
+                    authors.append(str(el.text))
+                elif el.tag == f"{{{MAIN_NS}}}comment":
+                    # Like openpyxl, use the plain text and the text of each run
+                    text = get_text(el.find(f"{{{MAIN_NS}}}text")) or ""
+                    author = authors[int(el.get("authorId", 0))] if authors else None
+                    notes[el.get("ref")] = {"text": text, "author": author}
+                    el.clear()
+    return frozen, hyperlinks, notes
+
+
+def iter_sheet_rows(zf, part, strings, date_styles=(), timedelta_styles=(), epoch=None):
+    """Stream the cells of a worksheet without creating openpyxl cells. Yield the row number and a
+    list of (column number, value, style index) for each row that has cells. Values are converted
+    the same way openpyxl converts them: numbers, booleans, dates (for cells in date_styles), shared
+    and inline strings, and formulas (as '=' followed by the formula)."""
+    row_tag = f"{{{MAIN_NS}}}row"
+    cell_tag = f"{{{MAIN_NS}}}c"
+    value_tag = f"{{{MAIN_NS}}}v"
+    formula_tag = f"{{{MAIN_NS}}}f"
+    inline_tag = f"{{{MAIN_NS}}}is"
+    # Column letters -> column number
+    columns = {}
+    shared_formulas = {}
+
+    def read_row(row, row_number):
+        col = 0
+        cells = []
+        for c in row:
+            if c.tag != cell_tag:
+                continue
+            coordinate = c.get("r")
+            if coordinate:
+                letters = coordinate.rstrip("0123456789")
+                col = columns.get(letters)
+                if not col:
+                    col = a1_to_rowcol(coordinate)[1]
+                    columns[letters] = col
+            else:
+                col += 1
+                coordinate = col_to_a1(col) + str(row_number)
+            data_type = c.get("t", "n")
+            style_id = int(c.get("s") or 0)
+            value = None
+            formula = None
+            inline = None
+            for child in c:
+                if child.tag == value_tag:
+                    value = child.text or None
+                elif child.tag == formula_tag:
+                    formula = child
+                elif child.tag == inline_tag:
+                    inline = child
+
+            if formula is not None:
+                value = "=" + (formula.text or "")
+                if formula.get("t") == "shared":
+                    # Only the first cell of a shared formula has the formula text
+                    idx = formula.get("si")
+                    if idx in shared_formulas:
+                        value = shared_formulas[idx].translate_formula(coordinate)
+                    elif value != "=":
+                        shared_formulas[idx] = Translator(value, coordinate)
+            elif data_type == "inlineStr":
+                value = get_text(inline)
+            elif value is None:
+                pass
+            elif data_type == "n":
+                if "." in value or "E" in value or "e" in value:
+                    value = float(value)
+                else:
+                    value = int(value)
+                if style_id in date_styles:
+                    try:
+                        value = from_excel(value, epoch, timedelta=style_id in timedelta_styles)
+                    except (OverflowError, ValueError):
+                        # openpyxl treats dates that are out of range as errors
+                        value = "#VALUE!"
+            elif data_type == "s":
+                value = strings[int(value)]
+            elif data_type == "b":
+                value = bool(int(value))
+            elif data_type == "d":
+                value = from_ISO8601(value)
+            cells.append((col, value, style_id))
+        return cells
+
+    row_number = 0
+    sheet_data = None
+    row = None
+    with zf.open(part) as f:
+        # Only start events are used, as there are half as many of them. A row is complete once the
+        # next row starts (or the worksheet ends).
+        for _, el in ET.iterparse(f, events=("start",)):
+            if el.tag == row_tag:
+                if row is not None:
+                    cells = read_row(row, row_number)
+                    if cells:
+                        yield row_number, cells
+                # Remove rows that have been read so that memory use does not grow with the sheet
+                # (the parser still adds cells to the new row)
+                sheet_data.clear()
+                row = el
+                r = el.get("r")
+                row_number = int(r) if r else row_number + 1
+            elif el.tag == f"{{{MAIN_NS}}}sheetData":
+                sheet_data = el
+    if row is not None:
+        cells = read_row(row, row_number)
+        if cells:
+            yield row_number, cells
+
+
+def get_text(el):
+    """Return the text of a string item (plain text and the text of each run) like openpyxl, or
+    None if there is no item."""
+    if el is None:
+        return None
+    if len(el) == 1 and el[0].tag == f"{{{MAIN_NS}}}t":
+        return el[0].text or ""
+    snippets = el.findall(f"{{{MAIN_NS}}}t")
+    snippets.extend(el.findall(f"{{{MAIN_NS}}}r/{{{MAIN_NS}}}t"))
+    return "".join(t.text or "" for t in snippets)
+
+
+def read_dimension(zf, part):
+    """Return the number of rows and columns in the dimension of a worksheet, or None if the
+    worksheet does not include its dimension."""
+    with zf.open(part) as f:
+        data = f.read(CHUNK_SIZE)
+    m = DIMENSION_RE.search(data.split(b"<sheetData", 1)[0])
+    if not m:
+        return None
+    ref = get_attrs(m.group(1)).get("ref", "")
+    return a1_to_rowcol(ref.split(":")[-1])
+
+
+def read_shared_strings(zf, part):
+    """Return a list of the text of each item in a shared strings part."""
+    strings = []
+    if not part:
+        return strings
+    with zf.open(part) as f:
+        for _, el in ET.iterparse(f):
+            if el.tag == f"{{{MAIN_NS}}}si":
+                # Like openpyxl, drop the escape for literal underscores
+                strings.append(get_text(el).replace("x005F_", ""))
+                el.clear()
+    return strings
+
+
+def get_attrs(data):
+    """Return the attributes from the bytes of an XML start tag as a dict of str -> str."""
+    return {k.decode(): v.decode() for k, v in ATTR_RE.findall(data)}
+
+
+def get_range_cells(ref):
+    """Return the A1 labels of all cells in a range like A1:B2 (or a single cell)."""
+    if ":" not in ref:
+        return [ref]
+    start = a1_to_rowcol(ref.split(":", 1)[0])
+    end = a1_to_rowcol(ref.split(":", 1)[1])
+    if not start or not end:
+        return []
+    cells = []
+    for row in range(start[0], end[0] + 1):
+        for col in range(start[1], end[1] + 1):
+            cells.append(col_to_a1(col) + str(row))
+    return cells
+
+
+def read_rels(zf, part):
+    """Return the relationships of a part as a list of dicts. Internal targets are resolved to
+    part names."""
+    try:
+        data = zf.read(rels_path(part))
+    except KeyError:
+        return []
+    rels = []
+    for el in ET.fromstring(data):
+        target = el.get("Target")
+        target_mode = el.get("TargetMode")
+        if target_mode != "External":
+            if target.startswith("/"):
+                target = target[1:]
+            else:
+                target = posixpath.normpath(posixpath.join(posixpath.dirname(part), target))
+        rels.append(
+            {
+                "Id": el.get("Id"),
+                "Type": el.get("Type"),
+                "Target": target,
+                "TargetMode": target_mode,
+            }
+        )
+    return rels
+
+
+def rel_number(rel_id):
+    """Return the number in a relationship ID like rId3, or 0 if it does not have one."""
+    m = re.search(r"(\d+)$", rel_id)
+    if m:
+        return int(m.group(1))
+    return 0
+
+
+def rels_path(part):
+    """Return the name of the relationships part for a part (or for the package, if part is '')."""
+    directory, filename = posixpath.split(part)
+    return posixpath.join(directory, "_rels", filename + ".rels")
+
+
+def rewrite_worksheet(src_zf, part, out_zf, new_part, xf_map, string_map):
+    """Stream a worksheet from one package to another, mapping its cell styles and shared string
+    indexes to those of the output package."""
+
+    def replace_style(m):
+        return m.group(1) + str(xf_map[int(m.group(2))]).encode() + m.group(3)
+
+    def replace_cell(m):
+        tag, attrs, close, value, idx = m.groups()
+        attrs = STYLE_ATTR_RE.sub(replace_style, attrs)
+        if value and SHARED_STRING_ATTR_RE.search(attrs):
+            value = b"<v>" + str(string_map[int(idx)]).encode() + b"</v>"
+        return b"<" + tag + attrs + close + b">" + (value or b"")
+
+    def process(data):
+        data = TAB_SELECTED_RE.sub(b"", data)
+        return CELL_RE.sub(replace_cell, data)
+
+    with src_zf.open(part) as fr, out_zf.open(new_zip_info(out_zf, new_part), "w") as fw:
+        buffer = b""
+        while True:
+            chunk = fr.read(CHUNK_SIZE)
+            if not chunk:
+                break
+            buffer += chunk
+            # Only process complete rows so that no cell is split between chunks
+            end = buffer.rfind(b"</row>")
+            if end < 0:
+                continue
+            end += len(b"</row>")
+            fw.write(process(buffer[:end]))
+            buffer = buffer[end:]
+        fw.write(process(buffer))
+
+
+def save_workbook(wb, path, compression="default", strings=None):
+    """Save an openpyxl workbook to path with the given compression level (see COMPRESSION). Each
+    worksheet is written straight into the package as it is produced. If strings is not None, text
+    cells are written as shared strings, starting from the given dict of string -> index (see
+    use_worksheet_writer). The package is written in a temporary directory next to path and then
+    replaces path in one step, so path is never left partly written. Without the openpyxl writers
+    (see HAS_WRITERS), the workbook is saved by openpyxl with its default compression and inline
+    strings."""
+    directory = os.path.dirname(os.path.abspath(path))
+    with tempfile.TemporaryDirectory(dir=directory) as tmp:
+        tmp_path = os.path.join(tmp, os.path.basename(path))
+        if not HAS_WRITERS:
+            wb.save(tmp_path)
+            os.replace(tmp_path, path)
+            return
+        with open_package(tmp_path, compression) as archive:
+            wb.properties.modified = datetime.datetime.now(tz=datetime.timezone.utc).replace(
+                tzinfo=None
+            )
+            StreamingExcelWriter(wb, archive, strings=strings).write_data()
+        os.replace(tmp_path, path)
+
+
+def to_xml(root, namespace, source=None):
+    """Serialize an element and its children with namespace as the default namespace. If source is
+    the XML that the element was parsed from, the other namespaces keep their prefixes from the
+    source and all namespaces declared on its root element stay declared: files saved by Excel list
+    prefixes in mc:Ignorable that may not be used by any element."""
+    declarations = []
+    if source:
+        for prefix, uri in XMLNS_RE.findall(source):
+            try:
+                ET.register_namespace(prefix.decode(), uri.decode())
+            except ValueError:
+                # Prefixes like ns0 are reserved by ElementTree
+                continue
+        declarations = XMLNS_RE.findall(ROOT_START_RE.search(source).group(0))
+    prefix = f"{{{namespace}}}"
+    for el in root.iter():
+        if el.tag.startswith(prefix):
+            el.tag = el.tag[len(prefix) :]
+    root.set("xmlns", namespace)
+    data = ET.tostring(root)
+    if declarations:
+        m = ROOT_START_RE.search(data)
+        start = m.group(0)
+        declared = {prefix for prefix, _ in XMLNS_RE.findall(start)}
+        for prefix, uri in declarations:
+            if prefix not in declared:
+                end = -2 if start.endswith(b"/>") else -1
+                start = start[:end] + b" xmlns:" + prefix + b'="' + uri + b'"' + start[end:]
+        data = data[: m.start()] + start + data[m.end() :]
+    return data
+
+
+def use_worksheet_writer(ws, strings=None):
+    """Make a write-only worksheet keep the bounds of its cells, so that it is saved with its
+    dimension. If strings is not None, text cells are written as shared strings, which are added to
+    the dict of string -> index, and the same dict must be given to save_workbook. This must be
+    called before any rows are appended. Without the openpyxl writers (see HAS_WRITERS), the
+    worksheet is saved without its dimension and with inline strings."""
+    if not HAS_WRITERS:
+        return
+    if strings is None:
+        set_worksheet_writer(ws, BoundedWorksheetWriter(ws))
+    else:
+        set_worksheet_writer(ws, SharedStringWorksheetWriter(ws, strings))
+
+
+def write_comments(out_zf, part, vml_part, notes):
+    """Write the notes of a worksheet (a dict of cell -> note) and the drawing that displays them
+    to the output package, the same way openpyxl does."""
+    records = []
+    for cell, note in sorted(notes.items(), key=lambda x: a1_to_rowcol(x[0]) or (0, 0)):
+        record = CommentRecord(ref=cell, author=note["author"])
+        record.text.t = note["text"]
+        records.append(record)
+    comment_sheet = CommentSheet.from_comments(records)
+    out_zf.writestr(new_zip_info(out_zf, part), tostring(comment_sheet.to_tree()))
+    out_zf.writestr(new_zip_info(out_zf, vml_part), comment_sheet.write_shapes())
+
+
+def write_content_types(out_zf, defaults, overrides):
+    """Write [Content_Types].xml for the output package."""
+    root = ET.Element("Types", xmlns=CT_NS)
+    for ext, content_type in defaults.items():
+        ET.SubElement(root, "Default", Extension=ext, ContentType=content_type)
+    for part, content_type in overrides.items():
+        ET.SubElement(root, "Override", PartName="/" + part, ContentType=content_type)
+    out_zf.writestr("[Content_Types].xml", ET.tostring(root))
+
+
+def write_rels(out_zf, part, rels):
+    """Write the relationships part for a part in the output package."""
+    root = ET.Element("Relationships", xmlns=PKG_REL_NS)
+    for rel in rels:
+        el = ET.SubElement(root, "Relationship", Id=rel["Id"], Type=rel["Type"])
+        if rel["TargetMode"] == "External":
+            el.set("Target", rel["Target"])
+            el.set("TargetMode", rel["TargetMode"])
+        else:
+            el.set("Target", "/" + rel["Target"])
+    out_zf.writestr(rels_path(part), ET.tostring(root))
+
+
+def write_string_table(out_zf, part, strings):
+    """Write a shared strings part from a dict of string -> index, in the order of the indexes."""
+    with out_zf.open(new_zip_info(out_zf, part), "w") as fw:
+        fw.write(f'<sst xmlns="{MAIN_NS}" uniqueCount="{len(strings)}">'.encode())
+        items = []
+        for text in strings:
+            if text != text.strip():
+                items.append(f'<si><t xml:space="preserve">{escape(text)}</t></si>')
+            else:
+                items.append(f"<si><t>{escape(text)}</t></si>")
+            if len(items) >= 10000:
+                fw.write("".join(items).encode())
+                items = []
+        fw.write("".join(items).encode() + b"</sst>")
+
+
+def write_shared_strings(base_zf, base_part, out_zf, part, strings):
+    """Stream the shared strings of the base package to the output package, followed by any new
+    strings from the other sources."""
+    new_strings = b"".join(strings["new"])
+    with out_zf.open(new_zip_info(out_zf, part), "w") as fw:
+        if not base_part:
+            fw.write(f'<sst xmlns="{MAIN_NS}">'.encode() + new_strings + b"</sst>")
+            return
+        with base_zf.open(base_part) as fr:
+            buffer = b""
+            start = True
+            while True:
+                chunk = fr.read(CHUNK_SIZE)
+                if not chunk:
+                    break
+                buffer += chunk
+                if start:
+                    # The counts are optional, so drop them instead of recounting
+                    m = re.search(rb"<(\w+:)?sst\b[^>]*>", buffer)
+                    if not m:
+                        continue
+                    head = re.sub(rb'\s(count|uniqueCount)="\d+"', b"", m.group(0))
+                    buffer = buffer[: m.start()] + head + buffer[m.end() :]
+                    start = False
+                # Hold back enough data to find the end tag
+                if len(buffer) > 64:
+                    fw.write(buffer[:-64])
+                    buffer = buffer[-64:]
+            end = re.search(rb"(</(\w+:)?sst>|/>)\s*$", buffer)
+            if not end:
+                raise AxleError(f"Unable to read shared strings from {base_part}")
+            if end.group(1) == b"/>":
+                # Empty element, e.g. <sst/>
+                fw.write(buffer[: end.start()] + b">" + new_strings + b"</sst>")
+            else:
+                fw.write(buffer[: end.start()] + new_strings + end.group(1))
@@ -0,0 +1,58 @@
+"""Compare two benchmark reports from run.py. For each phase, print the wall time and peak RSS in
+both reports and their ratio. Exit with status 1 if any phase got slower than the threshold."""
+import json
+import sys
+
+from argparse import ArgumentParser
+
+
+def compare(old, new, threshold=1.2):
+    """Return the lines of a comparison of two reports and a list of the phases whose wall time
+    grew by more than the threshold (a ratio of new to old)."""
+    old_phases = {p["phase"]: p for p in old["phases"]}
+    header = ["old (s)", "new (s)", "ratio", "old RSS", "new RSS"]
+    widths = [10, 10, 8, 12, 12]
+    lines = ["phase".ljust(10) + "".join(h.rjust(w) for h, w in zip(header, widths))]
+    slower = []
+    for result in new["phases"]:
+        phase = result["phase"]
+        previous = old_phases.get(phase)
+        if not previous:
+            continue
+        ratio = result["wall_time"] / previous["wall_time"] if previous["wall_time"] else 0
+        if ratio > threshold:
+            slower.append(phase)
+        lines.append(
+            f"{phase:<10}{previous['wall_time']:>10.3f}{result['wall_time']:>10.3f}{ratio:>8.2f}"
+            f"{previous.get('peak_rss_kb', ''):>12}{result.get('peak_rss_kb', ''):>12}"
+        )
+    if old.get("options") != new.get("options"):
+        lines.append("WARNING: the reports were run with different options")
+    return lines, slower
+
+
+def main():
+    parser = ArgumentParser(description="Compare two AXLE benchmark reports")
+    parser.add_argument("old", help="Path to the report to compare against")
+    parser.add_argument("new", help="Path to the new report")
+    parser.add_argument(
+        "-t",
+        "--threshold",
+        help="Ratio of new to old wall time that counts as a regression (default: 1.2)",
+        type=float,
+        default=1.2,
+    )
+    args = parser.parse_args()
+    with open(args.old, "r") as f:
+        old = json.load(f)
+    with open(args.new, "r") as f:
+        new = json.load(f)
+    lines, slower = compare(old, new, threshold=args.threshold)
+    print("\n".join(lines))
+    if slower:
+        print("Slower: " + ", ".join(slower))
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,152 @@
+"""Generate a synthetic AXLE project for benchmarks. The tables are added with `axle init` and
+`axle add`, and the project gets formatted and noted cells and a message table for `axle apply`.
+All values are generated from a seed, so the same options always give the same project."""
+import csv
+import os
+import random
+
+from argparse import ArgumentParser
+from axle.add import add
+from axle.helpers import (
+    col_to_a1,
+    get_format_dict,
+    update_format_dict,
+    update_formats,
+    update_notes,
+)
+from axle.init import init
+
+# Formats that are not "applied" formats (see DEFAULT_FORMATS in axle/init.py)
+FORMATS = {
+    4: {"font": {"b": True, "color": {"rgb": "FF000000"}}},
+    5: {"fill": {"fgColor": {"rgb": "FFD9EAD3"}, "patternType": "solid"}},
+    6: {"alignment": {"horizontal": "center"}, "number_format": "0.00"},
+}
+
+LEVELS = ["error", "warn", "info"]
+
+
+def generate(
+    path,
+    sheets=2,
+    rows=1000,
+    columns=10,
+    format_density=0.01,
+    note_density=0.01,
+    messages=1000,
+    seed=0,
+):
+    """Create an AXLE project in the directory at path (which must not exist) with the given number
+    of sheets, each with a header and the given number of rows and columns. The densities are the
+    fractions of cells with a format or a note, and messages is the number of rows in the message
+    table, messages.tsv. The spreadsheet is not pushed."""
+    rand = random.Random(seed)
+    os.makedirs(os.path.join(path, "tables"))
+    cwd = os.getcwd()
+    os.chdir(path)
+    try:
+        init("Benchmark")
+        titles = []
+        for n in range(1, sheets + 1):
+            title = f"sheet{n}"
+            table_path = os.path.join("tables", title + ".tsv")
+            write_table(table_path, rows, columns, rand)
+            add(table_path)
+            titles.append(title)
+
+        update_format_dict(".axle", {**get_format_dict(".axle"), **FORMATS})
+        sheet_formats = {}
+        sheet_notes = {}
+        for title in titles:
+            sheet_formats[title] = {
+                cell: rand.choice(list(FORMATS.keys()))
+                for cell in sample_cells(rows, columns, format_density, rand)
+            }
+            sheet_notes[title] = {
+                cell: {"text": f"Note on {cell}", "author": "benchmark"}
+                for cell in sample_cells(rows, columns, note_density, rand)
+            }
+        update_formats(".axle", sheet_formats)
+        update_notes(".axle", sheet_notes)
+
+        with open("messages.tsv", "w") as f:
+            writer = csv.writer(f, delimiter="\t", lineterminator="\n")
+            writer.writerow(["table", "cell", "level", "rule id", "rule", "message"])
+            for n in range(messages):
+                row = rand.randint(2, rows + 1)
+                cell = col_to_a1(rand.randint(1, columns)) + str(row)
+                level = rand.choice(LEVELS)
+                writer.writerow(
+                    [rand.choice(titles), cell, level, f"rule:{n % 10}", f"Rule {n % 10}", "Bad"]
+                )
+    finally:
+        os.chdir(cwd)
+
+
+def sample_cells(rows, columns, density, rand):
+    """Return a sorted list of random data cells (below the header) with the given density."""
+    total = rows * columns
+    count = min(total, int(total * density))
+    cells = []
+    for i in sorted(rand.sample(range(total), count)):
+        cells.append(col_to_a1(i % columns + 1) + str(i // columns + 2))
+    return cells
+
+
+def write_table(path, rows, columns, rand):
+    """Write a table with a header and rows of IDs, labels, and numbers."""
+    with open(path, "w") as f:
+        writer = csv.writer(f, delimiter="\t", lineterminator="\n")
+        writer.writerow([f"column {n}" for n in range(1, columns + 1)])
+        for n in range(1, rows + 1):
+            row = []
+            for col in range(columns):
+                if col == 0:
+                    row.append(f"ID:{n:07d}")
+                elif col % 3 == 1:
+                    row.append(f"label {rand.randint(0, 99999)}")
+                else:
+                    row.append(str(rand.randint(0, 1000000)))
+            writer.writerow(row)
+
+
+def add_arguments(parser):
+    """Add the options for generating a project to an argument parser."""
+    parser.add_argument("--sheets", help="Number of sheets", type=int, default=2)
+    parser.add_argument("--rows", help="Number of rows in each sheet", type=int, default=1000)
+    parser.add_argument("--columns", help="Number of columns in each sheet", type=int, default=10)
+    parser.add_argument(
+        "--format-density", help="Fraction of cells with a format", type=float, default=0.01
+    )
+    parser.add_argument(
+        "--note-density", help="Fraction of cells with a note", type=float, default=0.01
+    )
+    parser.add_argument(
+        "--messages", help="Number of rows in the message table", type=int, default=1000
+    )
+    parser.add_argument("--seed", help="Seed for the generated values", type=int, default=0)
+
+
+def get_options(args):
+    """Return the options for generate from parsed arguments."""
+    return {
+        "sheets": args.sheets,
+        "rows": args.rows,
+        "columns": args.columns,
+        "format_density": args.format_density,
+        "note_density": args.note_density,
+        "messages": args.messages,
+        "seed": args.seed,
+    }
+
+
+def main():
+    parser = ArgumentParser(description="Generate a synthetic AXLE project")
+    parser.add_argument("path", help="Directory to create the project in")
+    add_arguments(parser)
+    args = parser.parse_args()
+    generate(args.path, **get_options(args))
+
+
+if __name__ == "__main__":
+    main()
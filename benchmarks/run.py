@@ -0,0 +1,133 @@
+"""Time the AXLE commands on a synthetic project and write a JSON report with the wall time and
+peak RSS of each phase. Each phase runs in its own process, so that its peak RSS is not affected by
+the phases before it. Reports from different runs can be compared with compare.py."""
+import json
+import os
+import platform
+import resource
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+from argparse import SUPPRESS, ArgumentParser
+from axle.apply import apply
+from axle.clear import clear
+from axle.fetch import ENGINES, fetch
+from axle.helpers import get_version
+from axle.merge import merge
+from axle.push import push
+from generate import add_arguments, generate, get_options
+
+# Phases in the order they are run; each one runs on the project as the ones before it left it
+PHASES = ["push", "fetch", "merge", "apply", "clear"]
+
+
+def run_phase(phase, project, streaming=False, engine="openpyxl"):
+    """Run one phase on the project in this process. Return its wall time in seconds and the peak
+    RSS of this process in KB."""
+    os.chdir(project)
+    start = time.perf_counter()
+    if phase == "push":
+        push(streaming=streaming, full=True)
+    elif phase == "fetch":
+        fetch(streaming=streaming, engine=engine)
+    elif phase == "merge":
+        merge()
+    elif phase == "apply":
+        apply(["messages.tsv"])
+    elif phase == "clear":
+        clear("all")
+    else:
+        raise ValueError(f"Unknown phase '{phase}'")
+    wall_time = time.perf_counter() - start
+    return {
+        "wall_time": wall_time,
+        "peak_rss_kb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+    }
+
+
+def benchmark(options, phases=None, streaming=False, engine="openpyxl", project=None):
+    """Generate a project with the given options (see generate) and run each phase in a new
+    process. If project is provided, the project is created there and kept. Return the report."""
+    phases = phases or PHASES
+    tmp = None
+    if not project:
+        tmp = tempfile.mkdtemp(prefix="axle-benchmark-")
+        project = os.path.join(tmp, "project")
+    try:
+        start = time.perf_counter()
+        generate(project, **options)
+        results = [{"phase": "generate", "wall_time": time.perf_counter() - start}]
+        for phase in phases:
+            cmd = [sys.executable, os.path.abspath(__file__), "--phase", phase, project]
+            if streaming:
+                cmd.append("--streaming")
+            cmd.extend(["--engine", engine])
+            proc = subprocess.run(cmd, stdout=subprocess.PIPE, check=True)
+            result = json.loads(proc.stdout.decode().strip().splitlines()[-1])
+            results.append(dict(phase=phase, **result))
+    finally:
+        if tmp:
+            shutil.rmtree(tmp)
+    return {
+        "axle_version": get_version(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "time": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "options": dict(options, streaming=streaming, engine=engine),
+        "phases": results,
+    }
+
+
+def main():
+    parser = ArgumentParser(description="Run the AXLE benchmarks on a synthetic project")
+    add_arguments(parser)
+    parser.add_argument(
+        "-o", "--output", help="Path to write the JSON report to (default: print the report)"
+    )
+    parser.add_argument(
+        "--phases",
+        help="Comma-separated phases to run (default: all phases)",
+        default=",".join(PHASES),
+    )
+    parser.add_argument(
+        "-s", "--streaming", help="Use streaming mode for push and fetch", action="store_true"
+    )
+    parser.add_argument(
+        "-e", "--engine", help="Engine used to fetch", choices=ENGINES, default="openpyxl"
+    )
+    parser.add_argument("--project", help="Directory to create the project in and keep")
+    # Used to run a single phase in a new process
+    parser.add_argument("--phase", help=SUPPRESS)
+    parser.add_argument("phase_project", nargs="?", help=SUPPRESS)
+    args = parser.parse_args()
+
+    if args.phase:
+        result = run_phase(
+            args.phase, args.phase_project, streaming=args.streaming, engine=args.engine
+        )
+        print(json.dumps(result))
+        return
+
+    phases = [p.strip() for p in args.phases.split(",") if p.strip()]
+    for phase in phases:
+        if phase not in PHASES:
+            parser.error(f"unknown phase '{phase}' - must be one of: " + ", ".join(PHASES))
+    report = benchmark(
+        get_options(args),
+        phases=phases,
+        streaming=args.streaming,
+        engine=args.engine,
+        project=args.project,
+    )
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(json.dumps(report, indent=4))
+    else:
+        print(json.dumps(report, indent=4))
+
+
+if __name__ == "__main__":
+    main()
@@ -23,6 +23,7 @@ setup(
         "License :: OSI Approved :: BSD License",
     ],
     packages=find_packages(exclude="tests"),
-    python_requires=">=3.6, <4",
+    install_requires=["openpyxl>=3.1,<3.2"],
+    python_requires=">=3.8, <3.14",
     entry_points={"console_scripts": ["axle=axle.cli:main"]},
 )
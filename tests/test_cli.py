@@ -0,0 +1,22 @@
+import subprocess
+import sys
+
+# Run add through the command line in a new interpreter, then check which modules were imported
+ADD_SCRIPT = """
+import sys
+from axle.cli import main
+
+sys.argv = ["axle", "add", "foo.tsv"]
+main()
+assert "openpyxl" not in sys.modules, "openpyxl was imported"
+"""
+
+
+def test_add_does_not_import_openpyxl(tmp_path):
+    subprocess.run([sys.executable, "-m", "axle.cli", "init", "Test"], cwd=tmp_path, check=True)
+    (tmp_path / "foo.tsv").write_text("a\tb\n1\t2\n")
+    result = subprocess.run(
+        [sys.executable, "-c", ADD_SCRIPT], cwd=tmp_path, capture_output=True, text=True
+    )
+    assert result.returncode == 0, result.stderr
+    assert "foo.tsv" in (tmp_path / ".axle" / "sheet.tsv").read_text()
@@ -0,0 +1,29 @@
+import zipfile
+
+from axle import compat
+
+
+def write_source(path):
+    """Write a ZIP archive with a compressed part and a stored part."""
+    with zipfile.ZipFile(path, "w") as zf:
+        zf.writestr("a.xml", b"<a>" + b"x" * 10000 + b"</a>", zipfile.ZIP_DEFLATED)
+        zf.writestr("b.bin", b"\0\1\2", zipfile.ZIP_STORED)
+
+
+def test_copy_raw_with_and_without_zip_internals(tmp_path, monkeypatch):
+    src_path = str(tmp_path / "src.zip")
+    write_source(src_path)
+    for raw in [True, False]:
+        monkeypatch.setattr(compat, "HAS_RAW_ZIP", raw)
+        out_path = str(tmp_path / f"out-{raw}.zip")
+        with zipfile.ZipFile(src_path) as src_zf, zipfile.ZipFile(out_path, "w") as out_zf:
+            compat.copy_raw(src_zf, out_zf, "a.xml")
+            compat.copy_raw(src_zf, out_zf, "b.bin", new_name="c.bin")
+            out_zf.writestr(compat.new_zip_info(out_zf, "d.xml"), b"<d/>")
+        with zipfile.ZipFile(src_path) as src_zf, zipfile.ZipFile(out_path) as out_zf:
+            assert out_zf.testzip() is None
+            assert out_zf.namelist() == ["a.xml", "c.bin", "d.xml"]
+            assert out_zf.read("a.xml") == src_zf.read("a.xml")
+            assert out_zf.read("c.bin") == src_zf.read("b.bin")
+            assert out_zf.getinfo("a.xml").compress_type == zipfile.ZIP_DEFLATED
+            assert out_zf.getinfo("c.bin").compress_type == zipfile.ZIP_STORED
@@ -0,0 +1,88 @@
+import sqlite3
+
+from axle import database
+
+
+def test_update_formats_only_writes_changed_cells(tmp_path):
+    path = str(tmp_path / database.DB_NAME)
+    database.update_formats(
+        path,
+        {
+            "foo": [
+                ("A1:B2", 1, 1, 2, 2, 1),
+                ("B2", 2, 2, 2, 2, 2),
+                ("x!", None, None, None, None, 3),
+            ],
+            "bar": [("A1", 1, 1, 1, 1, 1)],
+        },
+    )
+    with sqlite3.connect(path) as conn:
+        assert conn.execute("PRAGMA user_version").fetchone()[0] == database.SCHEMA_VERSION
+        rowids = dict(conn.execute("SELECT cell, rowid FROM format"))
+
+    # Change one format, remove one, and add one - the other rows are not rewritten
+    changed = database.update_formats(
+        path,
+        {
+            "foo": [
+                ("A1:B2", 1, 1, 2, 2, 4),
+                ("x!", None, None, None, None, 3),
+                ("C3", 3, 3, 3, 3, 1),
+            ]
+        },
+        sheet_titles=["foo"],
+    )
+    assert changed
+    assert database.get_formats(path) == {
+        "foo": {"A1:B2": 4, "x!": 3, "C3": 1},
+        "bar": {"A1": 1},
+    }
+    with sqlite3.connect(path) as conn:
+        new_rowids = dict(conn.execute("SELECT cell, rowid FROM format"))
+    assert new_rowids["A1:B2"] == rowids["A1:B2"]
+    assert new_rowids["x!"] == rowids["x!"]
+    assert new_rowids["A1"] == rowids["A1"]
+    assert not database.update_formats(path, {"bar": [("A1", 1, 1, 1, 1, 1)]}, sheet_titles=["bar"])
+
+    # Later formats are applied over earlier ones, so a new order replaces the sheet
+    database.update_formats(
+        path,
+        {"foo": [("C3", 3, 3, 3, 3, 1), ("A1:B2", 1, 1, 2, 2, 4)]},
+        sheet_titles=["foo"],
+    )
+    assert list(database.get_formats(path, sheet_titles=["foo"])["foo"]) == ["C3", "A1:B2"]
+
+
+def test_get_formats_and_notes_in_area(tmp_path):
+    path = str(tmp_path / database.DB_NAME)
+    formats = [("A1:B2", 1, 1, 2, 2, 1), ("D4", 4, 4, 4, 4, 2), ("x!", None, None, None, None, 3)]
+    database.update_formats(path, {"foo": formats})
+    database.update_notes(path, {"foo": [("A1", 1, 1, "a", "x"), ("D4", 4, 4, "b", "y")]})
+    assert database.get_formats(path, area=(2, 2, None, None)) == {"foo": {"A1:B2": 1, "D4": 2}}
+    assert database.get_formats(path, area=(3, None, None, 3)) == {}
+    assert database.get_notes(path, area=(None, 2, None, None)) == {
+        "foo": {"D4": {"text": "b", "author": "y"}}
+    }
+    database.remove_notes(path, {"foo": [("D4", 4, 4)]})
+    assert database.get_notes(path) == {"foo": {"A1": {"text": "a", "author": "x"}}}
+
+
+def test_connect_updates_version_1_database(tmp_path):
+    path = str(tmp_path / database.DB_NAME)
+    with sqlite3.connect(path) as conn:
+        conn.executescript(
+            """
+            CREATE TABLE format (
+                sheet TEXT NOT NULL, cell TEXT NOT NULL, row INTEGER, col INTEGER,
+                last_row INTEGER, last_col INTEGER, format_id INTEGER NOT NULL
+            );
+            CREATE INDEX format_cell ON format (sheet, row, col);
+            INSERT INTO format VALUES ('foo', 'A1', 1, 1, 1, 1, 1);
+            INSERT INTO format VALUES ('foo', 'a1', 1, 1, 1, 1, 2);
+            """
+        )
+    assert database.get_formats(path) == {"foo": {"a1": 2}}
+    with sqlite3.connect(path) as conn:
+        assert conn.execute("PRAGMA user_version").fetchone()[0] == database.SCHEMA_VERSION
+        indexes = [row[1] for row in conn.execute("PRAGMA index_list(format)")]
+    assert indexes == ["format_key"]
@@ -0,0 +1,159 @@
+import logging
+import os
+
+import pytest
+
+from openpyxl import load_workbook
+from axle.add import add
+from axle.exceptions import MergeError
+from axle.fetch import fetch
+from axle.helpers import get_base_path
+from axle.init import init
+from axle.merge import merge, merge_three_way
+from axle.push import push
+
+BASE = "id\tlabel\n1\tfoo\n2\tbar\n3\tbaz\n"
+
+
+def write_tables(tmp_path, local, remote, base=BASE, local_name="local.tsv"):
+    """Write the base, local, and remote (cached) versions of a table. Return their paths."""
+    paths = []
+    for name, content in [("base.tsv", base), (local_name, local), ("remote.tsv", remote)]:
+        path = tmp_path / name
+        path.write_text(content)
+        paths.append(str(path))
+    return paths
+
+
+def test_merge_by_position(tmp_path):
+    base_path, local_path, remote_path = write_tables(
+        tmp_path,
+        "id\tlabel\n1\tFOO\n2\tbar\n3\tbaz\n",
+        "id\tlabel\n1\tfoo\n2\tbar\n3\tBAZ\n4\tqux\n",
+    )
+    assert merge_three_way(base_path, local_path, remote_path) == []
+    assert open(local_path).read() == "id\tlabel\n1\tFOO\n2\tbar\n3\tBAZ\n4\tqux\n"
+
+
+def test_merge_by_position_conflict_keeps_local_row(tmp_path):
+    base_path, local_path, remote_path = write_tables(
+        tmp_path,
+        "id\tlabel\n1\tlocal\n2\tbar\n3\tbaz\n",
+        "id\tlabel\n1\tremote\n2\tBAR\n3\tbaz\n",
+    )
+    assert merge_three_way(base_path, local_path, remote_path) == ["row 2 changed in both versions"]
+    assert open(local_path).read() == "id\tlabel\n1\tlocal\n2\tBAR\n3\tbaz\n"
+
+
+def test_merge_by_key(tmp_path):
+    # Rows were reordered in the spreadsheet and a row was added to each version
+    base_path, local_path, remote_path = write_tables(
+        tmp_path,
+        "id\tlabel\n1\tfoo\n2\tBAR\n3\tbaz\n4\tlocal\n",
+        "id\tlabel\n3\tBAZ\n1\tfoo\n2\tbar\n5\tremote\n",
+    )
+    assert merge_three_way(base_path, local_path, remote_path, key="id") == []
+    assert open(local_path).read() == "id\tlabel\n1\tfoo\n2\tBAR\n3\tBAZ\n4\tlocal\n5\tremote\n"
+
+
+def test_merge_by_key_conflict(tmp_path):
+    base_path, local_path, remote_path = write_tables(
+        tmp_path,
+        "id\tlabel\n1\tlocal\n2\tbar\n3\tbaz\n",
+        "id\tlabel\n1\tremote\n2\tbar\n3\tbaz\n",
+    )
+    assert merge_three_way(base_path, local_path, remote_path, key="id") == [
+        "row with id '1' changed in both versions"
+    ]
+    assert open(local_path).read() == "id\tlabel\n1\tlocal\n2\tbar\n3\tbaz\n"
+
+
+def test_merge_deleted_rows(tmp_path):
+    # Row 2 was deleted locally and row 3 was deleted in the spreadsheet
+    base_path, local_path, remote_path = write_tables(
+        tmp_path,
+        "id\tlabel\n1\tfoo\n3\tbaz\n",
+        "id\tlabel\n1\tfoo\n2\tbar\n",
+    )
+    assert merge_three_way(base_path, local_path, remote_path, key="id") == []
+    assert open(local_path).read() == "id\tlabel\n1\tfoo\n"
+
+    # A row that was deleted locally but changed in the spreadsheet is a conflict, and is not added
+    base_path, local_path, remote_path = write_tables(
+        tmp_path,
+        "id\tlabel\n1\tfoo\n3\tbaz\n",
+        "id\tlabel\n1\tfoo\n2\tBAR\n3\tbaz\n",
+    )
+    assert merge_three_way(base_path, local_path, remote_path, key="id") == [
+        "row with id '2' was removed locally and changed remotely"
+    ]
+    assert open(local_path).read() == "id\tlabel\n1\tfoo\n3\tbaz\n"
+
+    # By position, the last row was deleted in the spreadsheet
+    base_path, local_path, remote_path = write_tables(
+        tmp_path,
+        BASE,
+        "id\tlabel\n1\tfoo\n2\tbar\n",
+    )
+    assert merge_three_way(base_path, local_path, remote_path) == []
+    assert open(local_path).read() == "id\tlabel\n1\tfoo\n2\tbar\n"
+
+
+def test_merge_csv(tmp_path):
+    base_path, local_path, remote_path = write_tables(
+        tmp_path,
+        "id,label\n1,FOO\n2,bar\n3,baz\n",
+        "id\tlabel\n1\tfoo\n2\tBAR\n3\tbaz\n",
+        local_name="local.csv",
+    )
+    assert merge_three_way(base_path, local_path, remote_path) == []
+    assert open(local_path).read() == "id,label\n1,FOO\n2,BAR\n3,baz\n"
+
+
+def test_merge_duplicate_key(tmp_path):
+    local = "id\tlabel\n1\tfoo\n1\tbar\n3\tbaz\n"
+    base_path, local_path, remote_path = write_tables(tmp_path, local, BASE)
+    with pytest.raises(MergeError, match="More than one row in the local table"):
+        merge_three_way(base_path, local_path, remote_path, key="id")
+    with pytest.raises(MergeError, match="Key column 'name' does not exist"):
+        merge_three_way(base_path, local_path, remote_path, key="name")
+    # The local table and the temporary file are left as they were
+    assert open(local_path).read() == local
+    assert not os.path.exists(local_path + ".tmp")
+
+
+def edit_spreadsheet(path, cell, value):
+    """Change the value of a cell in the only sheet of a spreadsheet."""
+    wb = load_workbook(path)
+    wb.active[cell] = value
+    wb.save(path)
+
+
+def test_merge_with_base(tmp_path, monkeypatch, caplog):
+    monkeypatch.chdir(tmp_path)
+    init("Test")
+    (tmp_path / "foo.tsv").write_text(BASE)
+    add("foo.tsv")
+    push()
+    base_path = get_base_path(os.path.join(tmp_path, ".axle"), "foo")
+
+    # Without a base, the cached copy is the base if it has not changed since the push
+    assert not os.path.exists(base_path)
+    (tmp_path / "foo.tsv").write_text("id\tlabel\n1\tFOO\n2\tbar\n3\tbaz\n")
+    assert merge(three_way=True) == {}
+    assert (tmp_path / "foo.tsv").read_text() == "id\tlabel\n1\tFOO\n2\tbar\n3\tbaz\n"
+
+    # fetch keeps the last pushed version as the base when the spreadsheet changed
+    edit_spreadsheet("Test.xlsx", "B3", "BAR")
+    fetch()
+    assert open(base_path).read() == BASE
+    assert merge(three_way=True) == {}
+    assert (tmp_path / "foo.tsv").read_text() == "id\tlabel\n1\tFOO\n2\tBAR\n3\tbaz\n"
+
+    # A sheet that changed since the push cannot be merged without a base
+    os.remove(base_path)
+    (tmp_path / "foo.tsv").write_text(BASE)
+    with caplog.at_level(logging.WARNING):
+        assert merge(three_way=True) == {}
+    assert "'foo' has not been pushed" in caplog.text
+    assert (tmp_path / "foo.tsv").read_text() == BASE
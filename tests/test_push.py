@@ -0,0 +1,156 @@
+import os
+
+import pytest
+
+from openpyxl import load_workbook
+from axle import push as push_module
+from axle.add import add
+from axle.apply import apply
+from axle.fetch import fetch
+from axle.helpers import (
+    get_cached_path,
+    get_format_dict,
+    get_sheet_formats,
+    get_sheet_notes,
+    get_tracked_sheets,
+    iter_row_entries,
+)
+from axle.init import init
+from axle.push import push
+
+# The "mixed" column is numbers until its last row, so its type depends on every batch of rows.
+# The values of the "text" column are written as numbers or booleans by Excel, but would not be
+# fetched as the same text.
+TYPED_TABLE = (
+    "id\tmixed\tflag\ttext\n"
+    "1\t10\tTRUE\t007\n"
+    "2\t2.5\tFALSE\t1.50\n"
+    "3\t-3\t\t-0\n"
+    "4\t\tTRUE\t1e5\n"
+    "5\tfoo\tFALSE\tTRUE\n"
+)
+
+
+def get_values(path):
+    """Return the values of each sheet of a spreadsheet."""
+    wb = load_workbook(path)
+    return {ws.title: [[c.value for c in row] for row in ws.iter_rows()] for ws in wb}
+
+
+def get_cell_formats(axle_dir):
+    """Return the format of each formatted cell of the big table, row by row."""
+    id_to_format = get_format_dict(axle_dir)
+    return [
+        {col: id_to_format[fmt_id] for col, fmt_id in row.items()}
+        for row in iter_row_entries(get_sheet_formats(axle_dir)["big"])
+    ]
+
+
+@pytest.fixture
+def project(tmp_path, monkeypatch):
+    """Create a project with a table, and return the path to its AXLE directory."""
+    monkeypatch.chdir(tmp_path)
+    init("Test")
+    (tmp_path / "foo.tsv").write_text(TYPED_TABLE)
+    add("foo.tsv")
+    return os.path.join(tmp_path, ".axle")
+
+
+def test_typed_push_with_and_without_streaming(project, monkeypatch):
+    # Find the column types in batches of two rows when streaming
+    monkeypatch.setattr(push_module, "TYPE_BATCH_SIZE", 2)
+    push(typed=True)
+    values = get_values("Test.xlsx")
+    push(streaming=True, full=True, typed=True)
+    assert get_values("Test.xlsx") == values
+    assert values["foo"] == [
+        ["id", "mixed", "flag", "text"],
+        [1, "10", True, "007"],
+        [2, "2.5", False, "1.50"],
+        [3, "-3", None, "-0"],
+        [4, None, True, "1e5"],
+        [5, "foo", False, "TRUE"],
+    ]
+
+
+@pytest.mark.parametrize("streaming", [False, True])
+def test_fetch_typed_values(project, streaming):
+    push(streaming=streaming, typed=True)
+    # Save the spreadsheet again so that fetch reads it and replaces the cached copy
+    load_workbook("Test.xlsx").save("Test.xlsx")
+    cached_path = get_cached_path(project, "foo")
+    os.remove(cached_path)
+    fetch(streaming=streaming)
+    with open(cached_path) as f:
+        assert f.read() == TYPED_TABLE
+
+
+@pytest.mark.parametrize("streaming", [False, True])
+def test_push_and_fetch_shards(tmp_path, monkeypatch, streaming):
+    monkeypatch.chdir(tmp_path)
+    init("Test")
+    table = "id\tlabel\n" + "".join(f"ID:{i}\tv{i}\n" for i in range(1, 26))
+    (tmp_path / "big.tsv").write_text(table)
+    add("big.tsv")
+    # Messages on the header and on a cell in each shard
+    (tmp_path / "messages.tsv").write_text(
+        "table\tcell\tlevel\trule\tmessage\n"
+        "big\tA1\tinfo\thead\theader\n"
+        "big\tB7\terror\tbad\tsix\n"
+        "big\tB15\twarn\tmeh\tfourteen\n"
+        "big\tB26\tinfo\tfyi\ttwenty-five\n"
+    )
+    apply(["messages.tsv"])
+    axle_dir = os.path.join(tmp_path, ".axle")
+    # Push and fetch the table without shards first, so that the formats and notes are stored the
+    # way fetch stores them
+    push(streaming=streaming)
+    load_workbook("Test.xlsx").save("Test.xlsx")
+    fetch(streaming=streaming)
+    formats = get_cell_formats(axle_dir)
+    notes = get_sheet_notes(axle_dir)
+
+    # 25 rows after the header are split into shards of 10 rows, each starting with the header
+    push(streaming=streaming, shard_rows=10)
+    assert get_tracked_sheets(axle_dir)["big"]["Shards"] == "3"
+    wb = load_workbook("Test.xlsx")
+    assert wb.sheetnames == ["big (1)", "big (2)", "big (3)"]
+    for ws, first, last in zip(wb, [1, 11, 21], [10, 20, 25]):
+        values = [[c.value for c in row] for row in ws.iter_rows()]
+        assert values == [["id", "label"]] + [[f"ID:{i}", f"v{i}"] for i in range(first, last + 1)]
+        assert ws["A1"].has_style
+        assert ws["A1"].comment.text == notes["big"]["A1"]["text"]
+    # The formats and notes of the cells are moved to their rows in each shard
+    for title, cell, value, table_cell in [
+        ("big (1)", "B7", "v6", "B7"),
+        ("big (2)", "B5", "v14", "B15"),
+        ("big (3)", "B6", "v25", "B26"),
+    ]:
+        assert wb[title][cell].value == value
+        assert wb[title][cell].comment.text == notes["big"][table_cell]["text"]
+    styled = [
+        (ws.title, c.coordinate) for ws in wb for row in ws.iter_rows() for c in row if c.has_style
+    ]
+    assert styled == [
+        ("big (1)", "A1"),
+        ("big (1)", "B7"),
+        ("big (2)", "A1"),
+        ("big (2)", "B5"),
+        ("big (3)", "A1"),
+        ("big (3)", "B6"),
+    ]
+
+    # fetch joins the shards back into the table, with the formats and notes in the same cells
+    load_workbook("Test.xlsx").save("Test.xlsx")
+    cached_path = get_cached_path(axle_dir, "big")
+    os.remove(cached_path)
+    fetch(streaming=streaming)
+    with open(cached_path) as f:
+        assert f.read() == table
+    assert get_sheet_notes(axle_dir) == notes
+    assert get_cell_formats(axle_dir) == formats
+
+    # Without shard rows, the table is pushed to one sheet again
+    push(streaming=streaming)
+    assert load_workbook("Test.xlsx").sheetnames == ["big"]
+    assert get_tracked_sheets(axle_dir)["big"]["Shards"] == ""
@@ -0,0 +1,78 @@
+import io
+import xml.etree.ElementTree as ET
+import zipfile
+
+from openpyxl import Workbook, load_workbook
+from openpyxl.styles import Font
+from axle.xlsx import patch_sheets
+
+# The stylesheet of a new workbook saved by Excel: the prefixes in mc:Ignorable are declared on the
+# root element, but x16r2 is not used by any element
+EXCEL_STYLES = b"""<?xml version="1.0" encoding="UTF-8" standalone="yes"?>
+<styleSheet xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main" \
+xmlns:mc="http://schemas.openxmlformats.org/markup-compatibility/2006" mc:Ignorable="x14ac x16r2" \
+xmlns:x14ac="http://schemas.microsoft.com/office/spreadsheetml/2009/9/ac" \
+xmlns:x16r2="http://schemas.microsoft.com/office/spreadsheetml/2015/02/main">\
+<fonts count="1" x14ac:knownFonts="1"><font><sz val="11"/><color theme="1"/>\
+<name val="Calibri"/><family val="2"/><scheme val="minor"/></font></fonts>\
+<fills count="2"><fill><patternFill patternType="none"/></fill>\
+<fill><patternFill patternType="gray125"/></fill></fills>\
+<borders count="1"><border><left/><right/><top/><bottom/><diagonal/></border></borders>\
+<cellStyleXfs count="1"><xf numFmtId="0" fontId="0" fillId="0" borderId="0"/></cellStyleXfs>\
+<cellXfs count="1"><xf numFmtId="0" fontId="0" fillId="0" borderId="0" xfId="0"/></cellXfs>\
+<cellStyles count="1"><cellStyle name="Normal" xfId="0" builtinId="0"/></cellStyles>\
+<dxfs count="0"/><tableStyles count="0" defaultTableStyle="TableStyleMedium2" \
+defaultPivotStyle="PivotStyleLight16"/><extLst>\
+<ext uri="{EB79DEF2-80B8-43e5-95BD-54CBDDF9020C}" \
+xmlns:x14="http://schemas.microsoft.com/office/spreadsheetml/2009/9/main">\
+<x14:slicerStyles defaultSlicerStyle="SlicerStyleLight1"/></ext></extLst></styleSheet>"""
+
+
+def save_excel_workbook(path):
+    """Save a workbook with one sheet, with the stylesheet that Excel writes."""
+    wb = Workbook()
+    wb.active.title = "foo"
+    wb.active["A1"] = "bar"
+    buffer = io.BytesIO()
+    wb.save(buffer)
+    with zipfile.ZipFile(buffer) as zin, zipfile.ZipFile(path, "w") as zout:
+        for name in zin.namelist():
+            data = EXCEL_STYLES if name == "xl/styles.xml" else zin.read(name)
+            zout.writestr(name, data)
+
+
+def get_bold_styles():
+    """Return a stylesheet with a bold cell style, and the index of the style."""
+    wb = Workbook()
+    cell = wb.active["A1"]
+    cell.font = Font(bold=True)
+    buffer = io.BytesIO()
+    wb.save(buffer)
+    with zipfile.ZipFile(buffer) as zf:
+        return ET.fromstring(zf.read("xl/styles.xml")), cell.style_id
+
+
+def test_patch_sheets_keeps_excel_namespaces(tmp_path):
+    path = str(tmp_path / "excel.xlsx")
+    out_path = str(tmp_path / "patched.xlsx")
+    save_excel_workbook(path)
+    styles_root, style = get_bold_styles()
+    patch_sheets(out_path, path, styles_root, {"foo": ({(1, 1): style}, None)})
+
+    with zipfile.ZipFile(out_path) as zf:
+        styles = zf.read("xl/styles.xml")
+    root_start = styles[: styles.index(b">", styles.index(b"<styleSheet")) + 1]
+    assert b'mc:Ignorable="x14ac x16r2"' in root_start
+    assert b'xmlns:x14ac="http://schemas.microsoft.com/office/spreadsheetml/2009/9/ac"' in (
+        root_start
+    )
+    assert b'xmlns:x16r2="http://schemas.microsoft.com/office/spreadsheetml/2015/02/main"' in (
+        root_start
+    )
+    assert b'x14ac:knownFonts="1"' in styles
+    assert b"<x14:slicerStyles" in styles
+    assert b"ns0:" not in styles and b"ns1:" not in styles
+
+    # The stylesheet is still valid and the new style is used by the patched cell
+    ET.fromstring(styles)
+    assert load_workbook(out_path)["foo"]["A1"].font.b